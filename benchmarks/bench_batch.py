@@ -0,0 +1,49 @@
+"""Compare running scripts with `turtle -c` against `sh -c`, for a few common script patterns.
+
+Every run starts a fresh process, so the times include interpreter startup (and, for turtle,
+loading the cached parser tables).
+
+Usage: python benchmarks/bench_batch.py [N_RUNS]
+"""
+
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+PATTERNS = {
+    "startup": ("print hi", "echo hi"),
+    "10k loop iterations": (
+        "x = 1; for (i = 1; $i < 10000; i += 1) { x += $i }; print $x",
+        "x=1; i=1; while [ $i -lt 10000 ]; do x=$((x + i)); i=$((i + 1)); done; echo $x",
+    ),
+    "50 external commands": (
+        "foreach i in seq 1 50 { true }",
+        "for i in $(seq 1 50); do true; done",
+    ),
+    "pipeline": ("seq 1 100000 | wc -l", "seq 1 100000 | wc -l"),
+}
+
+
+def run(argv: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sh = shutil.which("sh")
+    turtle = [sys.executable, "-m", "turtleshell.main", "-c"]
+    run([*turtle, "print warmup"])  # Make sure the parser tables are cached
+
+    print(f"{'pattern':<24}{'turtle':>12}{'sh':>12}")
+    for label, (turtle_script, sh_script) in PATTERNS.items():
+        turtle_time = statistics.median(run([*turtle, turtle_script]) for _ in range(n))
+        sh_time = statistics.median(run([sh, "-c", sh_script]) for _ in range(n))
+        print(f"{label:<24}{turtle_time * 1000:>10.1f}ms{sh_time * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Measure the cost of dispatching to a builtin, by running `print` many times.
+
+Compares the registry's shared instances against constructing a new builtin (and its argument
+parser) for every call, which is how builtins used to be run.
+
+Usage: python benchmarks/bench_builtins.py [N_CALLS]
+"""
+
+import io
+import sys
+import time
+
+from turtleshell import streams
+from turtleshell.builtins import get_builtin
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    env = EnvironmentVarHolder()
+    command = parser.parse('print "hello"').children[0]
+    cmd = get_builtin("print")
+
+    with streams.redirect_stdout(io.BytesIO()):
+        start = time.perf_counter()
+        for _ in range(n):
+            type(cmd)().run("hello", env=env)
+        per_call = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(n):
+            cmd.run("hello", env=env)
+        registry = time.perf_counter() - start
+
+        run = command.compiled()
+        start = time.perf_counter()
+        for _ in range(n):
+            run(env)
+        compiled = time.perf_counter() - start
+
+    print(f"{n:,} calls to print")
+    print(f"  new instance per call: {per_call / n * 1e6:6.2f} us/call")
+    print(f"     registry singleton: {registry / n * 1e6:6.2f} us/call")
+    print(f"  compiled `print` node: {compiled / n * 1e6:6.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
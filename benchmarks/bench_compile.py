@@ -0,0 +1,47 @@
+"""Compare the tree-walking evaluator (`Token.eval`) against compiled closures
+(`Token.compiled()`) on a loop with a million iterations.
+
+Usage: python benchmarks/bench_compile.py [N_ITERATIONS]
+"""
+
+import sys
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+SCRIPT = """
+total = 1;
+for (i = 1; $i <= {n}; i += 1) {{
+    if ($i == 3) {{ total += 2 }} else {{ total += 1 }};
+    last = $i
+}}
+"""
+
+
+def run(n: int, compiled: bool) -> float:
+    env = EnvironmentVarHolder()
+    statements = parser.parse(SCRIPT.format(n=n)).children
+    start = time.perf_counter()
+    for statement in statements:
+        if compiled:
+            statement.compiled()(env)
+        else:
+            statement.eval(env)
+    elapsed = time.perf_counter() - start
+    assert env["total"] == n + 2
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tree_walking = run(n, compiled=False)
+    compiled = run(n, compiled=True)
+    print(f"{n:,} iterations")
+    print(f"tree-walking: {tree_walking:6.2f} s  ({tree_walking / n * 1e9:,.0f} ns/iter)")
+    print(f"    compiled: {compiled:6.2f} s  ({compiled / n * 1e9:,.0f} ns/iter)")
+    print(f"     speedup: {tree_walking / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure tab-completion latency with N_BINARIES executables on the PATH.
+
+Fills a temporary directory with N_BINARIES executables, puts it on the PATH, and times completing
+command names (every one- and two-letter prefix, plus some longer ones) and paths inside that
+directory. Exits with an error if the 99th percentile is over LIMIT_MS.
+
+Usage: python benchmarks/bench_completion.py [N_BINARIES] [LIMIT_MS]
+"""
+
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+
+from turtleshell.completion import CompletionEngine
+from turtleshell.util import get_os_path
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def make_names(n: int) -> list[str]:
+    rng = random.Random(0)
+    names: set[str] = set()
+    while len(names) < n:
+        length = rng.randint(2, 14)
+        names.add("".join(rng.choice(string.ascii_lowercase + "-_") for _ in range(length)))
+    return sorted(names)
+
+
+def timed(engine: CompletionEngine, texts: list[str]) -> list[float]:
+    times = []
+    for text in texts:
+        start = time.perf_counter()
+        engine.complete(text)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarise(label: str, times: list[float]) -> float:
+    times = sorted(times)
+    p99 = times[int(len(times) * 0.99)]
+    print(
+        f"{label:<10} {len(times):>6} completions  p50 {statistics.median(times) * 1000:6.3f} ms"
+        f"  p99 {p99 * 1000:6.3f} ms  max {times[-1] * 1000:6.3f} ms"
+    )
+    return p99
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    names = make_names(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            fd = os.open(os.path.join(tmp, name), os.O_WRONLY | os.O_CREAT, 0o755)
+            os.close(fd)
+
+        env = EnvironmentVarHolder()
+        env["PATH"] = [tmp, *get_os_path()]
+        engine = CompletionEngine(env)
+        start = time.perf_counter()
+        engine.start()
+        engine.commands.indexed.wait()
+        print(
+            f"indexed {len(engine.commands.trie):,} commands in {time.perf_counter() - start:.2f} s"
+        )
+
+        letters = string.ascii_lowercase
+        prefixes = ["", *letters, *(a + b for a in letters for b in letters)]
+        prefixes += [name[:4] for name in random.Random(1).sample(names, 1000)]
+        commands = timed(engine, [f"ls | {prefix}" for prefix in prefixes])
+        # The first path completion lists the directory; after that, it comes from the cache
+        paths = timed(engine, [f"cat {tmp}/{prefix}" for prefix in prefixes])
+
+    worst = max(summarise("commands", commands), summarise("paths", paths))
+    if worst * 1000 > limit:
+        print(f"FAIL: p99 is over {limit} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Compare command lookup latency between the hashed executable cache and a linear PATH scan.
+
+Usage: python benchmarks/bench_executables.py [N_LOOKUPS]
+"""
+
+import sys
+import timeit
+from pathlib import Path
+
+from turtleshell.executables import ExecutableCache
+from turtleshell.util import get_os_path, is_executable
+
+COMMANDS = ["ls", "cat", "grep", "true", "sh"]
+
+
+def linear_scan(name: str, path: list[str]) -> Path | None:
+    """How `EnvironmentVarHolder.get_executable` used to find commands."""
+    for directory in path:
+        directory = Path(directory)
+        if not directory.exists():
+            continue
+        for item in directory.iterdir():
+            if item.stem == name and is_executable(item):
+                return item
+    return None
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    path = get_os_path()
+    cache = ExecutableCache()
+
+    for name in COMMANDS:
+        scan = timeit.timeit(lambda: linear_scan(name, path), number=n) / n
+        cached = timeit.timeit(lambda: cache.lookup(name, path), number=n) / n
+        print(
+            f"{name:>6}: linear {scan * 1e6:10.1f} us   hashed {cached * 1e6:8.2f} us"
+            f"   ({scan / cached:,.0f}x)"
+        )
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
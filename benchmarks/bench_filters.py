@@ -0,0 +1,92 @@
+"""Compare the in-process filters (`grep`, `wc`, etc.) with the programs they stand in for.
+
+Writes SIZE_MB of text to a temporary file, then times pipelines which read it (like
+`cat FILE | grep ...`) with BUILTINFILTERS on and off, throwing the output away. `sort` reads
+everything into memory, so it gets a sixteenth of the file. Finally, a lot of small pipelines are timed, where
+not starting a program for each one matters most.
+
+The file is piped in, since filters given a large file by name leave it to the real program.
+
+Usage: python benchmarks/bench_filters.py [SIZE_MB]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.pipeline import PipelineRun
+from turtleshell.variables import EnvironmentVarHolder
+
+PIPELINES = [
+    "grep -c error",
+    "grep -v -i warn",
+    'grep -E "^(error|fatal)"',
+    "wc",
+    "wc -l",
+    'cut -d " " -f 2',
+    "head -n 1000000",
+    "uniq -c",
+]
+SORTS = ["sort", "sort -n", "sort -u"]
+
+# How many small pipelines to run
+N_SMALL = 500
+
+WORDS = ["info", "debug", "warn", "WARN", "error", "fatal", "request", "user", "disk", "cache"]
+
+
+def write_input(f, size: int):
+    rng = random.Random(0)
+    lines = [
+        f"{rng.randrange(100_000)} {rng.choice(WORDS)} {' '.join(rng.choices(WORDS, k=6))}\n"
+        for _ in range(20_000)
+    ]
+    block = "".join(lines).encode()
+    for _ in range(size // len(block)):
+        f.write(block)
+    f.write(block[: size % len(block)].rpartition(b"\n")[0] + b"\n")
+    f.flush()
+
+
+def run(text: str, env: EnvironmentVarHolder, stdout: int):
+    statement = parser.parse(text).children[0]
+    PipelineRun(statement.get_stages(env), stdout=os.dup(stdout)).start().wait()
+
+
+def compare(label: str, text: str, n: int, stdout: int, size: int = 0):
+    timings = []
+    for enabled in (True, False):
+        env = EnvironmentVarHolder()
+        env["BUILTINFILTERS"] = enabled
+        start = time.perf_counter()
+        for _ in range(n):
+            run(text, env, stdout)
+        timings.append(time.perf_counter() - start)
+    builtin, external = timings
+    rate = f"{size / 1e6 / builtin:7.0f} MB/s" if size else f"{builtin / n * 1e6:7.0f} µs each"
+    print(f"{label:<26} {builtin:8.2f} s {external:8.2f} s {external / builtin:6.2f}x  ({rate})")
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 1024 * 1024 * 1024
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    with (
+        tempfile.NamedTemporaryFile(suffix=".txt") as big,
+        tempfile.NamedTemporaryFile(suffix=".txt") as small,
+    ):
+        write_input(big, size)
+        write_input(small, size // 16)
+        print(f"{'':<26} {'in-process':>10} {'external':>10}")
+        for command in PIPELINES:
+            compare(command, f"cat {big.name} | {command}", 1, devnull, size)
+        for command in SORTS:
+            compare(command, f"cat {small.name} | {command}", 1, devnull, size // 16)
+        compare("print x | grep x", "print x | grep x", N_SMALL, devnull)
+        compare("print x | wc -l", "print x | wc -l", N_SMALL, devnull)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Measure the history database with a lot of entries in it.
+
+Fills a temporary history with N_ENTRIES commands, then times loading the first screen of history
+for the prompt, recording a command, and a prefix search (as used for suggestions).
+
+Usage: python benchmarks/bench_history.py [N_ENTRIES]
+"""
+
+import itertools
+import pathlib
+import sys
+import tempfile
+import time
+
+from turtleshell.history import SQLiteHistory
+
+WORDS = ["git", "ls", "cd", "grep", "make", "python", "docker", "ssh", "vim", "cat"]
+
+
+def timed(label: str, func, n: int = 100):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    print(f"{label:<24} {(time.perf_counter() - start) / n * 1000:8.3f} ms")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "history.sqlite"
+        history = SQLiteHistory(path)
+        start = time.perf_counter()
+        with history.connection as connection:
+            connection.executemany(
+                "INSERT INTO commands (command, last_run) VALUES (?, ?)",
+                ((f"{WORDS[i % len(WORDS)]} --arg {i}", i) for i in range(n)),
+            )
+        print(f"{'fill ' + format(n, ','):<24} {time.perf_counter() - start:8.3f} s")
+
+        def first_screen():
+            fresh = SQLiteHistory(path)
+            list(itertools.islice(fresh.load_history_strings(), 100))
+            fresh.close()
+
+        counter = itertools.count()
+        timed("open + first 100", first_screen)
+        timed("record", lambda: history.record(f"echo {next(counter)}", 0, 0.01))
+        timed("search_prefix('gre')", lambda: history.search_prefix("gre"))
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
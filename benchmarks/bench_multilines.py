@@ -0,0 +1,50 @@
+"""Measure how long it takes to read a long script pasted into the prompt.
+
+The script is one big block, so the shell has to keep asking for continuation lines until the last
+one. After every line it checks whether the input is complete, then joins all the lines together at
+the end, just like `main.main` does.
+
+Usage: python benchmarks/bench_multilines.py [N_LINES]
+"""
+
+import sys
+import time
+
+from turtleshell.multilines import LineLexer, concatenate_incomplete_lines
+
+
+def make_script(n: int) -> list[str]:
+    body = [
+        '    print "line {i} has a {{ in a string";',
+        "    x = $(print $(print {i}));  # comment with an unmatched (",
+        "    y = [{i}, {i}];",
+        "    print \\",
+        "        continued {i};",
+    ]
+    lines = ["foreach i in $(seq 1 10) {"]
+    while len(lines) < n - 1:
+        lines.append(body[len(lines) % len(body)].format(i=len(lines)))
+    return lines + ["}"]
+
+
+def paste(lines: list[str]) -> str:
+    lexer = LineLexer()
+    for line in lines:
+        lexer.feed(line.rstrip())
+    assert lexer.complete
+    return concatenate_incomplete_lines(lines)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    lines = make_script(n)
+    runs = 20
+    start = time.perf_counter()
+    for _ in range(runs):
+        paste(lines)
+    elapsed = (time.perf_counter() - start) / runs
+    print(f"paste {n:,} lines: {elapsed * 1000:.2f} ms ({elapsed / n * 1e6:.2f} µs/line)")
+
+
+if __name__ == "__main__":
+    main()
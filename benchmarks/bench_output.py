@@ -0,0 +1,54 @@
+"""Measure the cost of writing lots of small lines of output.
+
+Compares `print` with `streams.write` for N_LINES lines, and times a turtle loop which prints each
+line through the `print` builtin. Output goes to /dev/null, so nothing is line-buffered.
+
+Usage: python benchmarks/bench_output.py [N_LINES]
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+from turtleshell import streams
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    env = EnvironmentVarHolder()
+    loop = parser.parse(f"for (i = 1; $i < {n // 10}; i += 1) {{ print $i }}").children[0]
+
+    def with_print():
+        for i in range(n):
+            print(i)
+
+    def with_streams():
+        for i in range(n):
+            streams.write(f"{i}\n")
+        streams.flush()
+
+    def with_loop():
+        loop.compiled()(env)
+        streams.flush()
+
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for label, count, func in (
+            ("print", n, with_print),
+            ("streams.write", n, with_streams),
+            ("turtle loop", n // 10, with_loop),
+        ):
+            start = time.perf_counter()
+            func()
+            results.append((label, count, time.perf_counter() - start))
+    for label, count, elapsed in results:
+        print(
+            f"{label:<16} {count:>9,} lines {elapsed * 1000:9.1f} ms ({elapsed / count * 1e9:6.0f} ns/line)"
+        )
+
+
+if __name__ == "__main__":
+    main()
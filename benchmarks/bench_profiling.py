@@ -0,0 +1,51 @@
+"""Measure the cost of profiling, on a loop with N_ITERATIONS iterations.
+
+The loop is run with profiling off (where the only cost is checking whether a profiler is running,
+once per compile) and with it on (where every statement is timed and added to the trace).
+
+Usage: python benchmarks/bench_profiling.py [N_ITERATIONS]
+"""
+
+import sys
+import time
+
+from turtleshell import profiling
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+SCRIPT = """
+total = 1;
+for (i = 1; $i <= {n}; i += 1) {{
+    if ($i == 3) {{ total += 2 }} else {{ total += 1 }};
+    last = $i
+}}
+"""
+
+
+def run(n: int) -> float:
+    env = EnvironmentVarHolder()
+    statements = parser.parse(SCRIPT.format(n=n)).children
+    start = time.perf_counter()
+    for statement in statements:
+        statement.compiled()(env)
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    # Each iteration runs the `if`, an assignment inside it, `last = $i` and `i += 1`
+    statements = 4 * n
+    off = run(n)
+    profiler = profiling.start()
+    try:
+        on = run(n)
+    finally:
+        profiling.stop()
+    print(f"{n:,} iterations")
+    print(f"profiling off {off * 1000:9.1f} ms")
+    print(f"profiling on  {on * 1000:9.1f} ms ({(on - off) / statements * 1e9:,.0f} ns/statement)")
+    print(f"trace events  {len(profiler.events):,} (+{profiler.dropped_events:,} dropped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Measure how long it takes to draw the prompt when it contains a slow `$(...)` segment.
+
+The slow segment sleeps for a second, but the prompt shouldn't wait for it: the time until the
+user can type should stay around `PROMPT_WAIT` (5 ms) however long the segment takes.
+
+Usage: python benchmarks/bench_prompt.py [N_PROMPTS]
+"""
+
+import statistics
+import sys
+import time
+
+import turtleshell.main as shell
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for label, template in (
+        ("variables only", "$USER@$HOST: $CWD $ "),
+        ("slow segment", "$USER@$HOST: $CWD [$(sleep 1)] $ "),
+    ):
+        shell.ENV_VARS["PROMPT1"] = template
+        times = []
+        for _ in range(n):
+            start = time.perf_counter()
+            shell.get_prompt()
+            times.append(time.perf_counter() - start)
+        print(
+            f"{label:<16} median {statistics.median(times) * 1000:7.2f} ms"
+            f"   max {max(times) * 1000:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
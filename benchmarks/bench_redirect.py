@@ -0,0 +1,49 @@
+"""Measure how fast command output can be sent to a file.
+
+Copies a SIZE_MB file with `cat FILE > OUT` (redirected straight to the file), and compares it with
+capturing the output in the shell and writing it out ourselves, and with `shutil.copyfile`.
+
+Usage: python benchmarks/bench_redirect.py [SIZE_MB]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.pipeline import ExternalStage, read_output
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    env = EnvironmentVarHolder()
+    with tempfile.TemporaryDirectory() as tmp:
+        source, out = os.path.join(tmp, "source.bin"), os.path.join(tmp, "out.bin")
+        with open(source, "wb") as f:
+            for _ in range(size):
+                f.write(os.urandom(1024 * 1024))
+        redirect = parser.parse(f"cat {source} > {out}").children[0]
+
+        def with_capture():
+            result = read_output([ExternalStage(["cat", source])], limit=size * 1024 * 1024)
+            with open(out, "wb") as f:
+                for chunk in result.chunks(1024 * 1024):
+                    f.write(chunk)
+
+        for label, func in (
+            ("shutil.copyfile", lambda: shutil.copyfile(source, out)),
+            ("captured", with_capture),
+            ("redirected", lambda: redirect.eval(env)),
+        ):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            assert os.path.getsize(out) == size * 1024 * 1024
+            print(f"{label:<16} {size:>6} MB {elapsed * 1000:9.1f} ms ({size / elapsed:7.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Measure the memory used to capture a large command output and write it back out.
+
+`capture` reads the output the way a command substitution does, keeping it as bytes, and writes it
+out without decoding it. `decode` is what happens when the output is held as one big `bytes` and turned
+into text to be printed: it's decoded and then encoded again. Each mode runs in a fresh interpreter,
+so the peak RSS numbers don't affect each other.
+
+Usage: python benchmarks/bench_result_memory.py [SIZE_MIB]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+def run_mode(mode: str, size: int):
+    from turtleshell.datatypes import CommandResult
+    from turtleshell.pipeline import ExternalStage, read_output
+
+    argv = ["head", "-c", str(size), "/dev/zero"]
+    start = time.perf_counter()
+    with open(os.devnull, "wb") as devnull:
+        if mode == "capture":
+            read_output([ExternalStage(argv)], limit=size).write_to(devnull.write)
+        else:
+            proc = subprocess.run(argv, capture_output=True)
+            devnull.write(str(CommandResult.from_process(proc)).encode("utf-8"))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(f"{mode:<8} {elapsed:8.2f} s   peak RSS {peak:8.0f} MiB")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--mode":
+        run_mode(sys.argv[2], int(sys.argv[3]))
+        return
+    size_mib = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    print(f"Capturing {size_mib} MiB of output")
+    for mode in ("capture", "decode"):
+        subprocess.run(
+            [sys.executable, __file__, "--mode", mode, str(size_mib * 1024 * 1024)], check=True
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measure how long it takes to start external programs, by running `true` N times.
+
+Compares `subprocess.Popen` (what the shell used before), `posix_spawn` and the fork server, with a
+`bash` loop for reference. Pass `--ballast MIB` to grow the shell's memory first: fork gets slower as
+the parent gets bigger, but posix_spawn and the fork server shouldn't.
+
+Usage: python benchmarks/bench_spawn.py [N] [--ballast MIB]
+"""
+
+import argparse
+import shutil
+import subprocess
+import time
+
+from turtleshell.launcher import Launcher
+
+
+def timed(label: str, n: int, func):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {elapsed:7.2f} s  ({elapsed / n * 1e6:6.0f} µs per command)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("n", nargs="?", type=int, default=10_000)
+    arg_parser.add_argument("--ballast", type=int, default=0, metavar="MIB")
+    args = arg_parser.parse_args()
+    true = shutil.which("true")
+    ballast = bytearray(args.ballast * 1024 * 1024)  # noqa: F841 (kept alive on purpose)
+
+    timed("subprocess.Popen", args.n, lambda: subprocess.Popen([true]).wait())
+
+    launcher = Launcher()
+    timed("posix_spawn", args.n, lambda: launcher.spawn([true]).wait())
+    print(f"  {launcher.stats()}")
+
+    launcher = Launcher()
+    launcher.start_fork_server()
+    timed("fork server", args.n, lambda: launcher.spawn([true]).wait())
+    print(f"  {launcher.stats()}")
+    launcher.stop_fork_server()
+
+    if bash := shutil.which("bash"):
+        start = time.perf_counter()
+        subprocess.run([bash, "-c", f"for ((i = 0; i < {args.n}; i++)); do {true}; done"])
+        elapsed = time.perf_counter() - start
+        print(f"{'bash loop':<16} {elapsed:7.2f} s  ({elapsed / args.n * 1e6:6.0f} µs per command)")
+
+
+if __name__ == "__main__":
+    main()
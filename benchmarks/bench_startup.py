@@ -0,0 +1,63 @@
+"""Measure how long it takes the shell to start up and draw its first prompt.
+
+Each run happens in a fresh interpreter, so the measurements include building (or loading the
+cached) parser tables. The slowest imports from `python -X importtime` are listed as well, so it's
+easy to see where a regression came from.
+
+Usage: python benchmarks/bench_startup.py [N_RUNS]
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+FIRST_PROMPT = """
+import turtleshell.main as main
+main.get_prompt()
+main.parse_cache.parse('print "hello"')
+"""
+
+
+def run(code: str, *flags: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, *flags, "-c", code], capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start, proc.stderr
+
+
+def slowest_imports(importtime: str, n: int = 10) -> list[tuple[int, str]]:
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # Warm up the parser cache, so we measure the typical case
+    run(FIRST_PROMPT)
+
+    baseline = [run("pass")[0] for _ in range(n)]
+    imports = [run("import turtleshell.main")[0] for _ in range(n)]
+    first_prompt = [run(FIRST_PROMPT)[0] for _ in range(n)]
+
+    for label, times in (
+        ("python -c pass", baseline),
+        ("import turtleshell.main", imports),
+        ("import + first prompt", first_prompt),
+    ):
+        print(f"{label:>24}: median {statistics.median(times) * 1000:7.1f} ms")
+
+    print("\nSlowest imports (cumulative us):")
+    _, importtime = run("import turtleshell.main", "-X", "importtime")
+    for cumulative, name in slowest_imports(importtime):
+        print(f"{cumulative:10}  {name}")
+
+
+if __name__ == "__main__":
+    main()
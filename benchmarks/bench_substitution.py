@@ -0,0 +1,59 @@
+"""Measure the cost of a command substitution.
+
+Runs a loop which does `x = $(cwd)` on each of N_ITERATIONS iterations (which runs in-process), then
+the same loop with `$(pwd)` (which has to start a program) for comparison, and finally reads a large
+file with `$(cat ...)`.
+
+Usage: python benchmarks/bench_substitution.py [N_ITERATIONS]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+LOOP = "for (i = 0; $i < {n}; i += 1) {{ x = $({command}) }}"
+
+# How many times to run the external version (it's a lot slower)
+EXTERNAL_ITERATIONS = 200
+
+FILE_SIZE = 8 * 1024 * 1024
+
+
+def timed(label: str, n: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed * 1000:8.1f} ms ({elapsed / n * 1e6:9.2f} µs per call)")
+
+
+def run(text: str, env: EnvironmentVarHolder):
+    for statement in parser.parse(text).children:
+        statement.compiled()(env)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    env = EnvironmentVarHolder()
+    timed("$(cwd)", n, lambda: run(LOOP.format(n=n, command="cwd"), env))
+    assert env["x"] == os.getcwd()
+
+    timed(
+        "$(pwd)",
+        EXTERNAL_ITERATIONS,
+        lambda: run(LOOP.format(n=EXTERNAL_ITERATIONS, command="pwd"), env),
+    )
+    assert env["x"] == os.getcwd()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+        f.writelines("x" * 1023 + "\n" for _ in range(FILE_SIZE // 1024))
+        f.flush()
+        timed("$(cat)", 1, lambda: run(f"x = $(cat {f.name})", env))
+        assert len(env["x"]) == FILE_SIZE - 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure scripts which build up a long list of numbers.
+
+Appends N_NUMBERS numbers to a list one at a time, then doubles and shifts every number with `*=`
+and `+=`, and sums them with a `foreach` loop. The memory used by the list is compared with what
+the same numbers take up in a Python list.
+
+Usage: python benchmarks/bench_values.py [N_NUMBERS]
+"""
+
+import resource
+import sys
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+ACCUMULATE = "xs = []; for (i = 0; $i < {n}; i += 1) {{ xs += [$i] }}"
+VECTORIZED = "xs *= 2; xs += 1"
+SUM = "total = 0; foreach x in xs { total += $x }"
+
+
+def timed(label: str, n: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed * 1000:9.1f} ms ({elapsed / n * 1e9:6.0f} ns per number)")
+
+
+def run(text: str, env: EnvironmentVarHolder):
+    for statement in parser.parse(text).children:
+        statement.compiled()(env)
+
+
+def max_rss_mb() -> float:
+    # Linux reports kilobytes, macOS bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    env = EnvironmentVarHolder()
+    before = max_rss_mb()
+    timed("accumulate", n, lambda: run(ACCUMULATE.format(n=n), env))
+    timed("vectorized", n, lambda: run(VECTORIZED, env))
+    timed("sum", n, lambda: run(SUM, env))
+    assert env["total"] == n * n, env["total"]
+
+    # Before the Python list below is made, since that takes a lot more
+    peak = max_rss_mb() - before
+    storage = env["xs"].value
+    as_list = storage.tolist()
+    list_bytes = sys.getsizeof(as_list) + sum(map(sys.getsizeof, as_list))
+    print(f"\nstorage      {type(storage).__name__}('{storage.typecode}')")
+    print(f"list size    {len(storage) * storage.itemsize / 1e6:9.1f} MB")
+    print(f"as a list    {list_bytes / 1e6:9.1f} MB")
+    print(f"peak RSS     {peak:9.1f} MB more than at the start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Measure variable-heavy loops, and the cost of forking an environment.
+
+Runs a `for` loop which reads and writes several variables on each of N_ITERATIONS iterations, and a
+`foreach` loop over a list of the same length, then times `env.fork()` (which parallel foreach
+iterations and prompt substitutions do).
+
+Usage: python benchmarks/bench_variables.py [N_ITERATIONS]
+"""
+
+import sys
+import time
+
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+FOR_LOOP = """
+total = 0;
+for (i = 0; $i < {n}; i += 1) {{
+    a = $i;
+    b = $a;
+    total += $b;
+    flag = false;
+    if ($flag) {{ total = 0 }}
+}}
+"""
+
+FOREACH_LOOP = "count = 0; foreach item in ITEMS { count += 1; last = $item }"
+
+
+def timed(label: str, n: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed * 1000:8.1f} ms ({elapsed / n * 1e9:7.0f} ns per iteration)")
+
+
+def run(text: str, env: EnvironmentVarHolder):
+    for statement in parser.parse(text).children:
+        statement.compiled()(env)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    env = EnvironmentVarHolder()
+    timed("for", n, lambda: run(FOR_LOOP.format(n=n), env))
+    assert env["total"] == n * (n - 1) // 2, env["total"]
+
+    env["ITEMS"] = list(range(n))
+    timed("foreach", n, lambda: run(FOREACH_LOOP, env))
+    assert env["count"] == n
+
+    for i in range(100):
+        env[f"VAR{i}"] = i
+
+    def fork():
+        for _ in range(n):
+            env.fork()
+
+    timed("fork", n, fork)
+
+
+if __name__ == "__main__":
+    main()
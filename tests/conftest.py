@@ -0,0 +1,40 @@
+from pathlib import Path
+from typing import Any, Callable
+
+import pytest
+
+from turtleshell import streams
+from turtleshell.evaluate import evaluate
+from turtleshell.parsing import parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+@pytest.fixture
+def run() -> Callable[..., Any]:
+    """Returns a function which runs some statements the way the shell does (printing any results),
+    and returns the last one's result. Output is flushed, so it can be read with `capfd`.
+
+    With `mode="eval"`, each statement is run with `eval` rather than being compiled, and results
+    aren't printed."""
+
+    def run(text: str, env: EnvironmentVarHolder | None = None, mode: str = "compiled") -> Any:
+        env = env if env is not None else EnvironmentVarHolder()
+        result = None
+        for statement in parser.parse(text).children:
+            result = statement.eval(env) if mode == "eval" else evaluate(statement, env)
+        streams.flush()
+        return result
+
+    return run
+
+
+@pytest.fixture
+def make_executable() -> Callable[[Path], Path]:
+    """Returns a function which creates an (empty) executable script at a path."""
+
+    def make_executable(path: Path) -> Path:
+        path.write_text("#!/bin/sh\n")
+        path.chmod(0o755)
+        return path
+
+    return make_executable
@@ -0,0 +1,110 @@
+from typing import Any
+
+import pytest
+
+from turtleshell.builtins import ArgFlag, ArgOpt, ArgParser, ArgPos, ArgRest, CmdArg
+from turtleshell.errors import ArgumentError
+
+
+def legacy_parse_args(parser: ArgParser, *args: Any) -> dict:
+    """The original implementation of ArgParser.parse_args, kept as a reference."""
+    argspace = {}
+    n_positional_args = len(parser.args)
+    for arg, val in zip(parser.args, args[:n_positional_args]):
+        argspace.update(arg.eval(val))
+
+    flags = set()
+    arg_buffer = []
+    arg: CmdArg = None
+    for value in args[n_positional_args:]:
+        if not arg and not parser.is_arg(value):
+            raise ArgumentError(f"Expected new argument; got {value}")
+        if parser.is_arg(value):
+            if arg:
+                argspace.update(arg.eval(*arg_buffer))
+            arg_buffer = []
+            arg = parser.kwargs.get(value)
+            if not arg:
+                raise ArgumentError(f"Unrecognized arg '{value}'")
+            if isinstance(arg, ArgFlag):
+                flags.add(arg)
+                arg = None
+            continue
+        arg_buffer.append(value)
+
+    if arg:
+        argspace.update(arg.eval(*arg_buffer))
+    for flag in parser.flags:
+        argspace.update(flag.eval(flag in flags))
+    return argspace
+
+
+def make_parser() -> ArgParser:
+    parser = ArgParser()
+    parser.add_argument(ArgPos("string", coerce=str))
+    parser.add_argument(ArgFlag("trailing_newline", store_true=False), "-n")
+    parser.add_argument(ArgFlag("enable_escapes", store_true=True), "-e")
+    parser.add_argument(ArgFlag("verbose"), "-v", "--verbose")
+    return parser
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ("hello",),
+        ("hello", "-n"),
+        ("hello", "-e", "-n"),
+        ("hello", "--verbose"),
+        ("-n",),
+        (42, "-v", "-n", "-e"),
+        (),
+    ],
+)
+def test_equivalent_to_legacy_parser(args: tuple):
+    parser = make_parser()
+    assert parser.parse_args(*args).as_dict() == legacy_parse_args(parser, *args)
+
+
+@pytest.mark.parametrize("args", [("hello", "world"), ("hello", "-x")])
+def test_errors_match_legacy_parser(args: tuple):
+    parser = make_parser()
+    with pytest.raises(ArgumentError):
+        legacy_parse_args(parser, *args)
+    with pytest.raises(ArgumentError):
+        parser.parse_args(*args)
+
+
+def test_combined_short_flags():
+    parsed = make_parser().parse_args("hello", "-nev")
+    assert (parsed.trailing_newline, parsed.enable_escapes, parsed.verbose) == (False, True, True)
+
+
+def test_options():
+    parser = make_parser()
+    parser.add_argument(ArgOpt("count", nargs=1, coerce=int), "-c", "--count")
+    assert parser.parse_args("hello", "--count=3").count == [3]
+    assert parser.parse_args("hello", "-c", "4").count == [4]
+    with pytest.raises(ArgumentError):
+        parser.parse_args("hello", "-c", "4", "5")
+
+
+def test_double_dash_ends_options():
+    parser = make_parser()
+    parser.add_argument(ArgOpt("pattern", nargs=1), "-p")
+    assert parser.parse_args("hello", "-p", "--", "-n").pattern == ["-n"]
+
+
+def test_namespace_uses_slots():
+    parsed = make_parser().parse_args("hello")
+    assert not hasattr(parsed, "__dict__")
+    assert parsed["string"] == parsed.string == "hello"
+
+
+def test_rest_collects_operands():
+    parser = ArgParser()
+    parser.add_argument(ArgFlag("invert"), "-v")
+    parser.add_argument(ArgOpt("count", nargs=1, coerce=int), "-m")
+    parser.add_argument(ArgRest("operands", coerce=str))
+    parsed = parser.parse_args("pattern", "-v", "-m", "2", "file", 3)
+    assert (parsed.invert, parsed.count, parsed.operands) == (True, [2], ["pattern", "file", "3"])
+    assert parser.parse_args("-v", "--", "-m").operands == ["-m"]
@@ -0,0 +1,116 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from turtleshell.completion import CommandIndex, CompletionEngine, DirectoryCache, PrefixTrie
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def test_trie():
+    trie = PrefixTrie(["git", "gitk", "grep", "go", "git"])
+    assert len(trie) == 4
+    assert trie.with_prefix("g") == ["git", "gitk", "go", "grep"]
+    assert trie.with_prefix("gi") == ["git", "gitk"]
+    assert trie.with_prefix("g", limit=2) == ["git", "gitk"]
+    assert trie.with_prefix("x") == []
+    assert "gitk" in trie and "gi" not in trie
+
+
+def test_trie_counts_duplicates():
+    trie = PrefixTrie(["git", "git", "gitk"])
+    trie.remove("git")
+    assert "git" in trie
+    trie.remove("git")
+    assert "git" not in trie
+    assert trie.with_prefix("") == ["gitk"]
+    trie.remove("gitk")
+    trie.remove("nothing")
+    assert len(trie) == 0 and trie.root == {}
+
+
+def test_command_index_picks_up_changes(make_executable, tmp_path: Path):
+    make_executable(tmp_path / "frob")
+    (tmp_path / "not-executable").write_text("")
+    index = CommandIndex(["print"])
+    index.refresh([str(tmp_path)])
+    assert index.complete("") == ["frob", "print"]
+
+    make_executable(tmp_path / "frobnicate")
+    (tmp_path / "frob").unlink()
+    # Make sure the directory looks modified, even on filesystems with coarse mtimes
+    os.utime(tmp_path, ns=(0, 0))
+    index.refresh([str(tmp_path)])
+    assert index.complete("fr") == ["frobnicate"]
+
+    index.refresh([])
+    assert index.complete("") == ["print"]
+
+
+def test_directory_cache(tmp_path: Path):
+    (tmp_path / "b.txt").write_text("")
+    (tmp_path / "a").mkdir()
+    (tmp_path / ".hidden").write_text("")
+    cache = DirectoryCache(size=1)
+    listing = cache.get(str(tmp_path))
+    assert listing.with_prefix("") == ["a/", "b.txt"]
+    assert listing.with_prefix(".") == [".hidden"]
+    assert cache.get(str(tmp_path)) is listing
+    assert cache.get(str(tmp_path / "missing")) is None
+    cache.get(str(tmp_path / "a"))
+    assert list(cache.listings) == [str(tmp_path / "a")]
+
+
+@pytest.fixture
+def engine(make_executable, tmp_path: Path) -> CompletionEngine:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    make_executable(bin_dir / "frob")
+    (tmp_path / "files").mkdir()
+    (tmp_path / "files" / "frobs.txt").write_text("")
+    env = EnvironmentVarHolder()
+    env["PATH"] = [str(bin_dir)]
+    env["FROB"] = 1
+    engine = CompletionEngine(env)
+    engine.commands.refresh(env["PATH"])
+    return engine
+
+
+@pytest.mark.parametrize(
+    ("text", "word", "expected"),
+    [
+        ("fr", "fr", ["frob"]),
+        ("pri", "pri", ["print"]),
+        ("ls | fr", "fr", ["frob"]),
+        ("x = 1; fr", "fr", ["frob"]),
+        ("if ($x) {{ fr", "fr", ["frob"]),
+        ("print $FR", "$FR", ["$FROB"]),
+        ("print $CW", "$CW", ["$CWD"]),
+        ("cat {files}/fr", "{files}/fr", ["{files}/frobs.txt"]),
+        ("cat {files}/", "{files}/", ["{files}/frobs.txt"]),
+        ("cd {root}/fi", "{root}/fi", ["{root}/files/"]),
+    ],
+    ids=[
+        "command",
+        "builtin",
+        "after-pipe",
+        "after-semicolon",
+        "in-block",
+        "variable",
+        "shell-variable",
+        "path",
+        "directory-contents",
+        "directory",
+    ],
+)
+def test_complete(engine: CompletionEngine, tmp_path: Path, text, word, expected):
+    files = tmp_path / "files"
+    assert engine.complete(text.format(files=files, root=tmp_path)) == (
+        word.format(files=files, root=tmp_path),
+        [e.format(files=files, root=tmp_path) for e in expected],
+    )
+
+
+def test_arguments_complete_paths(engine: CompletionEngine, tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path / "files")
+    assert engine.complete("cat fr") == ("fr", ["frobs.txt"])
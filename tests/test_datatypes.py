@@ -0,0 +1,90 @@
+from array import array
+import os
+
+import pytest
+
+from turtleshell.datatypes import List, PathList, share
+
+
+@pytest.mark.parametrize(
+    ("items", "typecode"),
+    [([], "q"), ([1, 2], "q"), ([1, 2.5], "d"), ([1, "a"], None), ([True], None), ([2**70], None)],
+)
+def test_list_storage(items, typecode):
+    storage = List(items).value
+    if typecode is None:
+        assert type(storage) is list
+    else:
+        assert type(storage) is array and storage.typecode == typecode
+    assert List(items) == items
+
+
+@pytest.mark.parametrize(
+    ("item", "typecode"), [(3, "q"), (3.5, "d"), (2**70, None), ("c", None), (False, None)]
+)
+def test_list_append_widens(item, typecode):
+    lst = List([1, 2])
+    lst.append(item)
+    assert lst == [1, 2, item]
+    assert getattr(lst.value, "typecode", None) == typecode
+
+
+def test_list_extend():
+    lst = List([1, 2])
+    lst.extend(List([3.5]))
+    assert lst == [1, 2, 3.5] and lst.value.typecode == "d"
+    lst.extend([4])
+    assert lst == [1, 2, 3.5, 4] and lst.value.typecode == "d"
+    lst.extend(["x"])
+    assert lst == [1, 2, 3.5, 4, "x"] and type(lst.value) is list
+
+
+def test_list_arithmetic():
+    lst = List([1, 2, 3])
+    assert lst + 1 == [2, 3, 4]
+    assert lst * 2 == [2, 4, 6]
+    assert lst - 1 == [0, 1, 2]
+    assert lst / 2 == [0.5, 1, 1.5]
+    assert 10 - lst == [9, 8, 7]
+    assert lst + [4] == [1, 2, 3, 4]
+    assert lst * 2.5 == [2.5, 5, 7.5]
+    assert List(["a", "b"]) + "!" == ["a!", "b!"]
+    # 64-bit ints which overflow become Python ints
+    assert List([2**62]) * 4 == [2**64]
+    assert lst == [1, 2, 3]
+
+
+def test_list_in_place():
+    lst = List([1, 2])
+    original = lst
+    lst += [3]
+    lst *= 2
+    assert lst is original
+    assert lst == [2, 4, 6]
+
+
+def test_list_copy():
+    owner = object()
+    lst = List([1, 2], owner)
+    copy = lst.copy()
+    copy.append(3)
+    assert (lst, copy) == ([1, 2], [1, 2, 3])
+    assert copy.owner is None
+    assert share(lst) is lst and lst.owner is None
+
+
+def test_list_str():
+    assert str(List([1, 2.5, "a"])) == "1 2.5 a"
+    assert List([1, 2, 3])[1:] == [2, 3]
+
+
+def test_path_list():
+    path = PathList.of(f"/usr/bin{os.pathsep}{os.pathsep}/bin")
+    assert list(path) == ["/usr/bin", "/bin"]
+    assert path == ["/usr/bin", "/bin"]
+    assert "/bin" in path
+    # The same string gives the same PathList, so it's only split up once
+    assert PathList.of(f"/usr/bin{os.pathsep}{os.pathsep}/bin") is path
+    assert PathList.of(path) is path
+    assert list(path + "/opt/bin") == ["/usr/bin", "/bin", "/opt/bin"]
+    assert list("/opt/bin" + path) == ["/opt/bin", "/usr/bin", "/bin"]
@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from turtleshell.errors import CommandNotFound
+from turtleshell.executables import ExecutableCache
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def test_lookup_is_hashed(make_executable, tmp_path: Path):
+    exe = make_executable(tmp_path / "frob")
+    cache = ExecutableCache()
+    assert cache.lookup("frob", [str(tmp_path)]) == exe
+    assert cache.lookup("frob", [str(tmp_path)]) == exe
+    assert cache.stats() == {"hits": 1, "misses": 1, "hashed": 1}
+
+
+def test_lookup_respects_path_order(make_executable, tmp_path: Path):
+    first, second = tmp_path / "a", tmp_path / "b"
+    first.mkdir()
+    second.mkdir()
+    make_executable(second / "frob")
+    exe = make_executable(first / "frob")
+    cache = ExecutableCache()
+    assert cache.lookup("frob", [str(first), str(second)]) == exe
+
+
+def test_new_executables_are_found(make_executable, tmp_path: Path):
+    cache = ExecutableCache()
+    assert cache.lookup("frob", [str(tmp_path)]) is None
+    exe = make_executable(tmp_path / "frob")
+    # Make sure the directory looks modified, even on filesystems with coarse mtimes
+    os.utime(tmp_path, ns=(0, 0))
+    assert cache.lookup("frob", [str(tmp_path)]) == exe
+
+
+def test_removed_executables_are_forgotten(make_executable, tmp_path: Path):
+    exe = make_executable(tmp_path / "frob")
+    cache = ExecutableCache()
+    assert cache.lookup("frob", [str(tmp_path)]) == exe
+    exe.unlink()
+    os.utime(tmp_path, ns=(0, 0))
+    assert cache.lookup("frob", [str(tmp_path)]) is None
+
+
+def test_assigning_path_clears_cache(make_executable, tmp_path: Path):
+    make_executable(tmp_path / "frob")
+    env = EnvironmentVarHolder()
+    env["PATH"] = [str(tmp_path)]
+    env.get_executable("frob")
+    assert env.executables.hashed
+    env["PATH"] = []
+    assert not env.executables.hashed
+    with pytest.raises(CommandNotFound):
+        env.get_executable("frob")
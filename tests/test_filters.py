@@ -0,0 +1,162 @@
+import subprocess
+
+import pytest
+
+from turtleshell import filters
+from turtleshell.parsing import parser
+from turtleshell.pipeline import BuiltinStage, ExternalStage, Stage
+from turtleshell.variables import EnvironmentVarHolder
+
+LINES = [
+    "apple 3",
+    "Banana 10",
+    "banana 10",
+    "banana 10",
+    "cherry,red,sweet",
+    "",
+    "  2 date",
+    "-1.5 elderberry",
+    "fig\tpurple\tsmall",
+    "fig\tpurple\tsmall",
+    "grape  ",
+    "10 x",
+    "9 y",
+]
+
+COMMANDS = [
+    "grep an",
+    "grep -i banana",
+    "grep -v -i an",
+    "grep -c a",
+    "grep -F .",
+    'grep -E "a|e"',
+    'grep "^b"',
+    'grep "0$"',
+    "grep zzz",
+    "head",
+    "head -n 3",
+    "head -n 0",
+    "head -c 20",
+    "wc",
+    "wc -l",
+    "wc -w -c",
+    "sort",
+    "sort -r",
+    "sort -n",
+    "sort -n -r",
+    "sort -u",
+    "sort -n -u",
+    'cut -d "," -f 2',
+    'cut -d "," -f "1,3"',
+    "cut -f 2-",
+    "cut -s -f 1",
+    "cut -c 2-4",
+    "cut -b 1-3",
+    "uniq",
+    "uniq -c",
+    "uniq -d",
+    "uniq -u",
+]
+
+
+@pytest.fixture
+def text_file(tmp_path, monkeypatch):
+    # Small chunks, so lines and words are split between them
+    monkeypatch.setattr(filters, "CHUNK_SIZE", 7)
+    # `sort` is only run in-process when lines are compared byte by byte
+    monkeypatch.setenv("LC_ALL", "C")
+    path = tmp_path / "input.txt"
+    path.write_text("\n".join(LINES * 3) + "\n")
+    return path
+
+
+def stages(text: str, env: EnvironmentVarHolder | None = None) -> list[Stage]:
+    """Returns the stages a pipeline would run as, without running it."""
+    return parser.parse(text).children[0].get_stages(env or EnvironmentVarHolder())
+
+
+def system(command: str, path) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        f"cat {path} | {command}", shell=True, capture_output=True, env={"LC_ALL": "C"}
+    )
+
+
+@pytest.mark.parametrize("command", COMMANDS)
+def test_filter_matches_system(run, command: str, text_file, capfd):
+    text = f"cat {text_file} | {command}"
+    assert isinstance(stages(text)[-1], BuiltinStage)
+    result = run(text)
+    expected = system(command, text_file)
+    assert capfd.readouterr().out.encode() == expected.stdout
+    assert result.code == expected.returncode
+
+
+@pytest.mark.parametrize("command", ["wc", "head -n 2", "sort -r", "grep -c an", "uniq -c"])
+def test_filter_reads_file(run, command: str, text_file, capfd):
+    text = f"print x | {command} {text_file}"
+    assert isinstance(stages(text)[-1], BuiltinStage)
+    run(text)
+    expected = subprocess.run(f"{command} {text_file}", shell=True, capture_output=True)
+    assert capfd.readouterr().out.encode() == expected.stdout
+
+
+def test_filter_reads_redirected_input(run, text_file, capfd):
+    assert isinstance(stages(f"wc -l < {text_file}")[0], BuiltinStage)
+    run(f"wc -l < {text_file}")
+    assert capfd.readouterr().out == f"{len(LINES) * 3}\n"
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "grep -o an",  # Unsupported flag
+        "grep -P an",
+        'grep "a\\+"',  # Escapes are left to grep
+        'grep "a+"',  # A literal `+` to grep, but not to Python
+        "head -n 2 a b",  # More than one file
+        "sort -k 2",
+        "cut -f 1 -c 2",
+        "uniq -i",
+    ],
+)
+def test_unsupported_flags_fall_back(command: str):
+    assert isinstance(stages(f"print x | {command}")[-1], ExternalStage)
+
+
+def test_filters_need_piped_input():
+    env = EnvironmentVarHolder()
+    assert isinstance(parser.parse("grep x").children[0].get_stage(env), ExternalStage)
+    assert isinstance(stages("grep x | wc -l")[0], ExternalStage)
+
+
+def test_filters_can_be_turned_off():
+    env = EnvironmentVarHolder()
+    env["BUILTINFILTERS"] = False
+    assert isinstance(stages("print x | grep x", env)[-1], ExternalStage)
+
+
+def test_large_files_fall_back(text_file, monkeypatch):
+    monkeypatch.setattr(filters, "LARGE_FILE_SIZE", 100)
+    assert isinstance(stages(f"print x | grep x {text_file}")[-1], ExternalStage)
+    # Piped input could be any size, so it's always read in-process
+    assert isinstance(stages(f"cat {text_file} | grep x")[-1], BuiltinStage)
+
+
+def test_missing_file(run, capfd):
+    result = run("print x | grep x /no/such/file")
+    assert result.code == 2
+    assert capfd.readouterr().err == "grep: /no/such/file: No such file or directory\n"
+
+
+def test_head_stops_early(run, capfd):
+    # `yes` never ends, so this only finishes if head stops reading
+    run("yes | head -n 3")
+    assert capfd.readouterr().out == "y\ny\ny\n"
+
+
+@pytest.mark.parametrize(
+    ("spec", "expected"),
+    [("2", [(1, 2)]), ("3-,1", [(0, 1), (2, None)]), ("-2,2-4", [(0, 4)]), ("1-,3", [(0, None)])],
+)
+def test_parse_ranges(spec: str, expected: list):
+    assert filters.parse_ranges(spec) == expected
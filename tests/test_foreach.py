@@ -0,0 +1,117 @@
+import pytest
+
+from turtleshell.errors import ArgumentError, CommandNotFound, NotParallelSafe
+from turtleshell.parsing import Foreach, ParallelForeach, parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+@pytest.fixture
+def items(tmp_path):
+    path = tmp_path / "items.txt"
+    path.write_text("a\nb\nc\n")
+    return path
+
+
+def test_foreach_is_parsed():
+    token = parser.parse("foreach -j 4 --fail-fast x in ls -l { print $x }").children[0]
+    assert isinstance(token, ParallelForeach)
+    assert (token.max_jobs, token.foreach.fail_fast) == (4, True)
+    assert isinstance(token.foreach, Foreach)
+
+
+def test_foreach_over_command_output(run, items, capfd):
+    env = EnvironmentVarHolder()
+    run(f"foreach x in cat {items} {{ print $x }}", env)
+    assert capfd.readouterr().out == "a\nb\nc\n"
+    # The loop variable only exists inside the loop
+    assert env["x"] == ""
+
+
+def test_foreach_over_variable(run, capfd):
+    env = EnvironmentVarHolder()
+    env["LETTERS"] = ["x", "y"]
+    run("foreach letter in LETTERS { print $letter }", env)
+    assert capfd.readouterr().out == "x\ny\n"
+
+
+def test_parallel_foreach_buffers_output(run, items, capfd):
+    env = EnvironmentVarHolder()
+    result = run(f'foreach -j 3 x in cat {items} {{ print $x -n; sleep 0.1; echo " done" }}', env)
+    assert result.code == 0
+    assert capfd.readouterr().out == "a done\nb done\nc done\n"
+    # Each iteration has its own scope
+    assert env["x"] == ""
+
+
+def test_parallel_foreach_keeps_order(run, items, capfd):
+    # The first iteration finishes last, but is still written out first
+    env = EnvironmentVarHolder()
+    run(f'foreach -j 3 x in cat {items} {{ if ($x == "a") {{ sleep 0.2 }}; print $x }}', env)
+    assert capfd.readouterr().out == "a\nb\nc\n"
+
+
+def test_parallel_foreach_needs_a_job(run, items):
+    with pytest.raises(ArgumentError):
+        run(f"foreach -j 0 x in cat {items} {{ print $x }}", EnvironmentVarHolder())
+
+
+def test_parallel_foreach_reports_failures(run, items):
+    env = EnvironmentVarHolder()
+    assert run(f"foreach -j 2 x in cat {items} {{ false }}", env).code == 1
+    assert run(f"foreach --fail-fast x in cat {items} {{ false }}", env).code == 1
+
+
+def test_fail_fast_without_jobs_runs_in_order(run, items, tmp_path, monkeypatch, capfd):
+    token = parser.parse(f"foreach --fail-fast x in cat {items} {{ print $x }}").children[0]
+    assert isinstance(token, Foreach) and token.fail_fast
+    monkeypatch.chdir(tmp_path)
+    env = EnvironmentVarHolder()
+    # It isn't parallel, so `cd` is fine
+    run(f"foreach --fail-fast x in cat {items} {{ cd /; print $x }}", env)
+    assert capfd.readouterr().out == "a\nb\nc\n"
+
+
+def test_fail_fast_stops_at_first_failure(run, items, capfd):
+    env = EnvironmentVarHolder()
+    result = run(f'foreach --fail-fast x in cat {items} {{ print $x; sh -c "exit 3" }}', env)
+    assert result.code == 3
+    assert capfd.readouterr().out == "a\n"
+
+
+def test_foreach_streams_output(run, capfd):
+    # The producer never finishes, so this only works if the loop starts on the first line, and
+    #   the producer is cleaned up after `break`
+    env = EnvironmentVarHolder()
+    run('foreach x in sh -c "echo first; sleep 60" { print $x; break }', env)
+    assert capfd.readouterr().out == "first\n"
+
+
+def test_foreach_break_stops_infinite_producer(run):
+    env = EnvironmentVarHolder()
+    env["n"] = 1
+    run("foreach x in yes y { n += 1; if ($n == 100) { break } }", env)
+    assert env["n"] == 100
+
+
+def test_continue(run, capfd):
+    env = EnvironmentVarHolder()
+    run("for (i = 1; $i < 5; i += 1) { if ($i == 2) { continue }; print $i -n }", env)
+    assert capfd.readouterr().out == "134"
+
+
+def test_foreach_over_command_without_arguments(run, tmp_path, monkeypatch, capfd):
+    (tmp_path / "a.txt").write_text("")
+    (tmp_path / "b.txt").write_text("")
+    monkeypatch.chdir(tmp_path)
+    run("foreach f in ls { print $f }", EnvironmentVarHolder())
+    assert capfd.readouterr().out == "a.txt\nb.txt\n"
+
+
+def test_foreach_over_unknown_name(run):
+    with pytest.raises(CommandNotFound):
+        run("foreach x in definitely_not_a_command_xyz { print $x }", EnvironmentVarHolder())
+
+
+def test_parallel_foreach_rejects_cd(run, items):
+    with pytest.raises(NotParallelSafe):
+        run(f"foreach -j 2 x in cat {items} {{ if (1 == 1) {{ cd / }} }}", EnvironmentVarHolder())
@@ -0,0 +1,84 @@
+from pathlib import Path
+import sqlite3
+import threading
+
+from prompt_toolkit.document import Document
+
+from turtleshell import history as history_module
+from turtleshell.history import HistorySuggest, SQLiteHistory
+
+
+def test_record_and_load(tmp_path: Path):
+    history = SQLiteHistory(tmp_path / "history.sqlite")
+    history.record("ls", 0, 0.1, started=1)
+    history.record("pwd", 0, 0.1, started=2)
+    history.record("ls", 2, 0.5, started=3)
+    # Duplicates are only listed once, newest first
+    assert list(history.load_history_strings()) == ["ls", "pwd"]
+    assert history.runs("ls") == [(1, 0.1, 0), (3, 0.5, 2)]
+
+
+def test_limit(tmp_path: Path):
+    history = SQLiteHistory(tmp_path / "history.sqlite", limit=2)
+    for i in range(5):
+        history.record(f"echo {i}", started=i)
+    assert list(history.load_history_strings()) == ["echo 4", "echo 3"]
+
+
+def test_search(tmp_path: Path):
+    history = SQLiteHistory(tmp_path / "history.sqlite")
+    for i, command in enumerate(["git status", "git log", "ls", "echo git"]):
+        history.record(command, started=i)
+    assert history.search_prefix("git") == ["git log", "git status"]
+    assert history.search_prefix("git", limit=1) == ["git log"]
+    assert history.search_prefix("nope") == []
+
+
+def test_search_beyond_recent_commands(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(history_module, "RECENT_COMMANDS", 2)
+    history = SQLiteHistory(tmp_path / "history.sqlite")
+    for i, command in enumerate(["git status", "git log", "ls", "echo"]):
+        history.record(command, started=i)
+    assert history.search_prefix("git") == ["git log", "git status"]
+    assert history.search_prefix("e", limit=1) == ["echo"]
+
+
+def test_suggest_finds_commands_not_loaded(tmp_path: Path):
+    history = SQLiteHistory(tmp_path / "history.sqlite", limit=1)
+    for i, command in enumerate(["git status", "git log", "ls"]):
+        history.record(command, started=i)
+    assert list(history.load_history_strings()) == ["ls"]
+    suggest = HistorySuggest(history)
+    assert suggest.get_suggestion(None, Document("git s")).text == "tatus"
+    assert suggest.get_suggestion(None, Document("git ")).text == "log"
+    assert suggest.get_suggestion(None, Document("git log")) is None
+    assert suggest.get_suggestion(None, Document("   ")) is None
+
+
+def test_imports_legacy_file(tmp_path: Path):
+    legacy = tmp_path / "old_history"
+    legacy.write_text("ls\ncd ~\n\nls -la\n")
+    history = SQLiteHistory(tmp_path / "history.sqlite", legacy_file=legacy)
+    assert list(history.load_history_strings()) == ["ls -la", "cd ~", "ls"]
+    # Only the first time
+    legacy.write_text("other\n")
+    history = SQLiteHistory(tmp_path / "history.sqlite", legacy_file=legacy)
+    assert "other" not in list(history.load_history_strings())
+
+
+def test_concurrent_writers(tmp_path: Path):
+    path = tmp_path / "history.sqlite"
+    shells = [SQLiteHistory(path) for _ in range(4)]
+
+    def write(history: SQLiteHistory, n: int):
+        for i in range(50):
+            history.record(f"shell {n} command {i}", 0, 0.0)
+
+    threads = [threading.Thread(target=write, args=(h, n)) for n, h in enumerate(shells)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM runs").fetchone() == (200,)
+        assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from turtleshell.builtins import get_builtin
+from turtleshell.jobs import NoSuchJob, scheduler
+from turtleshell.parsing import Background, parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+@pytest.fixture
+def env():
+    yield EnvironmentVarHolder()
+    for job in list(scheduler.jobs.values()):
+        job.kill()
+        job.wait()
+    scheduler.jobs.clear()
+
+
+def test_background_is_parsed():
+    token = parser.parse("sleep 1 | cat &").children[0]
+    assert isinstance(token, Background)
+    assert str(token.statement) == "sleep 1 | cat"
+
+
+def test_wait_returns_exit_code(run, env):
+    run("false &", env)
+    assert run("wait %1", env).code == 1
+    assert not scheduler.jobs
+
+
+def test_wait_for_killed_job(run, env):
+    run("sleep 5 &", env)
+    run("kill %1", env)
+    assert run("wait %1", env).code == 143
+
+
+@pytest.mark.parametrize("kill", ["kill -s KILL %1", "kill -s 9 %1", "kill -9 %1", "kill -KILL %1"])
+def test_kill_with_signal(run, kill: str, env):
+    run("sleep 5 &", env)
+    assert run(kill, env).code == 0
+    assert run("wait %1", env).code == 137
+
+
+def test_kill_several_jobs(run, env):
+    run("sleep 5 &", env)
+    run("sleep 5 &", env)
+    run("kill -s INT %1 %2", env)
+    assert run("wait %1", env).code == run("wait %2", env).code == 130
+
+
+def test_kill_invalid_signal(run, env):
+    run("sleep 5 &", env)
+    result = run("kill -s NOPE %1", env)
+    assert result.code == 1 and "invalid signal" in result.stderr
+
+
+def test_kill_finished_job(run, env, monkeypatch):
+    run("true &", env)
+    job = scheduler.get("%1")
+    job.wait()
+    # Its pid may have been given to another process by now
+    monkeypatch.setattr(os, "kill", lambda *args: pytest.fail(f"os.kill{args}"))
+    job.kill()
+
+
+def test_jobs_run_concurrently(run, env):
+    run("sleep 5 &", env)
+    run("sleep 5 &", env)
+    assert env["JOBS"] == 2
+    assert "Running" in str(get_builtin("jobs").run(env=env))
+    run("kill %1", env)
+    run("kill %2", env)
+    run("wait", env)
+    assert env["JOBS"] == 0
+
+
+def test_unknown_job(run, env):
+    with pytest.raises(NoSuchJob):
+        run("wait %7", env)
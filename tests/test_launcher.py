@@ -0,0 +1,78 @@
+import os
+import signal
+
+import pytest
+
+from turtleshell.launcher import Launcher
+
+
+@pytest.fixture(params=["posix_spawn", "fork server"])
+def launcher(request):
+    launcher = Launcher()
+    if request.param == "fork server":
+        assert launcher.start_fork_server()
+    yield launcher
+    launcher.stop_fork_server()
+
+
+def run(launcher: Launcher, argv: list[str], stdin: bytes = b"") -> tuple[int, bytes]:
+    in_r, in_w = os.pipe()
+    out_r, out_w = os.pipe()
+    try:
+        process = launcher.spawn(argv, in_r, out_w)
+    finally:
+        os.close(in_r)
+        os.close(out_w)
+    with os.fdopen(in_w, "wb") as f:
+        f.write(stdin)
+    with os.fdopen(out_r, "rb") as f:
+        output = f.read()
+    return process.wait(), output
+
+
+def test_spawn(launcher: Launcher):
+    assert run(launcher, ["tr", "a-z", "A-Z"], b"hello") == (0, b"HELLO")
+    assert run(launcher, ["sh", "-c", "exit 3"]) == (3, b"")
+    assert launcher.stats()["spawned"] == 2
+
+
+def test_spawn_uses_current_directory(launcher: Launcher, tmp_path):
+    start = os.getcwd()
+    try:
+        os.chdir(tmp_path)
+        assert run(launcher, ["pwd"]) == (0, f"{tmp_path}\n".encode())
+    finally:
+        os.chdir(start)
+
+
+def test_spawn_missing_program(launcher: Launcher):
+    with pytest.raises(FileNotFoundError):
+        launcher.spawn(["definitely-not-a-command-xyz"])
+
+
+def test_terminate(launcher: Launcher):
+    process = launcher.spawn(["sleep", "10"])
+    assert process.poll() is None
+    process.terminate()
+    assert process.wait() == 128 + signal.SIGTERM
+
+
+def test_killed_by_signal(launcher: Launcher):
+    assert run(launcher, ["sh", "-c", "kill -KILL $$"]) == (128 + signal.SIGKILL, b"")
+
+
+def test_sigpipe_is_default(launcher: Launcher):
+    # Python ignores SIGPIPE, but `yes` should still die when the pipe closes
+    r, w = os.pipe()
+    process = launcher.spawn(["yes"], stdout=w)
+    os.close(w)
+    os.read(r, 10)
+    os.close(r)
+    assert process.wait() == 128 + signal.SIGPIPE
+
+
+def test_spawn_stderr(launcher: Launcher, tmp_path):
+    with open(tmp_path / "errors.txt", "wb") as f:
+        process = launcher.spawn(["sh", "-c", "echo oops >&2"], stderr=f.fileno())
+        assert process.wait() == 0
+    assert (tmp_path / "errors.txt").read_bytes() == b"oops\n"
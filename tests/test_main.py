@@ -0,0 +1,59 @@
+from pathlib import Path
+
+import pytest
+
+from turtleshell.main import main
+
+
+def test_command(capfd):
+    assert main(["-c", "x = 5; print $x; echo from echo"]) == 0
+    assert capfd.readouterr().out == "5\nfrom echo\n"
+
+
+def test_exit_code_is_from_last_statement(capfd):
+    assert main(["-c", "print a; ls /definitely/not/here"]) != 0
+    assert main(["-c", "definitely-not-a-command-xyz"]) == 127
+    assert "command not found" in capfd.readouterr().err
+
+
+def test_exit_code_from_signal():
+    # 128 + SIGKILL, as `sh` reports it
+    assert main(["-c", 'sh -c "kill -KILL $$"']) == 137
+
+
+@pytest.mark.parametrize(
+    ("command", "error"),
+    [
+        ("kill", "kill: usage: kill [-s SIGNAL | -SIGNAL] TARGET...\n"),
+        ("kill -s FOO 1", "kill: FOO: invalid signal\n"),
+        ("kill 999999", "kill: 999999: [Errno 3] No such process\n"),
+        ("wait %9", "%9: no such job\n"),
+        ("cd /nonexistent", "[Errno 2] No such file or directory: '/nonexistent'\n"),
+        ("cd /nonexistent | cat", "[Errno 2] No such file or directory: '/nonexistent'\n"),
+        ("if (true) { cd /nonexistent }", "[Errno 2] No such file or directory: '/nonexistent'\n"),
+    ],
+)
+def test_builtin_errors_are_reported(command: str, error: str, capfd):
+    main(["-c", command])
+    assert capfd.readouterr().err == error
+
+
+def test_syntax_error(capfd):
+    assert main(["-c", "print ("]) == 2
+    assert capfd.readouterr().err.startswith("syntax error")
+
+
+def test_script(tmp_path: Path, capfd):
+    script = tmp_path / "script.tt"
+    script.write_text("# setup\nx = 1  # comment\nif ($x == 1) {\n  print one;\n}\nprint two\n")
+    assert main([str(script)]) == 0
+    assert capfd.readouterr().out == "one\ntwo\n"
+
+
+def test_missing_script(tmp_path: Path, capfd):
+    assert main([str(tmp_path / "nope.tt")]) == 127
+
+
+def test_command_and_script_are_exclusive(tmp_path: Path):
+    with pytest.raises(SystemExit):
+        main(["-c", "print a", str(tmp_path / "script.tt")])
@@ -0,0 +1,90 @@
+import pytest
+
+from turtleshell.multilines import (
+    LineLexer,
+    concatenate_incomplete_lines,
+    is_complete,
+    join_statements,
+    number_statements,
+)
+from turtleshell.parsing import parser
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("print hello", True),
+        ("if (x == 1) {", False),
+        ("if (x == 1) { print x }", True),
+        ('print "{"', True),
+        ('print "unfinished', False),
+        ('print "escaped \\" quote', False),
+        ("print '{' \\{", True),
+        ("print a \\", False),
+        ("print a \\\\", True),
+        ("x = $(print $(print a)", False),
+        ("x = [1, 2", False),
+        ("print a # {", True),
+        ("print a }", True),  # Syntax errors shouldn't wait for more input
+        ("{ print a ]", True),
+        ("{\n  print a # }\n", False),
+    ],
+)
+def test_is_complete(text: str, expected: bool):
+    assert is_complete(text) is expected
+
+
+def test_lexer_keeps_state_across_lines():
+    lexer = LineLexer()
+    assert not lexer.feed('foreach x in $(print "a)')
+    assert not lexer.feed('b") {')
+    assert not lexer.feed("  print $x  # }")
+    assert lexer.feed("}")
+
+
+def test_concatenate_incomplete_lines():
+    lines = ["if (x == 1) {", "  print a;  # a comment", "  print b \\", "    c;", "}"]
+    text = concatenate_incomplete_lines(lines)
+    assert text == "if (x == 1) {\nprint a;  # a comment\nprint b\nc;\n}"
+    assert is_complete(text)
+    parser.parse(text)  # The comment mustn't swallow the following lines
+
+
+def test_concatenate_string_across_lines():
+    assert concatenate_incomplete_lines(['print "a', '  b"']) == 'print "a   b"'
+
+
+def test_number_statements():
+    script = "\n".join(
+        [
+            "print a  # comment",
+            "",
+            "# just a comment",
+            "if ($x == 1) {",
+            "  print b;",
+            "}",
+            "else {",
+            "  print c;",
+            "}",
+            "do { x += 1 }",
+            "while ($x < 3)",
+            "print d \\",
+            "  e",
+        ]
+    )
+    assert number_statements(script) == [
+        (1, "print a  # comment"),
+        (4, "if ($x == 1) {\nprint b;\n}\nelse {\nprint c;\n}"),
+        (10, "do { x += 1 }\nwhile ($x < 3)"),
+        (12, "print d\ne"),
+    ]
+
+
+def test_join_statements_keeps_line_numbers():
+    script = "# setup\nx = 1\n\nif ($x == 1) {\n  print b;\n}\n\n\nprint c  # done\n"
+    statements = number_statements(script)
+    assert [number for number, _ in statements] == [2, 4, 9]
+    lines = join_statements(statements).split("\n")
+    for number, statement in statements:
+        assert lines[number - 1] == statement.split("\n")[0]
+    assert len(parser.parse("\n".join(lines)).children) == 3
@@ -0,0 +1,73 @@
+import pytest
+
+from turtleshell.datatypes import CommandResult
+from turtleshell.errors import OutputTooLarge
+from turtleshell.parsing import Pipeline, parser
+from turtleshell.pipeline import ExternalStage, read_output
+
+
+def test_pipeline_is_parsed():
+    token = parser.parse("cat file.txt | grep -v x | wc -l").children[0]
+    assert isinstance(token, Pipeline)
+    assert [c.name for c in token.commands] == ["cat", "grep", "wc"]
+    assert token.commands[1].options == ("-v", "x")
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ('print "hello" | wc -c', "6"),
+        ('print "a" | cat | cat | cat', "a"),
+        ("cwd | wc -l", "1"),
+    ],
+    ids=["builtin-to-external", "long-pipeline", "result-builtin"],
+)
+def test_pipeline_output(run, text: str, expected: str, capfd):
+    run(text)
+    assert capfd.readouterr().out.strip() == expected
+
+
+def test_pipeline_streams(run, tmp_path, capfd):
+    # `head` exits early; upstream should be cut off rather than hang or read everything
+    (tmp_path / "nums.txt").write_text("\n".join(str(i) for i in range(100_000)))
+    run(f"cat {tmp_path / 'nums.txt'} | head -n 2")
+    assert capfd.readouterr().out.split() == ["0", "1"]
+
+
+def test_read_output():
+    result = read_output([ExternalStage(["printf", "a\\nb\\n"]), ExternalStage(["tac"])])
+    assert result.code == 0
+    assert isinstance(result.stdout, memoryview)
+    assert result == "b\na\n"
+    assert str(result) == "b\na\n"
+
+
+def test_read_output_is_limited():
+    with pytest.raises(OutputTooLarge):
+        read_output([ExternalStage(["head", "-c", "5000", "/dev/zero"])], limit=1000)
+
+
+def test_command_result_compares_without_copying():
+    data = bytearray(b"x" * 100)
+    result = CommandResult(0, memoryview(data), None)
+    assert result == b"x" * 100
+    assert result == CommandResult(0, "x" * 100, None)
+    assert result != "x" * 99
+    assert result != 5
+
+
+def test_command_result_decodes_lazily():
+    result = CommandResult(0, b"caf\xc3\xa9", None)
+    assert result._text is None
+    assert result == "café"  # Compared as bytes
+    assert result._text is None
+    assert str(result) == "café"
+    assert str(result) is str(result)  # Cached
+
+
+def test_command_result_write_to():
+    written = []
+    CommandResult(0, b"no newline", None).write_to(written.append)
+    CommandResult(0, "newline\n", None).write_to(written.append)
+    CommandResult(0, None, None).write_to(written.append)
+    assert b"".join(written) == b"no newline\nnewline\n"
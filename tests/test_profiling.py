@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+
+from turtleshell import profiling, streams
+from turtleshell.evaluate import evaluate
+from turtleshell.main import main
+from turtleshell.multilines import join_statements, number_statements
+from turtleshell.parsing import parse_with_positions, parser
+from turtleshell.variables import EnvironmentVarHolder
+
+SCRIPT = """\
+x = 1
+for (i = 1; $i < 4; i += 1) {
+    x += $i
+}
+"""
+
+
+def parse_script(text: str):
+    return parse_with_positions(join_statements(number_statements(text)))
+
+
+def run_profiled(text: str) -> profiling.Profiler:
+    env = EnvironmentVarHolder()
+    profiler = profiling.start()
+    try:
+        for statement in parse_script(text):
+            evaluate(statement, env)
+    finally:
+        profiling.stop()
+        streams.flush()
+    return profiler
+
+
+def test_lines_are_recorded():
+    statements = parse_script(SCRIPT)
+    assert [statement.line for statement in statements] == [1, 2]
+    assert statements[1].body.line == 2
+    assert statements[1].body.statements[0].line == 3
+
+
+def test_profile_counts_calls():
+    profiler = run_profiled(SCRIPT)
+    assert profiler.statements[("Assignment", 3)].calls == 3
+    assert profiler.statements[("For", 2)].calls == 1
+    # The loop's own assignments are part of line 2's time, rather than being counted again
+    assert profiler.lines[2].calls == 1
+    assert profiler.lines[3].calls == 3
+    assert profiler.lines[2].wall >= profiler.lines[3].wall
+
+
+def test_child_process_time_is_recorded():
+    profiler = run_profiled('sh -c "i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done"')
+    ((label, line), stats), *_ = profiler.statements.items()
+    assert label.startswith("Command: sh -c")
+    assert stats.children > 0
+
+
+def test_disabled_profiling_leaves_statements_alone():
+    statement = parser.parse("x = 1").children[0]
+    compiled = statement.compiled()
+    profiler = run_profiled("x = 1")
+    assert statement.compiled() is compiled
+    assert profiler.statements[("Assignment", 1)].calls == 1
+
+
+def test_trace_events_are_capped(monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_TRACE_EVENTS", 5)
+    profiler = run_profiled(SCRIPT)
+    assert len(profiler.trace()["traceEvents"]) == 5
+    assert "left out of the trace" in profiler.report()
+
+
+def test_profile_option(tmp_path: Path, capfd):
+    script = tmp_path / "script.tt"
+    script.write_text("# comment\n\n" + SCRIPT + "print $x\n")
+    trace = tmp_path / "trace.json"
+    assert main(["--profile-trace", str(trace), str(script)]) == 0
+    out, err = capfd.readouterr()
+    assert out == "7\n"
+    assert "Command: print $x" in err
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert {event["args"]["line"] for event in events} == {3, 4, 5, 7}
+    assert all(event["ph"] == "X" for event in events)
@@ -0,0 +1,94 @@
+from concurrent.futures import wait
+import threading
+
+import pytest
+
+from turtleshell.errors import OutputTooLarge
+from turtleshell.parsing import ParseCache
+from turtleshell.prompt import (
+    Substitution,
+    Text,
+    Variable,
+    capture,
+    compile_prompt,
+    split_segments,
+)
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def test_prompt_template():
+    env = {"USER": "ben", "USERNAME": "benjamin", "CWD": "/tmp"}
+    template = compile_prompt("$USERNAME/$USER: $CWD $MISSING$ ")
+    assert template.render(env) == "benjamin/ben: /tmp $ "
+    assert compile_prompt("$USERNAME/$USER: $CWD $MISSING$ ") is template
+
+
+def test_split_segments():
+    segments = split_segments("$USER $(print $(print x)) $(")
+    assert [type(s) for s in segments] == [Variable, Text, Substitution, Text]
+    assert segments[2].source == "print $(print x)"
+    assert segments[3].text == " $("
+
+
+def test_substitution_updates_in_background():
+    env = EnvironmentVarHolder()
+    updated = threading.Event()
+    template = compile_prompt("[$(print hi)] ")
+    assert template.render(env) == "[] "  # Nothing yet
+    wait(template.refresh(env, updated.set))
+    assert updated.is_set()
+    assert template.render(env) == "[hi] "
+
+
+def test_substitution_timeout_keeps_value_for_next_prompt():
+    env = EnvironmentVarHolder()
+    updated = threading.Event()
+    segment = Substitution("print late", timeout=0)
+    segment.refresh(env, updated.set).result()
+    assert not updated.is_set()
+    assert segment.render(env) == "late"
+
+
+def test_failed_substitution_keeps_last_value():
+    env = EnvironmentVarHolder()
+    segment = Substitution("print ok")
+    segment.refresh(env, None).result()
+    segment.source = "definitely-not-a-command-xyz"
+    segment.refresh(env, None).result()
+    assert segment.render(env) == "ok"
+
+
+def test_capture_reads_nothing_from_terminal():
+    # `cat` would otherwise wait for input from the terminal
+    assert capture("cat", EnvironmentVarHolder()) == ""
+    assert capture("print a | cat", EnvironmentVarHolder()) == "a"
+
+
+def test_capture_is_limited():
+    with pytest.raises(OutputTooLarge):
+        capture("yes", EnvironmentVarHolder())
+
+
+def test_capture_runs_on_its_own():
+    env = EnvironmentVarHolder()
+    env["x"] = 1
+    assert capture("x = 2; print $x", env) == "2"
+    assert env["x"] == 1
+
+
+def test_parse_cache_is_thread_safe():
+    cache = ParseCache(size=4)
+    texts = [f"print {i}" for i in range(8)]
+
+    def parse_all():
+        for _ in range(200):
+            for text in texts:
+                cache.parse(text)
+
+    threads = [threading.Thread(target=parse_all) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.entries) == 4
+    assert cache.hits + cache.misses == 4 * 200 * 8
@@ -0,0 +1,62 @@
+import os
+from pathlib import Path
+
+from turtleshell import providers
+from turtleshell.builtins import get_builtin
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def counter():
+    calls = []
+
+    def func():
+        calls.append(None)
+        return len(calls)
+
+    return func
+
+
+def test_on_event_is_cached_until_invalidated():
+    provider = providers.OnEvent(counter(), "test-event")
+    assert provider.get() == 1
+    assert provider.get() == 1
+    providers.invalidate("test-event")
+    assert provider.get() == 2
+
+
+def test_ttl_expires(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(providers.time, "monotonic", lambda: now)
+    provider = providers.TTL(counter(), 5)
+    assert provider.get() == 1
+    now = 104.0
+    assert provider.get() == 1
+    now = 105.0
+    assert provider.get() == 2
+
+
+def test_per_prompt():
+    provider = providers.PerPrompt(counter())
+    assert provider.get() == provider.get() == 1
+    providers.new_prompt()
+    assert provider.get() == 2
+
+
+def test_prompt_date_is_kept_until_next_prompt():
+    env = EnvironmentVarHolder()
+    providers.new_prompt()
+    first = env["PROMPTDATE"]
+    assert env["PROMPTDATE"] is first
+    providers.new_prompt()
+    assert env["PROMPTDATE"] is not first
+
+
+def test_cd_invalidates_cwd(tmp_path: Path):
+    env = EnvironmentVarHolder()
+    start = os.getcwd()
+    try:
+        env["CWD"]  # Make sure the old value is cached
+        get_builtin("cd").run(str(tmp_path), env=env)
+        assert env["CWD"].value == tmp_path.resolve()
+    finally:
+        os.chdir(start)
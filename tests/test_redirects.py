@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from turtleshell.errors import RedirectError
+from turtleshell.parsing import Command, parser
+from turtleshell.pipeline import apply_redirects
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def test_redirects_are_parsed():
+    token = parser.parse("ls -l > out.txt 2>> errors.log 2>&1").children[0]
+    assert isinstance(token, Command)
+    assert token.options == ("-l",)
+    assert [str(r) for r in token.redirects] == ["> out.txt", "2>> errors.log", "2>&1"]
+    assert str(token) == "ls -l > out.txt 2>> errors.log 2>&1"
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["for (i = 1; $i < 3; i += 1) { print $i }", "if (2 > 1) { print yes }"],
+    ids=["less-than", "greater-than"],
+)
+def test_comparisons_still_work(run, text: str, capfd):
+    run(text)
+    assert capfd.readouterr().out
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("print hello > {out}", "hello\n"),
+        ("print one > {out}; print two >> {out}", "one\ntwo\n"),
+        ("echo hello > {out}", "hello\n"),
+        ("echo one > {out}; echo two >> {out}", "one\ntwo\n"),
+        ('sh -c "echo oops >&2" 2> {out}', "oops\n"),
+        ('sh -c "echo out; echo err >&2" > {out} 2>&1', "out\nerr\n"),
+        ("print hello | tr a-z A-Z > {out}", "HELLO\n"),
+        ("tr a-z A-Z <<< hello > {out}", "HELLO\n"),
+        ('wc -w <<< "one two three" > {out}', "3\n"),
+    ],
+    ids=[
+        "builtin",
+        "builtin-append",
+        "external",
+        "external-append",
+        "stderr",
+        "merge-stderr",
+        "end-of-pipeline",
+        "here-string",
+        "quoted-here-string",
+    ],
+)
+def test_redirect_output(run, text: str, expected: str, tmp_path, capfd):
+    out = tmp_path / "out.txt"
+    run(text.format(out=out))
+    assert out.read_text() == expected
+    assert capfd.readouterr().out == ""
+
+
+def test_redirect_input(run, tmp_path, capfd):
+    (tmp_path / "in.txt").write_text("b\na\n")
+    run(f"sort < {tmp_path / 'in.txt'}")
+    assert capfd.readouterr().out == "a\nb\n"
+
+
+def test_redirect_target_can_be_a_variable(run, tmp_path):
+    env = EnvironmentVarHolder()
+    env["out"] = str(tmp_path / "out.txt")
+    run("echo hello > $out", env)
+    assert (tmp_path / "out.txt").read_text() == "hello\n"
+
+
+def test_merge_order(run, tmp_path, capfd):
+    # As in `sh`, `2>&1` copies wherever stdout goes *at that point*
+    run(f'sh -c "echo out; echo err >&2" 2>&1 > {tmp_path / "out.txt"}')
+    assert (tmp_path / "out.txt").read_text() == "out\n"
+    assert capfd.readouterr().out == "err\n"
+
+
+def test_large_here_string(run, capfd):
+    env = EnvironmentVarHolder()
+    env["text"] = "x" * 1_000_000
+    run("wc -c <<< $text", env)
+    assert capfd.readouterr().out.strip() == "1000001"
+
+
+def test_missing_input_file(run, tmp_path):
+    with pytest.raises(RedirectError, match="No such file"):
+        run(f"cat < {tmp_path / 'missing.txt'}")
+
+
+def test_failed_redirect_closes_fds(tmp_path):
+    r, w = os.pipe()
+    with pytest.raises(RedirectError):
+        apply_redirects(
+            parser.parse(f"cat < {tmp_path / 'missing.txt'}").children[0].redirects, r, w
+        )
+    for fd in (r, w):
+        with pytest.raises(OSError):
+            os.fstat(fd)
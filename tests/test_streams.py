@@ -0,0 +1,55 @@
+import io
+
+from turtleshell import streams
+from turtleshell.streams import Sink
+
+
+class FakeTerminal(io.TextIOWrapper):
+    def __init__(self, tty: bool):
+        super().__init__(io.BytesIO(), encoding="utf-8")
+        self.tty = tty
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def output(self) -> bytes:
+        return self.buffer.getvalue()
+
+
+def test_sink_buffers_until_threshold():
+    terminal = FakeTerminal(tty=False)
+    sink = Sink(lambda: terminal, size=10)
+    sink.write("line\n")
+    assert terminal.output() == b""
+    sink.write(b"more\n")
+    assert terminal.output() == b"line\nmore\n"
+
+
+def test_sink_is_line_buffered_on_a_tty():
+    terminal = FakeTerminal(tty=True)
+    sink = Sink(lambda: terminal)
+    sink.write("partial ")
+    assert terminal.output() == b""
+    sink.write("line\n")
+    assert terminal.output() == b"partial line\n"
+
+
+def test_sink_keeps_order_with_print():
+    terminal = FakeTerminal(tty=False)
+    sink = Sink(lambda: terminal)
+    sink.write("first\n")
+    sink.flush()
+    terminal.write("second\n")
+    sink.write(b"third\n")
+    sink.flush()
+    assert terminal.output() == b"first\nsecond\nthird\n"
+
+
+def test_redirect():
+    out, err = io.BytesIO(), io.BytesIO()
+    with streams.redirect_stdout(out), streams.redirect_stderr(err):
+        streams.write("text ")
+        streams.write(b"\xffbytes")
+        streams.write_error("oops")
+    assert out.getvalue() == b"text \xffbytes"
+    assert err.getvalue() == b"oops"
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from turtleshell.errors import OutputTooLarge
+from turtleshell.parsing import Substitution, parser
+from turtleshell.variables import EnvironmentVarHolder
+
+
+def substitution(text: str) -> Substitution:
+    return parser.parse(f"x = $({text})").children[0].value
+
+
+def test_substitution_is_parsed():
+    token = parser.parse("print $(cwd -P)").children[0]
+    assert isinstance(token.options[0], Substitution)
+    assert str(token) == "print $(cwd -P)"
+
+
+@pytest.mark.parametrize(
+    ("text", "in_process"),
+    [
+        ("cwd", True),
+        ("print hello", True),
+        ("if (1 == 1) { print yes }", True),
+        ("echo hello", False),
+        ("print hello | tr a-z A-Z", False),
+        ("print hello > out.txt", False),
+    ],
+)
+def test_builtins_run_in_process(text: str, in_process: bool):
+    assert substitution(text).runs_in_process() == in_process
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("cwd", os.getcwd()),
+        ("print hello", "hello"),
+        ("echo hello", "hello"),
+        ("print hello | tr a-z A-Z", "HELLO"),
+        ("if (1 == 1) { print yes; echo no }", "yes\nno"),
+        ("print $(print $(cwd))", os.getcwd()),
+        ("x = 1", ""),
+    ],
+)
+def test_substitution(run, text: str, expected: str, capfd):
+    env = EnvironmentVarHolder()
+    run(f"value = $({text})", env)
+    assert env["value"] == expected
+    # Nothing escapes to the terminal
+    assert capfd.readouterr().out == ""
+
+
+def test_substitution_in_loop(run, capfd):
+    env = EnvironmentVarHolder()
+    run("for (i = 0; $i < 3; i += 1) { print $(print $i) -n }", env)
+    assert capfd.readouterr().out == "012"
+
+
+@pytest.mark.parametrize("text", ["yes", "print hello | yes", "if (1 == 1) { yes }", "seq 1000"])
+def test_output_is_limited(text: str):
+    env = EnvironmentVarHolder()
+    token = substitution(text)
+    token.limit = 100
+    with pytest.raises(OutputTooLarge):
+        token.eval(env)
+
+
+def test_builtin_output_is_limited():
+    env = EnvironmentVarHolder()
+    env["long"] = "x" * 200
+    token = substitution("print $long")
+    token.limit = 100
+    with pytest.raises(OutputTooLarge):
+        token.eval(env)
+
+
+def test_assignments_stay_inside(run, capfd):
+    env = EnvironmentVarHolder()
+    run("x = 1; y = $(x = 5); z = $(if (1 == 1) { x = 6; print $x }); print $x", env)
+    assert env["z"] == "6"
+    assert capfd.readouterr().out == "1\n"
+
+
+def test_cd_stays_inside(run, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    env = EnvironmentVarHolder()
+    run("y = $(cd /)", env)
+    assert os.getcwd() == str(tmp_path)
+    run("y = $(if (1 == 1) { cd /; cwd })", env)
+    assert env["y"] == "/"
+    assert os.getcwd() == str(tmp_path)
+    run("y = $(cd / | cat)", env)
+    assert os.getcwd() == str(tmp_path)
+
+
+def test_compound_statement_of_builtins(run, tmp_path):
+    env = EnvironmentVarHolder()
+    run(f"x = $(if (true) {{ cd {tmp_path}; cwd; hash -s }})", env)
+    assert env["x"] == f"{tmp_path}\nhits: 0\nmisses: 0\nhashed: 0"
+    run("y = $(for (i = 0; $i < 3; i += 1) { cwd })", env)
+    assert env["y"] == "\n".join([os.getcwd()] * 3)
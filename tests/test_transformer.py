@@ -1,6 +1,10 @@
+import os
+
+from lark import Tree
 import pytest
 
 import turtleshell.parsing as parsing
+from turtleshell.variables import EnvironmentVarHolder
 
 
 @pytest.mark.parametrize(
@@ -12,3 +16,132 @@ def test_assignment(operator: str, new_val: int):
     string = f"x {operator} 2"
     token = parsing.parser.parse(string).children[0]
     assert token.func(10, 2) == new_val
+
+
+LOOPS = [
+    "total = 1; for (i = 1; $i <= 5; i += 1) { total *= $i }",
+    "total = 1; i = 1; while ($i <= 5) do { total *= $i; i += 1 }",
+    "total = 1; i = 1; do { total *= $i; i += 1 } while ($i <= 5)",
+    "total = 2; if ($total == 1) { total = 1 } elif $total == 2 { total = 120 } else { total = 3 }",
+    "total = 5; if (true) { total *= 24 } else { total = 0 }",
+]
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+@pytest.mark.parametrize("text", LOOPS, ids=["for", "while-do", "do-while", "elif", "constant-if"])
+def test_control_flow(text: str, mode: str):
+    """The tree-walking and compiled evaluators should give the same results."""
+    env = EnvironmentVarHolder()
+    for token in parsing.parser.parse(text).children:
+        if mode == "eval":
+            token.eval(env)
+        else:
+            token.compiled()(env)
+    assert env["total"] == 120
+
+
+COMPOSITE_CONDITIONS = [
+    "total = 120; x = 1; if ($x == 2 and $x == 3) { total = 0 }",
+    "total = 0; x = 1; if ($x == 2 or $x == 1) { total = 120 }",
+    "total = 0; x = 1; if ($x == 5) { total = 1 } elif $x == 2 or $x == 1 { total = 120 }",
+    "total = 120; x = 1; while ($x == 2 or $x == 3) do { total = 0 }",
+    "total = 1; i = 1; while ($i <= 5 and $total < 1000) do { total *= $i; i += 1 }",
+    "total = 120; for (i = 0; $i < 3 and $i > 5; i += 1) { total = 0 }",
+    "total = 1; for (i = 1; $i == 0 or $i <= 5; i += 1) { total *= $i }",
+    "total = 120; x = 1; if (($x == 1 or $x == 2) and ($x != 1)) { total = 0 }",
+]
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+@pytest.mark.parametrize(
+    "text",
+    COMPOSITE_CONDITIONS,
+    ids=["if-and", "if-or", "elif-or", "while-or", "while-and", "for-and", "for-or", "nested"],
+)
+def test_composite_conditions(text: str, mode: str):
+    env = EnvironmentVarHolder()
+    for token in parsing.parser.parse(text).children:
+        if mode == "eval":
+            token.eval(env)
+        else:
+            token.compiled()(env)
+    assert env["total"] == 120
+
+
+class Unreachable(parsing.Token):
+    def eval(self, env):
+        raise AssertionError("evaluated the right-hand side")
+
+
+def test_composite_conditions_short_circuit():
+    for token in (parsing.And(False, Unreachable()), parsing.Or(True, Unreachable())):
+        assert token.eval(None) == token.compiled()(None) == isinstance(token, parsing.Or)
+
+
+def test_untransformed_condition_is_rejected():
+    with pytest.raises(TypeError):
+        parsing.NestedConditional(Tree("composite_conditional", []))
+
+
+BLOCKS = [
+    "if (true) { {cmd} }",
+    "if (false) { print x } elif true { {cmd} }",
+    "if (false) { print x } else { {cmd} }",
+    "for (i = 0; $i < 2; i += 1) { {cmd} }",
+    "i = 0; while ($i < 2) do { {cmd}; i += 1 }",
+    "i = 0; do { i += 1; {cmd} } while ($i < 2)",
+    "xs = [1, 2]; foreach x in xs { {cmd} }",
+    "for (i = 0; $i < 2; i += 1) { if (true) { {cmd} } }",
+]
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+@pytest.mark.parametrize(
+    "text", BLOCKS, ids=["if", "elif", "else", "for", "while-do", "do-while", "foreach", "nested"]
+)
+def test_blocks_write_results(run, text: str, mode: str, capfd):
+    """Builtins like `cwd` return their output rather than writing it, so blocks write it out."""
+    times = 2 if "$i" in text or "foreach" in text else 1
+    run(text.replace("{cmd}", "cwd"), mode=mode)
+    assert capfd.readouterr().out == f"{os.getcwd()}\n" * times
+    run(text.replace("{cmd}", "hash -s"), mode=mode)
+    assert capfd.readouterr().out == "hits: 0\nmisses: 0\nhashed: 0\n" * times
+
+
+def test_if_returns_exit_code(run, capfd):
+    result = run("if (true) { cwd; false }")
+    assert result.code == 1
+    assert capfd.readouterr().out == f"{os.getcwd()}\n"
+
+
+def test_constant_conditions_are_folded():
+    token = parsing.parser.parse('if (1 < 2) { print "yes" }').children[0]
+    assert isinstance(token.conditional.conditional, parsing.BinaryOperation)
+    assert token.conditional.compiled()(None) is True
+
+
+def test_parse_cache_reuses_statements():
+    cache = parsing.ParseCache(size=2)
+    first = cache.parse("x = 1")
+    assert cache.parse("  x = 1 ") is first
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "size": 2}
+
+
+def test_parse_cache_evicts_least_recently_used():
+    cache = parsing.ParseCache(size=2)
+    cache.parse("x = 1")
+    cache.parse("x = 2")
+    cache.parse("x = 1")
+    cache.parse("x = 3")
+    assert list(cache.entries) == ["x = 1", "x = 3"]
+    cache.resize(1)
+    assert list(cache.entries) == ["x = 3"]
+
+
+def test_cached_statements_can_be_rerun():
+    cache = parsing.ParseCache()
+    env = EnvironmentVarHolder()
+    for _ in range(2):
+        for token in cache.parse("total = 1; for (i = 1; $i <= 5; i += 1) { total *= $i }"):
+            token.compiled()(env)
+        assert env["total"] == 120
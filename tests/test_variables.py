@@ -0,0 +1,125 @@
+import os
+import pathlib
+
+import pytest
+
+from turtleshell.errors import InvalidAssignment
+from turtleshell.variables import EnvironmentVarHolder, getter, setter, slot
+
+
+@pytest.mark.parametrize("value", [0, False, None, ""])
+def test_falsy_values_are_kept(value):
+    env = EnvironmentVarHolder()
+    env["x"] = value
+    env["PARSECACHESIZE"] = value
+    assert env["x"] is value
+    assert env["PARSECACHESIZE"] is value
+    assert getter("x")(env) is value
+
+
+def test_unset_variables():
+    env = EnvironmentVarHolder()
+    assert env["never-set"] == ""
+    assert env["PARSECACHESIZE"] == 256
+    env["x"] = 1
+    del env["x"]
+    assert env["x"] == ""
+    assert "x" not in list(env)
+    with pytest.raises(KeyError):
+        del env["x"]
+
+
+def test_read_only_variables():
+    env = EnvironmentVarHolder()
+    with pytest.raises(InvalidAssignment):
+        setter("CWD")(env, 1)
+    with pytest.raises(InvalidAssignment):
+        del env["CWD"]
+
+
+def test_slots_added_after_the_environment():
+    env = EnvironmentVarHolder()
+    env["x"] = 1
+    set_ = setter("a-brand-new-variable")
+    set_(env, 2)
+    assert env["a-brand-new-variable"] == 2
+    assert slot("a-brand-new-variable") == slot("a-brand-new-variable")
+    assert sorted(env) == ["a-brand-new-variable", "x"]
+
+
+def test_fork_is_a_snapshot():
+    env = EnvironmentVarHolder()
+    env["x"] = 1
+    child = env.fork()
+    child["x"] = 2
+    env["y"] = 3
+    assert (env["x"], child["x"], child["y"]) == (1, 2, "")
+    assert child.executables is env.executables
+
+
+def test_frames_restore_values():
+    env = EnvironmentVarHolder()
+    env["x"] = 1
+    frame = env.push_frame([slot("x"), slot("y")])
+    env["x"] = 2
+    env["y"] = 3
+    env.pop_frame(frame)
+    assert (env["x"], env["y"]) == (1, "")
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+def test_loop_variables_are_local(run, mode: str):
+    env = EnvironmentVarHolder()
+    env["i"] = "outer"
+    run("total = 0; for (i = 0; $i < 3; i += 1) { total += $i; last = $i }", env, mode)
+    assert (env["i"], env["total"], env["last"]) == ("outer", 3, 2)
+
+
+def test_foreach_variable_is_restored_after_break(run):
+    env = EnvironmentVarHolder()
+    env["ITEMS"] = [1, 2, 3]
+    env["x"] = "outer"
+    run("foreach x in ITEMS { seen = $x; if ($x == 2) { break } }", env)
+    assert (env["x"], env["seen"]) == ("outer", 2)
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+def test_list_accumulation(run, mode: str):
+    env = EnvironmentVarHolder()
+    run("xs = []; for (i = 0; $i < 5; i += 1) { xs += [$i, 0.5] }; xs *= 2", env, mode)
+    assert env["xs"] == [0, 1, 2, 1, 4, 1, 6, 1, 8, 1]
+    assert env["xs"].value.typecode == "d"
+
+
+@pytest.mark.parametrize("mode", ["eval", "compiled"])
+def test_lists_are_values(run, mode: str):
+    env = EnvironmentVarHolder()
+    run("xs = [1, 2]; ys = $xs; ys += [3]; xs *= 10", env, mode)
+    assert (env["xs"], env["ys"]) == ([10, 20], [1, 2, 3])
+
+    child = env.fork()
+    run("xs += [30]", child, mode)
+    assert (env["xs"], child["xs"]) == ([10, 20], [10, 20, 30])
+
+
+def test_foreach_over_changing_list(run):
+    env = EnvironmentVarHolder()
+    run("xs = [1, 2]; foreach x in xs { xs += [$x] }", env)
+    assert env["xs"] == [1, 2, 1, 2]
+
+
+def test_path_can_be_a_string(run, tmp_path):
+    env = EnvironmentVarHolder()
+    env["PATH"] = f"{tmp_path}{os.pathsep}/bin"
+    assert list(env["PATH"]) == [str(tmp_path), "/bin"]
+    run('PATH += "/usr/bin"', env)
+    assert list(env["PATH"]) == [str(tmp_path), "/bin", "/usr/bin"]
+    assert env.get_executable("sh").parent in (pathlib.Path("/bin"), pathlib.Path("/usr/bin"))
+
+
+def test_contains():
+    env = EnvironmentVarHolder()
+    assert "x" not in env
+    env["x"] = 0
+    assert "x" in env
+    assert "PATH" in env and "CWD" in env
@@ -1,16 +1,250 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
-import argparse
 import os
 from pathlib import Path
-from typing import Any, Callable
+import signal
+from typing import TYPE_CHECKING, Any, Callable
 
+from turtleshell import providers, streams
 from turtleshell.datatypes import CommandResult
 from turtleshell.errors import ArgumentError
+from turtleshell.jobs import scheduler
+from turtleshell.launcher import launcher
 
-_BUILTINS = {}
+if TYPE_CHECKING:
+    from turtleshell.variables import EnvironmentVarHolder
+
+BUILTINS: dict[str, Command] = {}
+
+_MISSING = object()
+
+
+def builtin(cls: type[Command]) -> type[Command]:
+    """Class decorator which registers a builtin command. Each builtin is only instantiated once, so
+    builtins mustn't hold on to any state between runs."""
+    BUILTINS[cls.name] = cls()
+    return cls
+
+
+def get_builtin(name: str) -> Command | None:
+    return BUILTINS.get(name)  # Return None if no builtin has this name
+
+
+class ArgNamespace:
+    """The result of parsing arguments. Each ArgParser creates a subclass of this with a slot for
+    each destination, so looking up a parsed value is just an attribute access."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.as_dict()})"
+
+
+class CmdArg:
+    def eval(self, arg: Any) -> dict:
+        pass
+
+
+class ArgPos(CmdArg):
+    def __init__(self, name: str, dest: str = None, coerce: Callable = None, default=_MISSING):
+        self.name = name
+        self.dest = dest if dest else name
+        self.coerce = coerce
+        self.default = default  # If not given, the arg is left unset when missing
+
+    def eval(self, arg: Any) -> dict:
+        return {self.dest: self.coerce(arg) if self.coerce is not None else arg}
+
+
+class ArgFlag(CmdArg):
+    """Represents a boolean flag that is either enabled or disabled when passed as an argument."""
+
+    def __init__(self, dest: str, store_true: bool = True):
+        self.dest = dest
+        self.store_true = store_true
+
+    def eval(self, is_present: bool) -> dict:
+        # Also return 'true' if we want to store false, but it isn't present
+        return {self.dest: is_present == self.store_true}
+
+
+class ArgOpt(CmdArg):
+    """Represents an option with 1 or more parameters."""
+
+    def __init__(self, dest: str, nargs: int, coerce: Callable = None):
+        self.dest = dest
+        self.nargs = nargs
+        self.coerce = coerce
+
+    def eval(self, *args) -> dict:
+        return {self.dest: [self.coerce(arg) if self.coerce else arg for arg in args]}
+
+
+class ArgRest(CmdArg):
+    """Collects the arguments which aren't options (or their parameters), wherever they are, e.g.
+    the pattern and files in `grep -i PATTERN FILE`. Options only take as many parameters as they
+    need, so anything after that is collected too."""
+
+    def __init__(self, dest: str, coerce: Callable = None):
+        self.dest = dest
+        self.coerce = coerce
+
+    def eval(self, *args) -> dict:
+        return {self.dest: [self.coerce(arg) if self.coerce else arg for arg in args]}
+
+
+class ArgParser:
+    def __init__(self):
+        self.args: list[ArgPos] = []
+        self.kwargs: dict[str, CmdArg] = {}
+        self.flags: list[ArgFlag] = []
+        self.rest: ArgRest | None = None
+        self._namespace: type[ArgNamespace] | None = None
+
+    def add_argument(
+        self,
+        arg: CmdArg,
+        *names: str,
+    ):
+        if isinstance(arg, ArgPos):
+            self.args.append(arg)
+        elif isinstance(arg, ArgRest):
+            self.rest = arg
+        else:
+            if isinstance(arg, ArgFlag):
+                self.flags.append(arg)
+            for name in names:
+                self.kwargs[name] = arg
+        # The spec has changed, so it needs compiling again
+        self._namespace = None
+
+    def is_arg(self, value: Any) -> bool:
+        """Return if the value indicates a flag or the beginning of a set of options."""
+        return isinstance(value, str) and value.startswith("-")
+
+    def compile(self):
+        """Work out everything about the spec that doesn't depend on the arguments, so that
+        parsing only needs a dict lookup per argument."""
+        dests = [arg.dest for arg in self.args]
+        dests += [arg.dest for arg in self.kwargs.values()]
+        if self.rest is not None:
+            dests.append(self.rest.dest)
+        self._namespace = type(
+            "ArgNamespace", (ArgNamespace,), {"__slots__": tuple(dict.fromkeys(dests))}
+        )
+
+        # A destination can be shared by several flags (e.g. `-e` and `-E`); it's disabled by
+        #   default if the first flag enables it, and vice versa
+        defaults: dict[str, Any] = {}
+        for flag in self.flags:
+            defaults.setdefault(flag.dest, not flag.store_true)
+        for arg in self.kwargs.values():
+            if isinstance(arg, ArgOpt):
+                defaults.setdefault(arg.dest, None)
+        for arg in self.args:
+            if arg.default is not _MISSING:
+                defaults[arg.dest] = arg.default
+        self._defaults = tuple(defaults.items())
+
+        # Single-character flags can be combined, e.g. `-ne` means `-n -e`
+        self._short_flags = {
+            name[1]: arg
+            for name, arg in self.kwargs.items()
+            if len(name) == 2 and name[0] == "-" and name[1] != "-" and isinstance(arg, ArgFlag)
+        }
+        self._positionals = tuple((arg.dest, arg.coerce) for arg in self.args)
+        self._rest = (self.rest.dest, self.rest.coerce) if self.rest is not None else None
+
+    def parse_args(self, *args: Any) -> ArgNamespace:
+        if self._namespace is None:
+            self.compile()
+
+        namespace = self._namespace()
+        for dest, value in self._defaults:
+            setattr(namespace, dest, value)
+
+        # Positional args come first
+        n_positional_args = len(self._positionals)
+        for (dest, coerce), value in zip(self._positionals, args):
+            setattr(namespace, dest, coerce(value) if coerce is not None else value)
+
+        option: ArgOpt | None = None  # The option we're collecting parameters for
+        params: list[Any] = []
+        rest: list[Any] | None = [] if self._rest is not None else None
+        options_ended = False
+        for value in args[n_positional_args:]:
+            if options_ended or not (isinstance(value, str) and value.startswith("-")):
+                if option is not None and (rest is None or len(params) < option.nargs):
+                    # This is a parameter for the current option
+                    params.append(value)
+                elif rest is not None:
+                    rest.append(value)
+                else:
+                    raise ArgumentError(f"Expected new argument; got {value}")
+                continue
+
+            if value == "--":
+                options_ended = True
+                continue
+
+            if option is not None:
+                self._store_option(namespace, option, params)
+                option, params = None, []
+
+            arg = self.kwargs.get(value)
+            if arg is None:
+                if value.startswith("--") and "=" in value:
+                    # `--opt=value`
+                    name, param = value.split("=", 1)
+                    if isinstance(arg := self.kwargs.get(name), ArgOpt):
+                        option, params = arg, [param]
+                        continue
+                elif len(value) > 2 and value[1] != "-":
+                    # Combined short flags, e.g. `-ne` means `-n -e`
+                    flags = [self._short_flags.get(char) for char in value[1:]]
+                    if all(flags):
+                        for flag in flags:
+                            setattr(namespace, flag.dest, flag.store_true)
+                        continue
+                raise ArgumentError(f"Unrecognized arg '{value}'")
+
+            if isinstance(arg, ArgFlag):
+                setattr(namespace, arg.dest, arg.store_true)
+            else:
+                option = arg
+
+        if option is not None:
+            self._store_option(namespace, option, params)
+        if rest is not None:
+            dest, coerce = self._rest
+            setattr(namespace, dest, [coerce(value) for value in rest] if coerce else rest)
+
+        return namespace
+
+    def _store_option(self, namespace: ArgNamespace, option: ArgOpt, params: list[Any]):
+        if len(params) != option.nargs:
+            raise ArgumentError(f"Expected {option.nargs} value(s) for '{option.dest}'")
+        coerce = option.coerce
+        setattr(namespace, option.dest, [coerce(p) for p in params] if coerce else params)
 
 
 class Command(ABC):
+    # Whether this builtin changes the working directory, which a command substitution (like
+    #   `$(if (true) { cd /tmp; cwd })`) has to put back afterwards
+    changes_cwd = False
+
     def __init__(self):
         self.setup_parser()
 
@@ -28,6 +262,7 @@ class Command(ABC):
         pass
 
 
+@builtin
 class Print(Command):
     name = "print"
 
@@ -61,12 +296,13 @@ class Print(Command):
         self.parser.add_argument(ArgFlag("enable_escapes", store_true=True), "-e")
         self.parser.add_argument(ArgFlag("enable_escapes", store_true=False), "-E")
 
-    def run(self, *args: str) -> None:
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> None:
         parsed = self.parser.parse_args(*args)
-        line_ending = "\n" if parsed["trailing_newline"] else ""
-        print(parsed["string"], end=line_ending)
+        line_ending = "\n" if parsed.trailing_newline else ""
+        streams.write(parsed.string + line_ending)
 
 
+@builtin
 class CWD(Command):
     name = "cwd"
 
@@ -82,160 +318,223 @@ class CWD(Command):
         self.parser = ArgParser()
         self.parser.add_argument(ArgFlag("allow_symlinks", store_true=False), "-P", "--physical")
 
-    def run(self, *args: str) -> None:
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> None:
         parsed = self.parser.parse_args(*args)
         out, err = "", ""
         try:
-            out = cwd(parsed["allow_symlinks"])
+            out = cwd(parsed.allow_symlinks)
         except Exception as e:
             err = str(e)
         return CommandResult(1 if err else 0, out, err)
 
 
+@builtin
 class CD(Command):
     name = "cd"
+    changes_cwd = True
 
     def setup_parser(self):
-        parser = argparse.ArgumentParser(
-            prog="cd",
-            description="change the shell working directory",
-        )
-        parser.add_argument("dir")
-        self.parser = parser
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgPos("dir", coerce=str, default="~"))
 
-    def run(self, *args: str) -> None:
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> None:
         parsed = self.parser.parse_args(*args)
         err = ""
         try:
             d = Path(parsed.dir).expanduser().resolve()
             os.chdir(d)
+            providers.invalidate("chdir")
         except FileNotFoundError as e:
             err = str(e)
         return CommandResult(1 if err else 0, "", err)
 
 
-def cwd(allow_symlinks: bool = True) -> str:
-    current_dir = Path(os.getcwd())
-    if not allow_symlinks:
-        current_dir = current_dir.resolve()
-    return str(current_dir)
+@builtin
+class Hash(Command):
+    name = "hash"
 
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("forget", store_true=True), "-r")
+        self.parser.add_argument(ArgFlag("stats", store_true=True), "-s", "--stats")
 
-class CmdArg:
-    def eval(self, arg: Any) -> dict:
-        pass
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        parsed = self.parser.parse_args(*args)
+        cache = env.executables
+        if parsed.forget:
+            cache.clear()
+            return CommandResult(0, "", "")
+        if parsed.stats:
+            stats = cache.stats()
+            return CommandResult(0, "\n".join(f"{k}: {v}" for k, v in stats.items()), "")
+
+        if not cache.hashed:
+            return CommandResult(0, "hash: hash table empty", "")
+        lines = ["hits\tcommand"]
+        for name, path in cache.hashed.items():
+            lines.append(f"{cache.hit_counts[name]:4}\t{path}")
+        return CommandResult(0, "\n".join(lines), "")
+
+
+@builtin
+class Rehash(Command):
+    name = "rehash"
 
+    def setup_parser(self):
+        self.parser = ArgParser()
 
-class ArgPos(CmdArg):
-    def __init__(self, name: str, dest: str = None, coerce: Callable = None):
-        self.name = name
-        self.dest = dest if dest else name
-        self.coerce = coerce
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        self.parser.parse_args(*args)
+        env.executables.clear()
+        return CommandResult(0, "", "")
 
-    def eval(self, arg: Any) -> dict:
-        return {self.dest: self.coerce(arg) if self.coerce is not None else arg}
 
+@builtin
+class ParseCacheStats(Command):
+    name = "parsecache"
 
-class ArgFlag(CmdArg):
-    """Represents a boolean flag that is either enabled or disabled when passed as an argument."""
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("clear", store_true=True), "-c", "--clear")
 
-    def __init__(self, dest: str, store_true: bool = True):
-        self.dest = dest
-        self.store_true = store_true
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        # Imported here, since the parser depends on this module
+        from turtleshell.parsing import parse_cache
 
-    def eval(self, is_present: bool) -> dict:
-        # Also return 'true' if we want to store false, but it isn't present
-        return {self.dest: is_present == self.store_true}
+        parsed = self.parser.parse_args(*args)
+        if parsed.clear:
+            parse_cache.clear()
+            return CommandResult(0, "", "")
+        stats = parse_cache.stats()
+        return CommandResult(0, "\n".join(f"{k}: {v}" for k, v in stats.items()), "")
 
 
-class ArgOpt(CmdArg):
-    """Represents an option with 1 or more parameters."""
+@builtin
+class SpawnStats(Command):
+    name = "spawnstats"
 
-    def __init__(self, dest: str, nargs: int, coerce: Callable = None):
-        self.dest = dest
-        self.nargs = nargs
-        self.coerce = coerce
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("clear", store_true=True), "-c", "--clear")
 
-    def eval(self, *args) -> dict:
-        return [self.coerce(arg) if self.coerce else arg for arg in args]
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        parsed = self.parser.parse_args(*args)
+        if parsed.clear:
+            launcher.clear_stats()
+            return CommandResult(0, "", "")
+        stats = launcher.stats()
+        return CommandResult(0, "\n".join(f"{k}: {v}" for k, v in stats.items()), "")
 
 
-class ArgParser:
-    def __init__(self):
-        self.args: list[CmdArg] = []
-        self.kwargs: dict[str, CmdArg] = {}
-        self.flags: list[ArgFlag] = []
+@builtin
+class Jobs(Command):
+    name = "jobs"
 
-    def add_argument(
-        self,
-        arg: CmdArg,
-        *names: str,
-    ):
-        if isinstance(arg, ArgPos):
-            self.args.append(arg)
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("show_pids", store_true=True), "-l")
+
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        parsed = self.parser.parse_args(*args)
+        lines = []
+        for job in list(scheduler.jobs.values()):
+            line = str(job)
+            if parsed.show_pids:
+                line = f"{line}  ({', '.join(str(pid) for pid in job.pids)})"
+            lines.append(line)
+        scheduler.reap()  # Finished jobs have now been reported
+        return CommandResult(0, "\n".join(lines), "")
+
+
+@builtin
+class Wait(Command):
+    name = "wait"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgPos("job", coerce=str, default=None))
+
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        parsed = self.parser.parse_args(*args)
+        if parsed.job is None:
+            jobs = list(scheduler.jobs.values())
         else:
-            if isinstance(arg, ArgFlag):
-                self.flags.append(arg)
-            for name in names:
-                self.kwargs[name] = arg
+            jobs = [scheduler.get(parsed.job)]
 
-    def is_arg(self, value: Any) -> bool:
-        """Return if the value indicates a flag or the beginning of a set of options."""
-        return isinstance(value, str) and value.startswith("-")
+        result = CommandResult(0, "", "")
+        for job in jobs:
+            result = job.wait()
+            scheduler.remove(job)
+        # The exit code is that of the last job waited for
+        return CommandResult(result.code, "", "")
 
-    def parse_args(self, *args: Any):
-        argspace = {}
-
-        # Get positional args first
-        n_positional_args = len(self.args)
-        for arg, val in zip(self.args, args[:n_positional_args]):
-            argspace.update(arg.eval(val))
-
-        # Do other args
-        flags = set()
-        arg_buffer = []
-        arg: CmdArg = None
-        idx = n_positional_args
-        for value in args[idx:]:
-            # There are exactly 3 posibilities:
-            # 1) this is a flag, and can be handled entirely inside a single loop
-            # 2) this is the beginning of an option
-            # 3) this is a parameter for a previous option
-            # We must handle these separately.
-
-            # First, check if we are expecting a new argument definitioon (opt 1 or 2)
-            if not arg and not self.is_arg(value):
-                raise ArgumentError(f"Expected new argument; got {value}")
-
-            # Otherwise, check if this is a new arg, and we need to wrap up our previous one
-            if self.is_arg(value):
-                if arg:
-                    # Wrap up previous arg
-                    argspace.update(arg.eval(*arg_buffer))
-
-                # If the new arg is unrecognized
-                arg_buffer = []
-                arg = self.kwargs.get(value)
-                if not arg:
-                    raise ArgumentError(f"Unrecognized arg '{value}'")
-
-                # If the new arg is a flag
-                if isinstance(arg, ArgFlag):
-                    flags.add(arg)
-                    arg = None
-
-                # Else, continue to next value
-                continue
 
-            # Lastly, if this is a parameter for the current argument
-            arg_buffer.append(value)
+@builtin
+class Fg(Command):
+    name = "fg"
 
-        # At the end of the loop, if there's anything left in the arg buffer, we shoudl evaluate it
-        if arg:
-            argspace.update(arg.eval(*arg_buffer))
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgPos("job", coerce=str, default=None))
+
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        parsed = self.parser.parse_args(*args)
+        job = scheduler.get(parsed.job)
+        streams.write(job.text + "\n")
+        try:
+            result = job.wait()
+        except KeyboardInterrupt:
+            # The job is in the foreground now, so Ctrl-C is meant for it
+            job.kill(signal.SIGINT)
+            result = job.wait()
+        scheduler.remove(job)
+        return CommandResult(result.code, "", "")
 
-        # Lastly, evaluate any flags
-        for flag in self.flags:
-            argspace.update(flag.eval(flag in flags))
 
-        return argspace
+@builtin
+class Kill(Command):
+    name = "kill"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgOpt("signal", nargs=1, coerce=str), "-s", "--signal")
+        self.parser.add_argument(ArgRest("targets", coerce=str))
+
+    def run(self, *args: str, env: EnvironmentVarHolder = None) -> CommandResult:
+        # `kill -9 %1` and `kill -KILL %1` give the signal in place of an option
+        first = args[0] if args else None
+        if isinstance(first, str) and first[:1] == "-" and first != "-s" and first[1:2] not in "-":
+            args = ("-s", first[1:], *args[1:])
+        parsed = self.parser.parse_args(*args)
+        if not parsed.targets:
+            return CommandResult(2, "", "kill: usage: kill [-s SIGNAL | -SIGNAL] TARGET...")
+
+        sig = signal.SIGTERM
+        if parsed.signal is not None:
+            name = parsed.signal[0].upper()
+            try:
+                if name.isdigit():
+                    sig = signal.Signals(int(name))
+                else:
+                    sig = signal.Signals[name if name.startswith("SIG") else "SIG" + name]
+            except (KeyError, ValueError):
+                return CommandResult(1, "", f"kill: {parsed.signal[0]}: invalid signal")
+
+        errors = []
+        for target in parsed.targets:
+            try:
+                if target.startswith("%"):
+                    scheduler.get(target).kill(sig)
+                else:
+                    os.kill(int(target), sig)
+            except (ValueError, ProcessLookupError) as e:
+                errors.append(f"kill: {target}: {e}")
+        return CommandResult(1 if errors else 0, "", "\n".join(errors))
+
+
+def cwd(allow_symlinks: bool = True) -> str:
+    # This is called a lot (e.g. `$(cwd)` in a prompt), so it sticks to strings rather than Paths
+    current_dir = os.getcwd()
+    if not allow_symlinks:
+        current_dir = os.path.realpath(current_dir)
+    return current_dir
@@ -0,0 +1,322 @@
+"""Tab completion for commands, paths and variables.
+
+Command names are kept in a prefix trie, built from every directory on the PATH (plus the builtins),
+so completing one never means scanning the PATH. The trie is kept up to date in the background:
+every so often each PATH directory is checked for changes (with one `stat`), and only the
+directories which have changed are scanned again.
+
+Directory listings for path completion are cached the same way: a cached listing is used straight
+away, and checked for changes in the background.
+"""
+
+from __future__ import annotations
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, Sequence
+
+from prompt_toolkit.completion import Completer, Completion
+
+from turtleshell.builtins import BUILTINS
+from turtleshell.executables import DirectoryIndex
+from turtleshell.variables import DEFAULT_VALUES, SHELL_VARS, EnvironmentVarHolder
+
+if TYPE_CHECKING:
+    from prompt_toolkit.completion import CompleteEvent
+    from prompt_toolkit.document import Document
+
+# How often to check whether directories have changed, in seconds
+REFRESH_INTERVAL = 1.0
+
+# How long the first completion waits for the PATH to be indexed, before making do without it
+FIRST_INDEX_WAIT = 1.0
+
+# Don't offer more completions than this (there could be thousands for a short prefix)
+MAX_COMPLETIONS = 200
+
+# How many directory listings to remember
+LISTING_CACHE_SIZE = 64
+
+# The word being completed, and what comes before a command (rather than an argument)
+WORD = re.compile(r"[^\s|;&(){}<>]*$")
+COMMAND_POSITION = re.compile(r"(^|[|;&({])\s*$")
+
+END = ""  # Marks the end of a word in the trie (every other key is a single character)
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # One thread is plenty, and means updates never race with each other
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="completion")
+    return _executor
+
+
+class PrefixTrie:
+    """A set of words which can be searched by prefix.
+
+    A word can be added more than once (e.g. a command in two PATH directories), and stays in the
+    trie until it's been removed as many times."""
+
+    def __init__(self, words: Iterable[str] = ()):
+        self.root: dict = {}
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        if END not in node:
+            self.size += 1
+        node[END] = node.get(END, 0) + 1
+
+    def remove(self, word: str):
+        parents = []
+        node = self.root
+        for char in word:
+            if (child := node.get(char)) is None:
+                return
+            parents.append((node, char))
+            node = child
+        if (count := node.get(END)) is None:
+            return
+        if count > 1:
+            node[END] = count - 1
+            return
+        del node[END]
+        self.size -= 1
+        # Prune the branch, up to the first node that's still needed
+        for parent, char in reversed(parents):
+            if parent[char]:
+                break
+            del parent[char]
+
+    def with_prefix(self, prefix: str, limit: int | None = None) -> list[str]:
+        """Returns the words starting with `prefix`, in sorted order."""
+        node = self.root
+        for char in prefix:
+            if (node := node.get(char)) is None:
+                return []
+        words: list[str] = []
+        stack = [(prefix, node)]
+        while stack:
+            word, node = stack.pop()
+            if END in node:
+                words.append(word)
+                if limit is not None and len(words) >= limit:
+                    break
+            # Push in reverse, so the smallest is visited next
+            stack.extend(
+                (word + char, node[char]) for char in sorted(node, reverse=True) if char != END
+            )
+        return words
+
+    def __contains__(self, word: str) -> bool:
+        node = self.root
+        for char in word:
+            if (node := node.get(char)) is None:
+                return False
+        return END in node
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class CommandIndex:
+    """The names of every command on the PATH, plus the builtins."""
+
+    def __init__(self, builtins: Iterable[str] = ()):
+        self.trie = PrefixTrie(builtins)
+        self.lock = threading.Lock()  # Held while the trie is read or changed
+        self.path: tuple[str, ...] = ()
+        self.directories: dict[str, DirectoryIndex] = {}
+        self.checked = float("-inf")  # When the directories were last checked for changes
+        self.indexed = threading.Event()  # Set once the whole PATH has been indexed
+        self.refreshing: Future | None = None
+
+    def refresh(self, path: Sequence[str]):
+        """Bring the index up to date with the PATH. Only directories which have changed since the
+        last refresh are scanned."""
+        path = tuple(str(directory) for directory in path)
+        for directory in set(self.directories) - set(path):
+            self.update(self.directories.pop(directory).entries, {})
+        for directory in path:
+            if (index := self.directories.get(directory)) is None:
+                index = self.directories[directory] = DirectoryIndex(directory)
+            before = index.entries
+            index.refresh()
+            # The index replaces its entries when it rescans, rather than changing them
+            if index.entries is not before:
+                self.update(before, index.entries)
+        self.path = path
+        self.checked = time.monotonic()
+        self.indexed.set()
+
+    def update(self, before: dict, after: dict):
+        removed, added = before.keys() - after.keys(), after.keys() - before.keys()
+        with self.lock:
+            for name in removed:
+                self.trie.remove(name)
+            for name in added:
+                self.trie.add(name)
+
+    def refresh_soon(self, path: Sequence[str]):
+        """Start a refresh in the background, unless there's been one recently."""
+        if self.refreshing is not None and not self.refreshing.done():
+            return
+        recent = time.monotonic() - self.checked < REFRESH_INTERVAL
+        if recent and tuple(str(directory) for directory in path) == self.path:
+            return
+        self.refreshing = get_executor().submit(self.refresh, path)
+
+    def complete(self, prefix: str, limit: int | None = MAX_COMPLETIONS) -> list[str]:
+        with self.lock:
+            return self.trie.with_prefix(prefix, limit)
+
+
+class Listing:
+    """A directory's entries, sorted by name. Directories have a trailing slash."""
+
+    __slots__ = ("mtime", "names", "checked")
+
+    def __init__(self, mtime: int, names: list[str]):
+        self.mtime = mtime
+        self.names = names
+        self.checked = time.monotonic()
+
+    def with_prefix(self, prefix: str, limit: int = MAX_COMPLETIONS) -> list[str]:
+        # Hidden files are only included if they've been asked for
+        hidden = prefix.startswith(".")
+        names: list[str] = []
+        for i in range(bisect_left(self.names, prefix), len(self.names)):
+            name = self.names[i]
+            if not name.startswith(prefix) or len(names) == limit:
+                break
+            if hidden or not name.startswith("."):
+                names.append(name)
+        return names
+
+
+class DirectoryCache:
+    """Remembers the contents of recently-completed directories."""
+
+    def __init__(self, size: int = LISTING_CACHE_SIZE):
+        self.size = size
+        self.listings: OrderedDict[str, Listing] = OrderedDict()
+        self.checking: set[str] = set()
+
+    @staticmethod
+    def scan(directory: str) -> Listing | None:
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as entries:
+                names = [entry.name + "/" if entry.is_dir() else entry.name for entry in entries]
+        except OSError:
+            return None
+        return Listing(mtime, sorted(names))
+
+    def get(self, directory: str) -> Listing | None:
+        """Returns the directory's listing. Only a directory we haven't seen before is listed
+        straight away; a cached listing is returned as it is, and checked in the background."""
+        if (listing := self.listings.get(directory)) is None:
+            if (listing := self.scan(directory)) is None:
+                return None
+            self.listings[directory] = listing
+            while len(self.listings) > self.size:
+                self.listings.popitem(last=False)
+        else:
+            self.listings.move_to_end(directory)
+            if time.monotonic() - listing.checked >= REFRESH_INTERVAL:
+                self.check_soon(directory, listing)
+        return listing
+
+    def check_soon(self, directory: str, listing: Listing):
+        if directory in self.checking:
+            return
+        self.checking.add(directory)
+
+        def check():
+            try:
+                try:
+                    changed = os.stat(directory).st_mtime_ns != listing.mtime
+                except OSError:
+                    changed = True
+                if not changed:
+                    listing.checked = time.monotonic()
+                elif (new := self.scan(directory)) is not None:
+                    self.listings[directory] = new
+                else:
+                    self.listings.pop(directory, None)
+            finally:
+                self.checking.discard(directory)
+
+        get_executor().submit(check)
+
+
+class CompletionEngine:
+    """Works out the completions for the word before the cursor."""
+
+    def __init__(self, env: EnvironmentVarHolder):
+        self.env = env
+        self.commands = CommandIndex(BUILTINS)
+        self.directories = DirectoryCache()
+
+    def start(self):
+        """Start indexing the PATH in the background, so it's ready before it's needed."""
+        self.commands.refresh_soon(self.env["PATH"])
+
+    def complete(self, text: str) -> tuple[str, list[str]]:
+        """Returns the word being completed (the end of `text`), and what it could be replaced
+        with."""
+        word = WORD.search(text)[0]
+        if word.startswith("$"):
+            return word, ["$" + name for name in self.complete_variable(word[1:])]
+        if "/" in word or word.startswith(("~", ".")):
+            return word, self.complete_path(word)
+        if COMMAND_POSITION.search(text[: len(text) - len(word)]):
+            return word, self.complete_command(word)
+        return word, self.complete_path(word)
+
+    def complete_command(self, prefix: str) -> list[str]:
+        self.commands.refresh_soon(self.env["PATH"])
+        self.commands.indexed.wait(FIRST_INDEX_WAIT)
+        return self.commands.complete(prefix)
+
+    def complete_variable(self, prefix: str) -> list[str]:
+        # There are only ever a few dozen variables, so there's no need for anything clever
+        names = {*self.env, *SHELL_VARS, *DEFAULT_VALUES}
+        return sorted(name for name in names if name.startswith(prefix))[:MAX_COMPLETIONS]
+
+    def complete_path(self, word: str) -> list[str]:
+        head, _, prefix = word.rpartition("/")
+        if word.startswith("/") and not head:
+            head = "/"
+        directory = os.path.expanduser(head) if head else "."
+        if (listing := self.directories.get(os.path.abspath(directory))) is None:
+            return []
+        start = word[: len(word) - len(prefix)]
+        return [start + name for name in listing.with_prefix(prefix)]
+
+
+class ShellCompleter(Completer):
+    """Connects the completion engine to prompt_toolkit."""
+
+    def __init__(self, engine: CompletionEngine):
+        self.engine = engine
+
+    def get_completions(
+        self, document: Document, complete_event: CompleteEvent
+    ) -> Iterator[Completion]:
+        word, candidates = self.engine.complete(document.text_before_cursor)
+        for candidate in candidates:
+            yield Completion(candidate, start_position=-len(word))
@@ -1,12 +1,25 @@
-"""Define some data types, mostly wrappers for Python datatypes."""
+"""Define some data types, mostly wrappers for Python datatypes.
 
+Numbers, strings and booleans are kept as plain Python values. Everything here uses `__slots__`,
+since a script can make a lot of them.
+"""
+
+from __future__ import annotations
+from array import array
 from datetime import datetime
+import functools
+from itertools import repeat
+from operator import add, eq, mul, sub, truediv
+import os
 import pathlib
 import subprocess
 import time
+from typing import Any, Callable, Iterable, Iterator
 
 
 class DataType:
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
@@ -15,10 +28,12 @@ class DataType:
 
 
 class Integer(DataType):
-    pass
+    __slots__ = ()
 
 
 class DateTime(DataType):
+    __slots__ = ()
+
     def __init__(self, value: datetime):
         self.value = value
 
@@ -42,6 +57,8 @@ class DateTime(DataType):
 
 
 class Path(DataType):
+    __slots__ = ()
+
     def __init__(self, value: str | pathlib.Path):
         if not isinstance(value, pathlib.Path):
             value = pathlib.Path(value)
@@ -57,23 +74,326 @@ class Path(DataType):
         return self.value.name
 
 
+# The Python types each kind of array can hold without changing kind: "q" is 64-bit ints, and "d" is
+#   floats. (bools are ints to Python, but they'd come back out as 0 and 1, so they need a list.)
+ARRAY_TYPES: dict[str, tuple[type, ...]] = {"q": (int,), "d": (float, int)}
+
+
+def storage_for(items: Iterable[Any]) -> array | list:
+    """Returns a new container for some items: an array of ints or floats if they're all numbers
+    (and the ints fit in 64 bits), otherwise a list."""
+    if isinstance(items, array):
+        return items[:]
+    items = list(items)
+    types = set(map(type, items))
+    if types <= {int}:
+        try:
+            return array("q", items)
+        except OverflowError:
+            return items
+    if types <= {int, float}:
+        try:
+            return array("d", items)
+        except OverflowError:
+            return items
+    return items
+
+
+def share(value: Any) -> Any:
+    """Marks a list as having more than one holder (e.g. after `ys = $xs`), so that it's copied
+    before it's changed in place."""
+    if type(value) is List:
+        value.owner = None
+    return value
+
+
+class List(DataType):
+    """A list of values. Lists of numbers are kept in an array (8 bytes per number, rather than a
+    pointer to a Python object each), and only become a Python list if something else is added.
+
+    Arithmetic with a single value applies it to every item, e.g. `xs *= 2` doubles each one, while
+    adding another list joins them. `+=` and `*=` change the list in place. So that a script never
+    sees a list change through another variable (or another environment), it's copied first
+    unless it belongs to the environment doing the assignment: see `owner`."""
+
+    __slots__ = ("owner",)
+
+    def __init__(self, items: Iterable[Any] = (), owner: object = None):
+        self.value: array | list = storage_for(items)
+        # Whoever can change this list in place without copying it: the `owner` of the environment
+        #   it was last copied for, or None if it might have more than one holder
+        self.owner = owner
+
+    @classmethod
+    def wrap(cls, storage: array | list, owner: object = None) -> List:
+        """Makes a List which uses `storage` as it is, rather than copying it."""
+        lst = cls.__new__(cls)
+        lst.value = storage
+        lst.owner = owner
+        return lst
+
+    def copy(self, owner: object = None) -> List:
+        return List.wrap(self.value[:], owner)
+
+    def append(self, item: Any):
+        storage = self.value
+        if type(storage) is not list:
+            kind = type(item)
+            if kind in ARRAY_TYPES[storage.typecode]:
+                try:
+                    storage.append(item)
+                    return
+                except OverflowError:
+                    pass
+            elif kind is float and storage.typecode == "q":
+                self.value = storage = array("d", storage)
+                storage.append(item)
+                return
+            self.value = storage = storage.tolist()
+        storage.append(item)
+
+    def extend(self, items: Iterable[Any]):
+        other = items.value if isinstance(items, List) else storage_for(items)
+        storage = self.value
+        if type(storage) is not list:
+            if type(other) is not array:
+                # Something other than numbers (or an int too big for 64 bits)
+                self.value = storage = storage.tolist()
+            elif other.typecode != storage.typecode:
+                # Ints and floats together make floats
+                if storage.typecode == "q":
+                    self.value = storage = array("d", storage)
+                else:
+                    other = array("d", other)
+        storage.extend(other)
+
+    def map(self, func: Callable[[Any, Any], Any], operand: Any, reflected: bool = False) -> List:
+        """Returns a new list, with `func(item, operand)` for each item (or `func(operand, item)`,
+        if it's reflected)."""
+        storage = self.value
+        items = (repeat(operand), storage) if reflected else (storage, repeat(operand))
+        if type(storage) is array and type(operand) in ARRAY_TYPES[storage.typecode]:
+            if func is not truediv:  # Which always makes floats
+                try:
+                    return List.wrap(array(storage.typecode, map(func, *items)))
+                except OverflowError:
+                    pass
+        return List(map(func, *items))
+
+    def __add__(self, other: Any) -> List:
+        if isinstance(other, (List, PathList, list, tuple)):
+            result = self.copy()
+            result.extend(other)
+            return result
+        return self.map(add, other)
+
+    def __radd__(self, other: Any) -> List:
+        if isinstance(other, (list, tuple)):
+            result = List(other)
+            result.extend(self)
+            return result
+        return self.map(add, other, reflected=True)
+
+    def __iadd__(self, other: Any) -> List:
+        if isinstance(other, (List, PathList, list, tuple)):
+            self.extend(other)
+        else:
+            self.value = self.map(add, other).value
+        return self
+
+    def __sub__(self, other: Any) -> List:
+        return self.map(sub, other)
+
+    def __rsub__(self, other: Any) -> List:
+        return self.map(sub, other, reflected=True)
+
+    def __mul__(self, other: Any) -> List:
+        if isinstance(other, (List, list, tuple)):
+            return NotImplemented
+        return self.map(mul, other)
+
+    def __rmul__(self, other: Any) -> List:
+        return self.map(mul, other, reflected=True)
+
+    def __imul__(self, other: Any) -> List:
+        if isinstance(other, (List, list, tuple)):
+            return NotImplemented
+        self.value = self.map(mul, other).value
+        return self
+
+    def __truediv__(self, other: Any) -> List:
+        return self.map(truediv, other)
+
+    def __rtruediv__(self, other: Any) -> List:
+        return self.map(truediv, other, reflected=True)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.value)
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            return List.wrap(self.value[index])
+        return self.value[index]
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.value
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, List):
+            other = other.value
+        if isinstance(other, (list, tuple, array)):
+            return len(self.value) == len(other) and all(map(eq, self.value, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __str__(self) -> str:
+        return " ".join(map(str, self.value))
+
+    def __repr__(self) -> str:
+        return f"List({list(self.value)!r})"
+
+
+class PathList(DataType):
+    """A search path like PATH: a list of directories, written as a string with `os.pathsep`
+    between them.
+
+    The string is only split up when the directories are needed, and equal strings share a
+    PathList (see `parse`), so setting PATH to the same thing again doesn't mean splitting it
+    again, and anything which has remembered the directories can tell they're the same."""
+
+    __slots__ = ("_directories",)
+
+    def __init__(self, value: str):
+        self.value = value
+        self._directories: tuple[str, ...] | None = None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def parse(value: str) -> PathList:
+        return PathList(value)
+
+    @staticmethod
+    def of(value: Any) -> PathList:
+        """Makes a PathList from a string, or from some directories."""
+        if isinstance(value, PathList):
+            return value
+        if not isinstance(value, str):
+            value = os.pathsep.join(str(directory) for directory in value)
+        return PathList.parse(value)
+
+    @property
+    def directories(self) -> tuple[str, ...]:
+        if self._directories is None:
+            self._directories = tuple(d for d in self.value.split(os.pathsep) if d)
+        return self._directories
+
+    def __add__(self, other: Any) -> PathList:
+        """Adds directories to the end, e.g. `PATH += "/opt/bin"`."""
+        return PathList.of(self.directories + PathList.of(other).directories)
+
+    def __radd__(self, other: Any) -> PathList:
+        return PathList.of(PathList.of(other).directories + self.directories)
+
+    def __len__(self) -> int:
+        return len(self.directories)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.directories)
+
+    def __getitem__(self, index: int) -> str:
+        return self.directories[index]
+
+    def __contains__(self, directory: Any) -> bool:
+        return str(directory) in self.directories
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (PathList, str, list, tuple)):
+            return self.directories == PathList.of(other).directories
+        return NotImplemented
+
+    __hash__ = None
+
+
 class CommandResult(DataType):
-    def __init__(self, code: int, stdout: str | bytes, stderr: str | bytes):
+    """The result of running a command.
+
+    Captured output is kept the way it was produced, as bytes (or a memoryview of them). It's only
+    decoded when it's needed as text, and the decoded text is kept in case it's needed again. Use
+    `chunks` to write it out as it is."""
+
+    __slots__ = ("code", "stdout", "stderr", "_text")
+
+    def __init__(
+        self,
+        code: int,
+        stdout: str | bytes | memoryview | None,
+        stderr: str | bytes | None,
+    ):
         self.code = code
         self.stdout = stdout
         self.stderr = stderr
+        self._text: str | None = None
 
     @staticmethod
     def from_process(proc: subprocess.CompletedProcess):
         return CommandResult(proc.returncode, proc.stdout, proc.stderr)
 
-    def __str__(self):
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            if isinstance(self.stdout, str):
+                self._text = self.stdout
+            else:
+                self._text = str(self._view(), "utf-8", errors="replace")
+        return self._text
+
+    def _view(self) -> memoryview:
+        """The output as bytes, without copying it (unless it's text, which has to be encoded)."""
         s = self.stdout
         if s is None:
-            return ""
-        if isinstance(s, bytes):
-            return s.decode("utf-8")
-        return str(s)
+            return memoryview(b"")
+        if isinstance(s, str):
+            return memoryview(s.encode("utf-8"))
+        return memoryview(s)
+
+    def chunks(self, size: int = 64 * 1024) -> Iterator[bytes | memoryview]:
+        """Yields the output as bytes, a piece at a time, without decoding it."""
+        if self.stdout is None:
+            return
+        view = self._view()
+        for i in range(0, len(view), size):
+            yield view[i : i + size]
+
+    def write_to(self, write: Callable[[bytes | memoryview], Any]):
+        """Write out the output, followed by a line break if it doesn't already end with one."""
+        last = None
+        for chunk in self.chunks():
+            write(chunk)
+            last = chunk
+        if last and last[-1:] != b"\n":
+            write(b"\n")
+
+    def __bytes__(self) -> bytes:
+        return bytes(self._view())
+
+    def __str__(self):
+        return self.text
+
+    def __eq__(self, other) -> bool:
+        # Compare as bytes, so that big outputs don't need decoding (or copying)
+        if isinstance(other, CommandResult):
+            other = other._view()
+        elif isinstance(other, str):
+            other = other.encode("utf-8")
+        if isinstance(other, (bytes, bytearray, memoryview)):
+            return self._view() == other
+        return NotImplemented
+
+    __hash__ = None
 
     def __bool__(self):
         return self.code == 0
@@ -13,3 +13,29 @@ class CommandNotFound(ShellError):
 
 class ArgumentError(ShellError):
     """We had issues while parsing the arguments for a command."""
+
+
+class RedirectError(ShellError):
+    """A file named in a redirection (like `> out.txt`) couldn't be opened."""
+
+
+class OutputTooLarge(ShellError):
+    """A command substitution (like `$(cat big.log)`) produced more output than we're willing to
+    keep."""
+
+
+class NotParallelSafe(ShellError):
+    """A parallel loop (`foreach -j`) does something which would affect the other iterations, like
+    `cd`."""
+
+
+class LoopControl(ShellError):
+    """Raised by `break` and `continue`, and caught by the enclosing loop."""
+
+
+class BreakLoop(LoopControl):
+    pass
+
+
+class ContinueLoop(LoopControl):
+    pass
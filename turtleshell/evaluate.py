@@ -1,8 +1,11 @@
+from typing import Any
+
+from turtleshell import streams
 from turtleshell.parsing import Token
 from turtleshell.variables import EnvironmentVarHolder
 
 
-def evaluate(token: Token, env: EnvironmentVarHolder):
-    result = token.eval(env)
-    if result is not None and str(result):
-        print(result)
+def evaluate(token: Token, env: EnvironmentVarHolder) -> Any:
+    result = token.compiled()(env)
+    streams.write_result(result)
+    return result
@@ -0,0 +1,112 @@
+"""A bash-style hash table for looking up executables on the PATH.
+
+Scanning every PATH directory on every command is slow when directories like /usr/bin contain
+thousands of entries. Instead, we remember where each command was found, and keep a lazily-built
+index of each PATH directory which is thrown away whenever the directory's mtime changes.
+"""
+
+import os
+import pathlib
+from typing import Iterable
+
+from turtleshell.datatypes import PathList
+import turtleshell.util
+
+
+class DirectoryIndex:
+    """Maps command names to executables for a single directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: int | None = None
+        self.entries: dict[str, pathlib.Path] = {}
+
+    def refresh(self) -> bool:
+        """Rebuild the index if the directory has changed since we last looked at it. Returns
+        false if the directory doesn't exist."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self.mtime = None
+            self.entries = {}
+            return False
+
+        if mtime != self.mtime:
+            self.entries = self.scan()
+            self.mtime = mtime
+        return True
+
+    def scan(self) -> dict[str, pathlib.Path]:
+        entries: dict[str, pathlib.Path] = {}
+        stems: dict[str, pathlib.Path] = {}
+        try:
+            items = list(os.scandir(self.path))
+        except OSError:
+            return entries
+        for item in items:
+            path = pathlib.Path(item.path)
+            if not turtleshell.util.is_executable(path):
+                continue
+            entries[item.name] = path
+            # Allow 'python' to match 'python.exe' on Windows
+            stems.setdefault(path.stem, path)
+        for stem, path in stems.items():
+            entries.setdefault(stem, path)
+        return entries
+
+    def get(self, name: str) -> pathlib.Path | None:
+        return self.entries.get(name)
+
+
+class ExecutableCache:
+    """Remembers where commands live, so we don't need to search the PATH for every command."""
+
+    def __init__(self):
+        self.path: tuple[str, ...] = ()
+        self.hashed: dict[str, pathlib.Path] = {}
+        self.hit_counts: dict[str, int] = {}
+        self.directories: dict[str, DirectoryIndex] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, name: str, path: Iterable[str]) -> pathlib.Path | None:
+        """Returns the first executable called `name` in the given PATH directories, or None."""
+        # A PathList only works out its directories once, and then it's the same tuple every time
+        path = path.directories if isinstance(path, PathList) else tuple(str(p) for p in path)
+        if path is not self.path and path != self.path:
+            self.clear()
+            self.path = path
+
+        # Fast path: we've found this command before and it's still there
+        if (hashed := self.hashed.get(name)) is not None:
+            if turtleshell.util.is_executable(hashed):
+                self.hits += 1
+                self.hit_counts[name] += 1
+                return hashed
+            self.forget(name)
+
+        self.misses += 1
+        for directory in path:
+            index = self.directories.get(directory)
+            if index is None:
+                index = self.directories[directory] = DirectoryIndex(directory)
+            if not index.refresh():
+                continue
+            if (found := index.get(name)) is not None:
+                self.hashed[name] = found
+                self.hit_counts[name] = 1
+                return found
+        return None
+
+    def forget(self, name: str):
+        self.hashed.pop(name, None)
+        self.hit_counts.pop(name, None)
+
+    def clear(self):
+        """Forget every remembered location. Called when PATH changes, or by `hash -r`."""
+        self.hashed.clear()
+        self.hit_counts.clear()
+        self.directories.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "hashed": len(self.hashed)}
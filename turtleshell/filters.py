@@ -0,0 +1,536 @@
+"""In-process versions of common text filters: `grep`, `head`, `wc`, `sort`, `cut` and `uniq`.
+
+Starting a program costs more than most pipelines spend on their data, so when one of these is a
+stage in a pipeline, it runs as a builtin instead: on a thread, reading its input in large chunks of
+bytes rather than a line at a time. Only the common options are understood. Given anything else (or
+when BUILTINFILTERS is turned off), the real program is run as usual, so the output is always the
+same as it would have been.
+
+Filters are only used when their input is a pipe or a file. Reading from the terminal is left to the
+real programs, as are large files: they're a lot quicker at getting through lots of data, once
+they've started.
+"""
+
+from __future__ import annotations
+from abc import abstractmethod
+from itertools import chain, filterfalse, groupby
+from operator import itemgetter
+import os
+import re
+import stat
+import sys
+from typing import TYPE_CHECKING, Any, BinaryIO, Iterable, Iterator
+
+from turtleshell import streams
+from turtleshell.builtins import ArgFlag, ArgNamespace, ArgOpt, ArgParser, ArgRest, Command
+from turtleshell.datatypes import CommandResult
+from turtleshell.errors import ArgumentError
+
+if TYPE_CHECKING:
+    from turtleshell.variables import EnvironmentVarHolder
+
+FILTERS: dict[str, Filter] = {}
+
+# How much input to read at once
+CHUNK_SIZE = 1024 * 1024
+
+# How many lines to join together for each write, when writing out a list of them
+LINES_PER_WRITE = 64 * 1024
+
+# Files bigger than this are left to the real programs, which get through them so much quicker that
+#   it makes up for the time it takes to start one
+LARGE_FILE_SIZE = 1024 * 1024
+
+
+def filter_command(cls: type[Filter]) -> type[Filter]:
+    """Class decorator which registers a filter, like `builtin` does for builtins."""
+    FILTERS[cls.name] = cls()
+    return cls
+
+
+def get_filter(name: str, args: list[Any], piped: bool) -> Filter | None:
+    """Returns the in-process version of a command, if there's one which understands these
+    arguments. `piped` is whether the command's input is a pipe or file (rather than the
+    terminal)."""
+    if (command := FILTERS.get(name)) is None:
+        return None
+    try:
+        parsed = command.parser.parse_args(*args)
+    except (ArgumentError, TypeError, ValueError):
+        return None
+    return command if command.accepts(parsed, piped) else None
+
+
+def are_small(files: list[str]) -> bool:
+    for file in files:
+        try:
+            if os.stat(os.path.expanduser(file)).st_size > LARGE_FILE_SIZE:
+                return False
+        except OSError:
+            pass  # It's reported when we try to open it
+    return True
+
+
+def read_inputs(command: str, files: list[str]) -> Iterator[BinaryIO | None]:
+    """Yields a stream for each input: each of the files, or the standard input if there aren't
+    any. A file which can't be opened is reported, and yielded as None."""
+    if not files:
+        yield streams.get_stdin() or sys.stdin.buffer
+        return
+    for file in files:
+        try:
+            f = open(os.path.expanduser(file), "rb")
+        except OSError as e:
+            streams.write_error(f"{command}: {file}: {e.strerror}\n")
+            yield None
+            continue
+        with f:
+            yield f
+
+
+def read_chunks(f: BinaryIO) -> Iterator[bytes]:
+    while chunk := f.read1(CHUNK_SIZE):
+        yield chunk
+
+
+def read_lines(f: BinaryIO) -> Iterator[bytes]:
+    """Yields the input in chunks of whole lines. Every chunk ends with a line break, even if the
+    input doesn't."""
+    pending: list[bytes] = []
+    for chunk in read_chunks(f):
+        end = chunk.rfind(b"\n") + 1
+        if not end:
+            pending.append(chunk)
+            continue
+        if pending:
+            pending.append(chunk[:end])
+            yield b"".join(pending)
+            pending = []
+        else:
+            yield chunk if end == len(chunk) else chunk[:end]
+        if end < len(chunk):
+            pending.append(chunk[end:])
+    if pending:
+        yield b"".join(pending) + b"\n"
+
+
+def split_lines(chunk: bytes) -> list[bytes]:
+    """Splits a chunk from `read_lines` into lines, without their line breaks."""
+    lines = chunk.split(b"\n")
+    lines.pop()  # The chunk ends with a line break, so there's nothing after it
+    return lines
+
+
+def write_lines(lines: list[bytes]):
+    for i in range(0, len(lines), LINES_PER_WRITE):
+        streams.write(b"\n".join(lines[i : i + LINES_PER_WRITE]) + b"\n")
+
+
+class Filter(Command):
+    """A builtin which reads the files named in its arguments, or the previous stage of its
+    pipeline. Subclasses say which arguments they can handle with `accepts`."""
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        """Whether we can do what the arguments ask for. Anything else is left to the real
+        program."""
+        return (piped or bool(parsed.files)) and are_small(parsed.files)
+
+    def run(self, *args: Any, env: EnvironmentVarHolder = None) -> CommandResult:
+        return CommandResult(self.filter(self.parser.parse_args(*args)), None, None)
+
+    @abstractmethod
+    def filter(self, parsed: ArgNamespace) -> int:
+        """Does the work, and returns the exit code."""
+
+
+# Characters which are special to Python's `re`, but not in grep's basic regular expressions
+BASIC_LITERALS = frozenset("+?|(){}")
+
+
+def is_portable(pattern: str, extended: bool) -> bool:
+    """Whether a pattern means the same to grep as it does to Python's `re`.
+
+    Backslashes and bracket expressions like `[[:digit:]]` are left to grep, as is anything outside
+    ASCII (which grep matches by character, rather than by byte)."""
+    if not pattern.isascii() or "\\" in pattern or "\n" in pattern:
+        return False
+    if any(bracket in pattern for bracket in ("[:", "[=", "[.")):
+        return False
+    if not extended:
+        if not BASIC_LITERALS.isdisjoint(pattern):
+            return False
+        # `^` and `$` are only anchors at the start and end of a basic regular expression
+        if "^" in pattern[1:] or "$" in pattern[:-1]:
+            return False
+    try:
+        re.compile(pattern)
+    except re.error:
+        return False
+    return True
+
+
+@filter_command
+class Grep(Filter):
+    name = "grep"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("ignore_case"), "-i", "--ignore-case")
+        self.parser.add_argument(ArgFlag("invert"), "-v", "--invert-match")
+        self.parser.add_argument(ArgFlag("count"), "-c", "--count")
+        self.parser.add_argument(ArgFlag("quiet"), "-q", "--quiet", "--silent")
+        self.parser.add_argument(ArgFlag("fixed"), "-F", "--fixed-strings")
+        self.parser.add_argument(ArgFlag("extended"), "-E", "--extended-regexp")
+        self.parser.add_argument(ArgRest("operands", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        # With more than one file, grep puts the file's name before each line
+        if not 1 <= len(parsed.operands) <= 2 or not (piped or len(parsed.operands) == 2):
+            return False
+        if not are_small(parsed.operands[1:]):
+            return False
+        pattern = parsed.operands[0]
+        if parsed.fixed:
+            return pattern.isascii() and "\n" not in pattern
+        return is_portable(pattern, parsed.extended)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        pattern, files = parsed.operands[0].encode(), parsed.operands[1:]
+        if parsed.fixed:
+            pattern = re.escape(pattern)
+        flags = re.IGNORECASE if parsed.ignore_case else 0
+        search = re.compile(pattern, flags).search
+        # Lines are searched one at a time, but most chunks can be skipped (or passed through, with
+        #   `-v`) after searching the whole chunk at once
+        search_chunk = re.compile(pattern, flags | re.MULTILINE).search
+        select = filterfalse if parsed.invert else filter
+
+        total, failed = 0, False
+        for f in read_inputs(self.name, files):
+            if f is None:
+                failed = True
+                continue
+            for chunk in read_lines(f):
+                if search_chunk(chunk) is None:
+                    if not parsed.invert:
+                        continue
+                    selected = None
+                    count = chunk.count(b"\n")
+                else:
+                    selected = list(select(search, split_lines(chunk)))
+                    count = len(selected)
+                if count and parsed.quiet:
+                    return 0
+                total += count
+                if parsed.count or not count:
+                    continue
+                if selected is None:
+                    streams.write(chunk)
+                else:
+                    write_lines(selected)
+        if parsed.count:
+            streams.write(f"{total}\n")
+        if failed:
+            return 2
+        return 0 if total else 1
+
+
+@filter_command
+class Head(Filter):
+    name = "head"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgOpt("lines", nargs=1, coerce=int), "-n", "--lines")
+        self.parser.add_argument(ArgOpt("bytes", nargs=1, coerce=int), "-c", "--bytes")
+        self.parser.add_argument(ArgRest("files", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        # With more than one file, head puts a header before each one
+        if len(parsed.files) > 1 or (parsed.lines and parsed.bytes):
+            return False
+        if any(n < 0 for n in (parsed.lines or parsed.bytes or [])):
+            return False
+        return super().accepts(parsed, piped)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        for f in read_inputs(self.name, parsed.files):
+            if f is None:
+                return 1
+            if parsed.bytes:
+                self.head_bytes(f, parsed.bytes[0])
+            else:
+                self.head_lines(f, parsed.lines[0] if parsed.lines else 10)
+        return 0
+
+    @staticmethod
+    def head_lines(f: BinaryIO, remaining: int):
+        if remaining <= 0:
+            return
+        for chunk in read_chunks(f):
+            if (newlines := chunk.count(b"\n")) < remaining:
+                streams.write(chunk)
+                remaining -= newlines
+                continue
+            end = -1
+            for _ in range(remaining):
+                end = chunk.index(b"\n", end + 1)
+            streams.write(chunk[: end + 1])
+            return
+
+    @staticmethod
+    def head_bytes(f: BinaryIO, remaining: int):
+        if remaining <= 0:
+            return
+        for chunk in read_chunks(f):
+            streams.write(chunk[:remaining])
+            if (remaining := remaining - len(chunk)) <= 0:
+                return
+
+
+@filter_command
+class Wc(Filter):
+    name = "wc"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("lines"), "-l", "--lines")
+        self.parser.add_argument(ArgFlag("words"), "-w", "--words")
+        self.parser.add_argument(ArgFlag("bytes"), "-c", "--bytes")
+        self.parser.add_argument(ArgRest("files", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        # With more than one file, wc adds a total
+        return len(parsed.files) <= 1 and super().accepts(parsed, piped)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        show = (parsed.lines, parsed.words, parsed.bytes)
+        if not any(show):
+            show = (True, True, True)
+        for f in read_inputs(self.name, parsed.files):
+            if f is None:
+                return 1
+            counts = self.count(f, count_words=show[1])
+            shown = [n for n, wanted in zip(counts, show) if wanted]
+            # The same widths as wc: no padding for a single number, and otherwise wide enough for
+            #   the file's size (or 7, if it isn't a regular file)
+            if len(shown) == 1:
+                width = 1
+            elif stat.S_ISREG((info := os.fstat(f.fileno())).st_mode):
+                width = len(str(info.st_size))
+            else:
+                width = 7
+            line = " ".join(f"{n:>{width}}" for n in shown)
+            streams.write(f"{line} {parsed.files[0]}\n" if parsed.files else f"{line}\n")
+        return 0
+
+    @staticmethod
+    def count(f: BinaryIO, count_words: bool) -> tuple[int, int, int]:
+        lines = words = size = 0
+        in_word = False  # Whether the last chunk ended part-way through a word
+        for chunk in read_chunks(f):
+            lines += chunk.count(b"\n")
+            size += len(chunk)
+            if count_words:
+                words += len(chunk.split())
+                if in_word and not chunk[:1].isspace():
+                    words -= 1  # It's the rest of the same word
+                in_word = not chunk[-1:].isspace()
+        return lines, words, size
+
+
+# Leading blanks and a number, as `sort -n` reads them
+NUMBER = re.compile(rb"[ \t]*(-?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+))")
+
+
+def numeric_key(line: bytes) -> float:
+    """The number at the start of a line (or 0 if there isn't one), for `sort -n`."""
+    match = NUMBER.match(line)
+    return float(match[1]) if match else 0.0
+
+
+def collation_is_bytewise() -> bool:
+    """Whether `sort` would compare lines byte by byte, which is the only order we know. In other
+    locales, lines are compared by the locale's rules."""
+    for name in ("LC_ALL", "LC_COLLATE", "LANG"):
+        if value := os.environ.get(name):
+            return value in ("C", "POSIX") or value.startswith("C.")
+    return True
+
+
+@filter_command
+class Sort(Filter):
+    name = "sort"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("reverse"), "-r", "--reverse")
+        self.parser.add_argument(ArgFlag("numeric"), "-n", "--numeric-sort")
+        self.parser.add_argument(ArgFlag("unique"), "-u", "--unique")
+        self.parser.add_argument(ArgRest("files", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        return collation_is_bytewise() and super().accepts(parsed, piped)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        chunks, failed = [], False
+        for f in read_inputs(self.name, parsed.files):
+            if f is None:
+                failed = True
+                continue
+            chunks.extend(read_lines(f))
+        if failed:
+            return 2
+        lines = split_lines(b"".join(chunks))
+        del chunks
+
+        if parsed.unique:
+            # Only the first of each run of equal lines (or equal numbers, with `-n`) is kept
+            key = numeric_key if parsed.numeric else None
+            lines.sort(key=key, reverse=parsed.reverse)
+            lines = [next(group) for _, group in groupby(lines, key)]
+        elif parsed.numeric:
+            # Lines with the same number are in byte order
+            lines.sort(key=lambda line: (numeric_key(line), line), reverse=parsed.reverse)
+        else:
+            lines.sort(reverse=parsed.reverse)
+        write_lines(lines)
+        return 0
+
+
+def parse_ranges(spec: str) -> list[tuple[int, int | None]]:
+    """Parses a list like `1,3-5,7-` for `cut`, into sorted slices which don't overlap (with None
+    for the end of a range which is open)."""
+    ranges: list[tuple[int, int | None]] = []
+    for part in spec.split(","):
+        first, dash, last = part.partition("-")
+        start = int(first) if first else 1
+        end = (int(last) if last else None) if dash else start
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"invalid range: {part}")
+        ranges.append((start - 1, end))
+    ranges.sort(key=lambda r: r[0])
+
+    merged: list[tuple[int, int | None]] = []
+    for start, end in ranges:
+        if merged and (last_end := merged[-1][1]) is None:
+            break  # The last range goes to the end, so it covers this one
+        if merged and start <= last_end:
+            merged[-1] = (merged[-1][0], None if end is None else max(end, last_end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@filter_command
+class Cut(Filter):
+    name = "cut"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgOpt("fields", nargs=1, coerce=str), "-f", "--fields")
+        self.parser.add_argument(ArgOpt("delimiter", nargs=1, coerce=str), "-d", "--delimiter")
+        self.parser.add_argument(ArgOpt("bytes", nargs=1, coerce=str), "-b", "--bytes")
+        # cut counts characters as bytes too
+        self.parser.add_argument(ArgOpt("bytes", nargs=1, coerce=str), "-c", "--characters")
+        self.parser.add_argument(ArgFlag("only_delimited"), "-s", "--only-delimited")
+        self.parser.add_argument(ArgRest("files", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        if bool(parsed.fields) == bool(parsed.bytes):
+            return False
+        if parsed.fields is None and (parsed.delimiter or parsed.only_delimited):
+            return False
+        if parsed.delimiter and len(parsed.delimiter[0].encode()) != 1:
+            return False
+        try:
+            parse_ranges((parsed.fields or parsed.bytes)[0])
+        except ValueError:
+            return False
+        return super().accepts(parsed, piped)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        ranges = parse_ranges((parsed.fields or parsed.bytes)[0])
+        delimiter = parsed.delimiter[0].encode() if parsed.delimiter else b"\t"
+        # Lines only need splitting as far as the last field we want
+        maxsplit = -1 if ranges[-1][1] is None else ranges[-1][1]
+        slices = [slice(start, end) for start, end in ranges]
+        if len(slices) == 1:
+            pick = itemgetter(slices[0])
+        else:
+            get_slices = itemgetter(*slices)
+
+            def pick(fields: list[bytes]) -> Iterable[bytes]:
+                return chain.from_iterable(get_slices(fields))
+
+        failed = False
+        for f in read_inputs(self.name, parsed.files):
+            if f is None:
+                failed = True
+                continue
+            for chunk in read_lines(f):
+                lines = split_lines(chunk)
+                if parsed.bytes:
+                    write_lines([b"".join([line[part] for part in slices]) for line in lines])
+                    continue
+                if parsed.only_delimited:
+                    lines = [line for line in lines if delimiter in line]
+                # Lines without any fields are passed through whole
+                selected = [
+                    delimiter.join(pick(line.split(delimiter, maxsplit)))
+                    if delimiter in line
+                    else line
+                    for line in lines
+                ]
+                if selected:
+                    write_lines(selected)
+        return 1 if failed else 0
+
+
+@filter_command
+class Uniq(Filter):
+    name = "uniq"
+
+    def setup_parser(self):
+        self.parser = ArgParser()
+        self.parser.add_argument(ArgFlag("count"), "-c", "--count")
+        self.parser.add_argument(ArgFlag("repeated"), "-d", "--repeated")
+        self.parser.add_argument(ArgFlag("unique"), "-u", "--unique")
+        self.parser.add_argument(ArgRest("files", coerce=str))
+
+    def accepts(self, parsed: ArgNamespace, piped: bool) -> bool:
+        # A second file is where uniq writes its output
+        return len(parsed.files) <= 1 and super().accepts(parsed, piped)
+
+    def filter(self, parsed: ArgNamespace) -> int:
+        for f in read_inputs(self.name, parsed.files):
+            if f is None:
+                return 1
+            previous, repeats = None, 0
+            for chunk in read_lines(f):
+                runs = [(line, len(list(group))) for line, group in groupby(split_lines(chunk))]
+                if runs[0][0] == previous:
+                    runs[0] = (previous, repeats + runs[0][1])
+                elif previous is not None:
+                    runs.insert(0, (previous, repeats))
+                # The last run of lines may carry on in the next chunk
+                previous, repeats = runs.pop()
+                self.write_runs(parsed, runs)
+            if previous is not None:
+                self.write_runs(parsed, [(previous, repeats)])
+        return 0
+
+    @staticmethod
+    def write_runs(parsed: ArgNamespace, runs: list[tuple[bytes, int]]):
+        """Writes out each run of equal lines, given as the line and how many times it was
+        repeated."""
+        if parsed.repeated:
+            runs = [run for run in runs if run[1] > 1]
+        if parsed.unique:
+            runs = [run for run in runs if run[1] == 1]
+        if not runs:
+            return
+        if parsed.count:
+            write_lines([b"%7d %s" % (count, line) for line, count in runs])
+        else:
+            write_lines([line for line, _ in runs])
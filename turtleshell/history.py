@@ -0,0 +1,185 @@
+"""Command history, kept in an SQLite database.
+
+Each distinct command is stored once, along with every time it was run (when, how long it took, and
+its exit code). The database is in WAL mode, so several shells can read and write it at once.
+
+The prompt only loads the most recent `limit` distinct commands, newest first, and does it lazily
+(wrap it in prompt_toolkit's `ThreadedHistory` to load in the background). Older commands are still
+suggested as you type, by `HistorySuggest`, which looks them up with `search_prefix`.
+"""
+
+from __future__ import annotations
+from collections.abc import Iterator
+import pathlib
+import sqlite3
+import threading
+import time
+
+from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.document import Document
+from prompt_toolkit.history import History
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL UNIQUE,
+    last_run REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS commands_last_run ON commands (last_run);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command_id INTEGER NOT NULL REFERENCES commands (id),
+    started REAL NOT NULL,
+    duration REAL,
+    exit_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_command_id ON runs (command_id);
+"""
+
+# How many rows to read at a time when loading history into the prompt
+BATCH_SIZE = 500
+
+# How many of the most recent commands `search_prefix` looks through before searching them all
+RECENT_COMMANDS = 1000
+
+
+class SQLiteHistory(History):
+    def __init__(
+        self,
+        path: pathlib.Path,
+        limit: int = 10_000,
+        legacy_file: pathlib.Path | None = None,
+    ):
+        super().__init__()
+        self.path = path
+        self.limit = limit
+        self.legacy_file = legacy_file
+        self._local = threading.local()  # SQLite connections can't be shared between threads
+        self._setup_done = False
+        self._setup_lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, timeout=5.0)
+            self._local.connection = connection
+        if not self._setup_done:
+            with self._setup_lock:
+                if not self._setup_done:
+                    self._setup(connection)
+                    self._setup_done = True
+        return connection
+
+    def _setup(self, connection: sqlite3.Connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.executescript(SCHEMA)
+        is_empty = connection.execute("SELECT 1 FROM commands LIMIT 1").fetchone() is None
+        if is_empty and self.legacy_file is not None and self.legacy_file.is_file():
+            self._import_file(connection, self.legacy_file)
+
+    def import_file(self, path: pathlib.Path):
+        """Import a plain-text history file, with one command per line (oldest first)."""
+        self._import_file(self.connection, path)
+
+    def _import_file(self, connection: sqlite3.Connection, path: pathlib.Path):
+        with path.open("r", errors="replace") as f:
+            lines = [line.strip() for line in f]
+        # The file has no timestamps, so keep the order by giving each line its own fake time
+        start = time.time() - len(lines)
+        with connection:
+            connection.executemany(
+                "INSERT INTO commands (command, last_run) VALUES (?, ?)"
+                " ON CONFLICT (command) DO UPDATE SET last_run = excluded.last_run",
+                [(line, start + i) for i, line in enumerate(lines) if line],
+            )
+
+    def load_history_strings(self) -> Iterator[str]:
+        cursor = self.connection.execute(
+            "SELECT command FROM commands ORDER BY last_run DESC LIMIT ?", (self.limit,)
+        )
+        while rows := cursor.fetchmany(BATCH_SIZE):
+            for (command,) in rows:
+                yield command
+
+    def store_string(self, string: str):
+        # Commands are stored by `record` once they've finished, so we know how they went
+        pass
+
+    def record(
+        self,
+        command: str,
+        exit_code: int | None = None,
+        duration: float | None = None,
+        started: float | None = None,
+    ):
+        """Save a command that's been run."""
+        if not command:
+            return
+        started = time.time() if started is None else started
+        with self.connection as connection:
+            connection.execute(
+                "INSERT INTO commands (command, last_run) VALUES (?, ?)"
+                " ON CONFLICT (command) DO UPDATE SET last_run = excluded.last_run",
+                (command, started),
+            )
+            connection.execute(
+                "INSERT INTO runs (command_id, started, duration, exit_code)"
+                " SELECT id, ?, ?, ? FROM commands WHERE command = ?",
+                (started, duration, exit_code, command),
+            )
+
+    def search_prefix(self, prefix: str, limit: int = 20) -> list[str]:
+        """Returns the most recent commands starting with `prefix`, newest first."""
+        end = prefix + "\U0010ffff"
+        # Most prefixes (like "g") match a lot of commands, and sorting all of them would take a
+        #   while, so look through the most recent ones first
+        rows = self.connection.execute(
+            "SELECT command FROM (SELECT command FROM commands ORDER BY last_run DESC LIMIT ?)"
+            " WHERE command >= ? AND command < ? LIMIT ?",
+            (RECENT_COMMANDS, prefix, end, limit),
+        ).fetchall()
+        if len(rows) < limit:
+            # A range comparison (rather than LIKE) can use the index on `command`
+            rows = self.connection.execute(
+                "SELECT command FROM commands WHERE command >= ? AND command < ?"
+                " ORDER BY last_run DESC LIMIT ?",
+                (prefix, end, limit),
+            )
+        return [command for (command,) in rows]
+
+    def runs(self, command: str) -> list[tuple[float, float | None, int | None]]:
+        """Returns (started, duration, exit code) for each time `command` was run, oldest first."""
+        rows = self.connection.execute(
+            "SELECT started, duration, exit_code FROM runs"
+            " JOIN commands ON commands.id = runs.command_id"
+            " WHERE command = ? ORDER BY runs.id",
+            (command,),
+        )
+        return list(rows)
+
+    def close(self):
+        if (connection := getattr(self._local, "connection", None)) is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class HistorySuggest(AutoSuggest):
+    """Suggests the rest of the most recent command starting with what's been typed, like fish.
+    Unlike prompt_toolkit's `AutoSuggestFromHistory`, this finds commands older than the ones
+    loaded into the prompt."""
+
+    def __init__(self, history: SQLiteHistory):
+        self.history = history
+
+    def get_suggestion(self, buffer: Buffer, document: Document) -> Suggestion | None:
+        text = document.text
+        # Only suggest at the end of the first line, and not for blank input
+        if not text.strip() or "\n" in text or not document.is_cursor_at_the_end:
+            return None
+        for command in self.history.search_prefix(text, limit=2):
+            if command != text:
+                return Suggestion(command[len(text) :])
+        return None
@@ -0,0 +1,131 @@
+"""Background jobs, started by ending a command with `&`.
+
+Jobs are watched by an asyncio event loop running on its own thread, so the prompt stays responsive
+while they run. Finished jobs are kept until they've been reported to the user (or waited on).
+"""
+
+from __future__ import annotations
+import signal
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING
+
+from turtleshell.datatypes import CommandResult
+from turtleshell.errors import ShellError
+
+if TYPE_CHECKING:
+    import asyncio
+
+    from turtleshell.pipeline import PipelineRun
+
+
+class NoSuchJob(ShellError):
+    def __init__(self, spec: str):
+        super().__init__(f"{spec}: no such job")
+
+
+class Job:
+    def __init__(self, id: int, text: str, run: PipelineRun, future: Future[CommandResult]):
+        self.id = id
+        self.text = text
+        self.run = run
+        self.future = future
+
+    @property
+    def pids(self) -> list[int]:
+        return [p.pid for stage in self.run.stages if (p := getattr(stage, "process", None))]
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def result(self) -> CommandResult | None:
+        if not self.done:
+            return None
+        if self.future.exception() is not None:
+            return CommandResult(1, None, str(self.future.exception()))
+        return self.future.result()
+
+    @property
+    def state(self) -> str:
+        if not self.done:
+            return "Running"
+        if (code := self.result.code) == 0:
+            return "Done"
+        return f"Exit {code}"
+
+    def wait(self) -> CommandResult:
+        self.future.exception()  # Wait without raising
+        return self.result
+
+    def kill(self, sig: int = signal.SIGTERM):
+        for stage in self.run.stages:
+            if (process := getattr(stage, "process", None)) is None:
+                continue
+            try:
+                # This checks it hasn't been reaped: if it has, its pid could be another process's
+                process.send_signal(sig)
+            except ProcessLookupError:
+                pass  # Already finished
+
+    def __str__(self) -> str:
+        return f"[{self.id}]  {self.state:<10}{self.text} &"
+
+
+class JobScheduler:
+    def __init__(self):
+        self.jobs: dict[int, Job] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # asyncio is slow to import, so don't start the loop until there's a job to run
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return self._loop
+
+    def submit(self, run: PipelineRun, text: str) -> Job:
+        """Track a pipeline which has already been started."""
+        import asyncio
+
+        future = asyncio.run_coroutine_threadsafe(self._watch(run), self.loop)
+        job = Job(max(self.jobs, default=0) + 1, text, run, future)
+        self.jobs[job.id] = job
+        return job
+
+    async def _watch(self, run: PipelineRun) -> CommandResult:
+        # Waiting on processes blocks, so it happens on the loop's default executor
+        return await self.loop.run_in_executor(None, run.wait)
+
+    def get(self, spec: str | int | None = None) -> Job:
+        """Find a job from a spec like `%1` or `1`. Returns the most recent job if spec is None."""
+        if spec is None:
+            if not self.jobs:
+                raise NoSuchJob("current")
+            return self.jobs[max(self.jobs)]
+        try:
+            return self.jobs[int(str(spec).removeprefix("%"))]
+        except (KeyError, ValueError):
+            raise NoSuchJob(str(spec)) from None
+
+    def remove(self, job: Job):
+        self.jobs.pop(job.id, None)
+
+    def reap(self) -> list[Job]:
+        """Remove and return all the jobs that have finished."""
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in finished:
+            self.remove(job)
+        return finished
+
+    def running(self) -> int:
+        return sum(not job.done for job in self.jobs.values())
+
+
+scheduler = JobScheduler()
@@ -0,0 +1,368 @@
+"""Starting external programs.
+
+Programs are started with `os.posix_spawnp` where it's available. Unlike `fork`, it doesn't have to
+copy the shell's page tables, so it doesn't get slower as the shell uses more memory.
+
+Optionally, programs can be started by a fork server instead: a tiny helper process, started early
+on, which forks and execs on the shell's behalf. The shell sends it each command's arguments (and
+its stdin/stdout/stderr file descriptors) over a UNIX socket, and it reports back the process ID and later
+the exit code.
+
+Each spawn is timed; `launcher.stats()` (and the `spawnstats` builtin) report how long they take.
+"""
+
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import json
+import os
+import selectors
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Protocol
+
+# How many recent spawn times to keep, for working out percentiles
+LATENCY_SAMPLES = 1000
+
+# Signals which Python ignores, but which programs expect to have their default behaviour
+RESET_SIGNALS = tuple(
+    sig for name in ("SIGPIPE", "SIGXFSZ") if (sig := getattr(signal, name, None)) is not None
+)
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+class Process(Protocol):
+    """The parts of `subprocess.Popen` that the rest of the shell uses."""
+
+    pid: int
+    returncode: int | None
+
+    def poll(self) -> int | None: ...
+
+    def wait(self) -> int: ...
+
+    def send_signal(self, sig: int): ...
+
+    def terminate(self): ...
+
+
+def exit_code(status: int) -> int:
+    """Converts a status from `os.waitpid` to an exit code. A program killed by signal N exits
+    with 128+N, as in `sh` (rather than -N, like `subprocess`)."""
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.waitstatus_to_exitcode(status)
+
+
+class SpawnedProcess:
+    """A child process started with `posix_spawn`."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: int | None = None
+        self._lock = threading.Lock()
+
+    def _reap(self, blocking: bool) -> int | None:
+        if not self._lock.acquire(blocking=blocking):
+            return None  # Someone else is waiting for it already
+        try:
+            if self.returncode is None:
+                pid, status = os.waitpid(self.pid, 0 if blocking else os.WNOHANG)
+                if pid:
+                    self.returncode = exit_code(status)
+        finally:
+            self._lock.release()
+        return self.returncode
+
+    def poll(self) -> int | None:
+        return self._reap(blocking=False)
+
+    def wait(self) -> int:
+        return self._reap(blocking=True)
+
+    def send_signal(self, sig: int):
+        # Once it's been reaped, its pid could belong to something else
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+
+class ServerProcess(SpawnedProcess):
+    """A process started by the fork server. It's the server's child, not ours, so the server
+    tells us when it exits."""
+
+    def __init__(self, pid: int, exit_code: Future[int]):
+        super().__init__(pid)
+        self.exit_code = exit_code
+
+    def _reap(self, blocking: bool) -> int | None:
+        if blocking or self.exit_code.done():
+            self.returncode = self.exit_code.result()
+        return self.returncode
+
+
+def posix_spawn(
+    argv: list[str], stdin: int | None, stdout: int | None, stderr: int | None, new_session: bool
+) -> SpawnedProcess:
+    file_actions = [
+        (os.POSIX_SPAWN_DUP2, fd, target)
+        for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2))
+        if fd is not None
+    ]
+    pid = os.posix_spawnp(
+        argv[0],
+        argv,
+        os.environ,
+        file_actions=file_actions,
+        setsid=new_session,
+        setsigdef=RESET_SIGNALS,
+    )
+    return SpawnedProcess(pid)
+
+
+def popen(
+    argv: list[str], stdin: int | None, stdout: int | None, stderr: int | None, new_session: bool
+) -> Process:
+    # For platforms without posix_spawn
+    return subprocess.Popen(
+        argv, stdin=stdin, stdout=stdout, stderr=stderr, start_new_session=new_session
+    )
+
+
+class ForkServer:
+    """The shell's end of the connection to the fork server."""
+
+    def __init__(self):
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "turtleshell.launcher", str(theirs.fileno())],
+                pass_fds=[theirs.fileno()],
+            )
+        except BaseException:
+            ours.close()
+            raise
+        finally:
+            theirs.close()
+        self.sock = ours
+        self.ids = itertools.count()
+        self.send_lock = threading.Lock()
+        self.replies: dict[int, Future[dict]] = {}
+        self.exits: dict[int, Future[int]] = {}
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def spawn(
+        self,
+        argv: list[str],
+        stdin: int | None,
+        stdout: int | None,
+        stderr: int | None,
+        new_session: bool,
+    ) -> ServerProcess:
+        request = {
+            "id": next(self.ids),
+            "argv": argv,
+            "stdin": stdin is not None,
+            "stdout": stdout is not None,
+            "stderr": stderr is not None,
+            "new_session": new_session,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+        }
+        reply: Future[dict] = Future()
+        self.replies[request["id"]] = reply
+        fds = [fd for fd in (stdin, stdout, stderr) if fd is not None]
+        with self.send_lock:
+            socket.send_fds(self.sock, [json.dumps(request).encode()], fds)
+        result = reply.result()
+        if "errno" in result:
+            raise OSError(result["errno"], os.strerror(result["errno"]), argv[0])
+        return ServerProcess(result["pid"], result["exit"])
+
+    def read_replies(self):
+        try:
+            while message := self.sock.recv(MAX_MESSAGE_SIZE):
+                reply = json.loads(message)
+                if "id" in reply:
+                    # The server always reports a process starting before it reports it exiting
+                    if "pid" in reply:
+                        reply["exit"] = self.exits[reply["pid"]] = Future()
+                    self.replies.pop(reply["id"]).set_result(reply)
+                else:
+                    self.exits.pop(reply["pid"]).set_result(reply["code"])
+        except OSError:
+            pass
+        # The server has gone away, so nothing else is going to be reported
+        error = ConnectionError("fork server exited")
+        for future in [*self.replies.values(), *self.exits.values()]:
+            future.set_exception(error)
+
+    def close(self):
+        # Shutting down (rather than just closing) wakes up the reader thread, and tells the server
+        #   to exit
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+        self.process.wait()
+
+
+class Launcher:
+    def __init__(self):
+        self.fork_server: ForkServer | None = None
+        self.clear_stats()
+
+    @property
+    def method(self) -> str:
+        if self.fork_server is not None:
+            return "fork server"
+        return "posix_spawn" if hasattr(os, "posix_spawnp") else "subprocess"
+
+    def start_fork_server(self) -> bool:
+        """Start using a fork server. Returns False if one couldn't be started."""
+        if self.fork_server is None:
+            try:
+                self.fork_server = ForkServer()
+            except OSError:
+                return False
+        return True
+
+    def stop_fork_server(self):
+        if self.fork_server is not None:
+            self.fork_server.close()
+            self.fork_server = None
+
+    def spawn(
+        self,
+        argv: list[str],
+        stdin: int | None = None,
+        stdout: int | None = None,
+        stderr: int | None = None,
+        new_session: bool = False,
+    ) -> Process:
+        """Start running a program. `stdin`, `stdout` and `stderr` are file descriptors (or None to
+        use the shell's own). The caller is still responsible for closing them."""
+        start = time.perf_counter()
+        if self.fork_server is not None:
+            process = self.fork_server.spawn(argv, stdin, stdout, stderr, new_session)
+        elif hasattr(os, "posix_spawnp"):
+            process = posix_spawn(argv, stdin, stdout, stderr, new_session)
+        else:
+            process = popen(argv, stdin, stdout, stderr, new_session)
+        elapsed = time.perf_counter() - start
+        self.spawned += 1
+        self.total_time += elapsed
+        self.latencies.append(elapsed)
+        return process
+
+    def clear_stats(self):
+        self.spawned = 0
+        self.total_time = 0.0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def stats(self) -> dict[str, str | int]:
+        """Spawn latency statistics. Percentiles are over the most recent spawns."""
+        stats: dict[str, str | int] = {"method": self.method, "spawned": self.spawned}
+        if self.latencies:
+            recent = sorted(self.latencies)
+            stats["mean_us"] = round(self.total_time / self.spawned * 1e6)
+            stats["p50_us"] = round(statistics.median(recent) * 1e6)
+            stats["p99_us"] = round(recent[int(len(recent) * 0.99)] * 1e6)
+            stats["max_us"] = round(recent[-1] * 1e6)
+        return stats
+
+
+launcher = Launcher()
+
+
+def serve(sock: socket.socket):
+    """The fork server's main loop. It runs until the shell closes its end of the socket."""
+    os.set_inheritable(sock.fileno(), False)
+    # Ctrl-C is meant for the programs we start, not for us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sock:
+                try:
+                    message, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE_SIZE, 3)
+                except ConnectionError:
+                    return
+                if not message:
+                    return
+                sock.send(json.dumps(start_child(json.loads(message), fds)).encode())
+            else:
+                os.read(wakeup_r, 512)
+                for pid, code in reap_children():
+                    sock.send(json.dumps({"pid": pid, "code": code}).encode())
+
+
+def start_child(request: dict, fds: list[int]) -> dict:
+    received = iter(fds)
+    stdin = next(received) if request["stdin"] else None
+    stdout = next(received) if request["stdout"] else None
+    stderr = next(received) if request["stderr"] else None
+    # If exec fails, the child writes the errno to this pipe. If it succeeds, the pipe just closes.
+    error_r, error_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(error_r)
+            signal.set_wakeup_fd(-1)
+            for sig in (signal.SIGINT, signal.SIGCHLD, *RESET_SIGNALS):
+                signal.signal(sig, signal.SIG_DFL)
+            if request["new_session"]:
+                os.setsid()
+            for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2)):
+                if fd is not None:
+                    os.dup2(fd, target)
+            for fd in fds:
+                if fd > 2:
+                    os.close(fd)
+            os.chdir(request["cwd"])
+            os.execvpe(request["argv"][0], request["argv"], request["env"])
+        except OSError as e:
+            os.write(error_w, str(e.errno).encode())
+        finally:
+            os._exit(127)
+
+    os.close(error_w)
+    for fd in fds:
+        os.close(fd)
+    with os.fdopen(error_r, "rb") as f:
+        error = f.read()
+    if error:
+        os.waitpid(pid, 0)
+        return {"id": request["id"], "errno": int(error)}
+    return {"id": request["id"], "pid": pid}
+
+
+def reap_children() -> list[tuple[int, int]]:
+    finished = []
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        finished.append((pid, exit_code(status)))
+    return finished
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])))
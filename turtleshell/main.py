@@ -1,38 +1,46 @@
-"""Main program for Ben's Incredible SHell."""
+"""Main program for Ben's Incredible SHell.
 
-import inspect
-import os
-import pathlib
-import platform
-import re
+Run `turtle` on its own for an interactive prompt, or `turtle -c COMMAND` / `turtle SCRIPT` to run
+some commands and exit (e.g. from cron or CI). The prompt_toolkit and history setup is only done for
+the interactive prompt.
 
-import colorama
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import InMemoryHistory
+`--profile` (or setting `PROFILE = true` at the prompt) reports how long each statement took.
+"""
 
-from turtleshell import builtins
-from turtleshell.errors import CommandNotFound
-from turtleshell.datatypes import Path
-from turtleshell.variables import EnvironmentVarHolder
-from turtleshell.parsing import parser
+import argparse
+from collections.abc import Iterable
+from concurrent.futures import wait
+import functools
+import pathlib
+import platform
+import sys
+import time
+from typing import Any, Callable
+
+from lark.exceptions import UnexpectedInput
+
+from turtleshell.errors import CommandNotFound, ShellError
+from turtleshell.datatypes import CommandResult, Path
+from turtleshell.jobs import scheduler
+from turtleshell.launcher import launcher
+from turtleshell.variables import DEFAULT_VALUES, EnvironmentVarHolder
+from turtleshell.parsing import Token, parse_cache, parse_with_positions, parser
+from turtleshell.prompt import compile_prompt
+from turtleshell import profiling, providers, streams
 from turtleshell.evaluate import evaluate
-from turtleshell.multilines import is_complete, concatenate_incomplete_lines
+from turtleshell.multilines import (
+    LineLexer,
+    concatenate_incomplete_lines,
+    join_statements,
+    number_statements,
+)
 
 VERSION = "0.0.1"
 
-colorama.init()
-
 ENV_VARS = EnvironmentVarHolder()
 
-BUILTINS: dict[str, builtins.Command] = {}
-
-
-def load_builtins():
-    members = inspect.getmembers()
-    for member in members:
-        if inspect.issubclass(member, builtins.Command):
-            cmd = member()
-            BUILTINS[cmd.name] = cmd
+# Where history used to be kept, as plain text. It's imported into the new history file once.
+LEGACY_HISTFILE = pathlib.Path("~/.turtle_history")
 
 
 def get_histfile() -> pathlib.Path:
@@ -41,58 +49,198 @@ def get_histfile() -> pathlib.Path:
         if isinstance(histfile, Path):
             return histfile.value.expanduser().resolve()
     # Else, return a default value
-    return pathlib.Path("~/.turtle_history").expanduser().resolve()
+    return pathlib.Path("~/.turtle_history.sqlite").expanduser().resolve()
+
+
+# How long to wait for slow prompt segments (like `$(...)`) before drawing the prompt without them
+PROMPT_WAIT = 0.005
+
+
+def get_prompts(on_update: Callable[[], Any] | None = None) -> tuple[Callable[[], str], ...]:
+    """Returns functions which render the primary and right-hand prompts. Slow segments keep
+    updating in the background, calling `on_update` when they change."""
+    providers.new_prompt()
+    templates = [compile_prompt(ENV_VARS[name]) for name in ("PROMPT1", "RPROMPT1")]
+    if futures := [f for template in templates for f in template.refresh(ENV_VARS, on_update)]:
+        wait(futures, timeout=PROMPT_WAIT)
+    return tuple(functools.partial(template.render, ENV_VARS) for template in templates)
+
+
+def get_prompt() -> str:
+    """Returns the primary prompt string, with any variables expanded."""
+    prompt, _ = get_prompts()
+    return prompt()
+
+
+def report_finished_jobs():
+    """Let the user know about any background jobs that have finished since the last prompt."""
+    for job in scheduler.reap():
+        streams.write(f"{job}\n")
+
+
+def get_parse_cache_size() -> int:
+    try:
+        return int(ENV_VARS["PARSECACHESIZE"])
+    except (TypeError, ValueError):
+        return DEFAULT_VALUES["PARSECACHESIZE"]
+
+
+def run_statements(statements: Iterable[Token]) -> int:
+    """Evaluate some statements, stopping at the first error. Returns the exit code."""
+    exit_code = 0
+    try:
+        for statement in statements:
+            result = evaluate(statement, ENV_VARS)
+            exit_code = result.code if isinstance(result, CommandResult) else 0
+    except CommandNotFound as e:
+        streams.write_error(f"{e}: command not found\n")
+        exit_code = 127
+    except ShellError as e:
+        streams.write_error(f"{e}\n")
+        exit_code = 1
+    return exit_code
+
+
+def profiling_enabled() -> bool:
+    return bool(ENV_VARS["PROFILE"])
+
+
+def run_profiled(statements: Iterable[Token]) -> int:
+    """Like `run_statements`, but reports how long each statement took afterwards (and writes a
+    trace to PROFILETRACE, if it's set)."""
+    profiling.start()
+    try:
+        return run_statements(statements)
+    finally:
+        profiler = profiling.stop()
+        streams.write_error(profiler.report())
+        if trace := ENV_VARS["PROFILETRACE"]:
+            try:
+                profiler.write_trace(pathlib.Path(str(trace)).expanduser())
+            except OSError as e:
+                streams.write_error(f"turtle: couldn't write the trace: {e}\n")
+
+
+def run_script(text: str) -> int:
+    """Run a whole script in one go, without an interactive prompt. Returns the exit code."""
+    if not (statements := number_statements(text)):
+        return 0
+    profile = profiling_enabled()
+    try:
+        source = join_statements(statements)
+        # Line numbers are only needed for the profile
+        tokens = parse_with_positions(source) if profile else parser.parse(source).children
+    except UnexpectedInput as e:
+        streams.write_error(f"syntax error: {e}\n")
+        streams.flush()
+        return 2
+    try:
+        return run_profiled(tokens) if profile else run_statements(tokens)
+    finally:
+        streams.flush()
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(prog="turtle", description="🐢 turtle shell")
+    source = arg_parser.add_mutually_exclusive_group()
+    source.add_argument("-c", dest="command", help="run COMMAND and exit")
+    source.add_argument("script", nargs="?", type=pathlib.Path, help="run SCRIPT and exit")
+    arg_parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="start programs from a small helper process, rather than from the shell itself",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="report how long each statement took (the same as setting PROFILE = true)",
+    )
+    arg_parser.add_argument(
+        "--profile-trace",
+        metavar="TRACE",
+        type=pathlib.Path,
+        help="profile, and also write a Chrome trace to TRACE (e.g. for ui.perfetto.dev)",
+    )
+    arg_parser.add_argument("--version", action="version", version=f"turtle {VERSION}")
+    return arg_parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = get_arg_parser().parse_args(argv)
+    if args.fork_server and not launcher.start_fork_server():
+        streams.write_error("turtle: couldn't start the fork server\n")
+    if args.profile or args.profile_trace is not None:
+        ENV_VARS["PROFILE"] = True
+    if args.profile_trace is not None:
+        ENV_VARS["PROFILETRACE"] = Path(args.profile_trace)
+    if args.command is not None:
+        return run_script(args.command)
+    if args.script is not None:
+        try:
+            text = args.script.read_text()
+        except OSError as e:
+            streams.write_error(f"turtle: {e}\n")
+            return 127
+        return run_script(text)
+    return interactive()
 
 
-def main():
+def interactive() -> int:
+    # prompt_toolkit is slow to import, so scripts don't pay for it
+    import colorama
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.auto_suggest import ThreadedAutoSuggest
+    from prompt_toolkit.history import ThreadedHistory
+
+    from turtleshell.completion import CompletionEngine, ShellCompleter
+    from turtleshell.history import HistorySuggest, SQLiteHistory
+
+    colorama.init()
     print("🐢 turtle version " + VERSION)
     if platform.system() not in ("Windows", "Linux", "Darwin"):
         print(f"Unsupported platform: '{platform.system()}'. Must exit now.")
-        exit(1)
-
-    # Initialize prompt history
-    histfile = get_histfile()
-    with histfile.open("r") as f:
-        history = [line.strip() for line in f.readlines()]
-    # Only keep the last 100 commands
-    if len(history) > 100:
-        history = history[-100:]
-        with histfile.open("w") as f:
-            f.write(os.linesep.join(history))
-
-    prompt_session = PromptSession(history=InMemoryHistory(history_strings=history))
+        return 1
+
+    # History is loaded in the background, so it doesn't hold up the first prompt
+    history = SQLiteHistory(get_histfile(), legacy_file=LEGACY_HISTFILE.expanduser())
+    # So is the index of commands for tab completion
+    completion = CompletionEngine(ENV_VARS)
+    completion.start()
+    prompt_session = PromptSession(
+        history=ThreadedHistory(history),
+        completer=ShellCompleter(completion),
+        # Looking through the whole history shouldn't hold up typing
+        auto_suggest=ThreadedAutoSuggest(HistorySuggest(history)),
+    )
 
     while True:
-        prompt1: str = ENV_VARS["PROMPT1"]
-        env_vars = set(m for m in re.findall(r"\$\w+", prompt1))
-        for env_var in env_vars:
-            prompt1 = prompt1.replace(env_var, str(ENV_VARS.get(env_var[1:], "")))
-
-        input_ = [prompt_session.prompt(prompt1).strip()]
-        while not is_complete(" ".join(input_)):
+        report_finished_jobs()
+        streams.flush()
+        prompt, rprompt = get_prompts(on_update=prompt_session.app.invalidate)
+        input_ = [prompt_session.prompt(prompt, rprompt=rprompt).strip()]
+        lexer = LineLexer()
+        lexer.feed(input_[0])
+        while not lexer.complete:
             input_.append(prompt_session.prompt(ENV_VARS["PROMPT2"]))
+            lexer.feed(input_[-1].rstrip())
 
         input_ = concatenate_incomplete_lines(input_)
 
-        # Log input to history file
-        histfile = get_histfile()
-        with histfile.open("a") as f:
-            f.write(input_ + os.linesep)
-
         # If nothing is entered, just move to next loop
         if not input_:
             continue
 
         if input_ == "exit":
-            break
+            return 0
 
-        tree = parser.parse(input_)
-        try:
-            for statement in tree.children:
-                evaluate(statement, ENV_VARS)
-        except CommandNotFound as e:
-            print(f"{e}: command not found")
+        started, start_time = time.time(), time.perf_counter()
+        if profiling_enabled():
+            exit_code = run_profiled(parse_with_positions(input_))
+        else:
+            parse_cache.resize(get_parse_cache_size())
+            exit_code = run_statements(parse_cache.parse(input_))
+        history.record(input_, exit_code, time.perf_counter() - start_time, started)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -2,46 +2,130 @@
 
 import re
 
-pattern = r"([\"'])(?:(?=(\\?))\2.)*?\1"
+# Lines starting with these words carry on the statement before them, rather than starting a new one
+CONTINUATION = re.compile(r"\s*(elif|else)\b")
+DO_WHILE = (re.compile(r"\s*do\b"), re.compile(r"\s*while\b"))
+
+BRACKETS = {"(": ")", "[": "]", "{": "}"}
+
+# The characters which can change the lexer's state. Everything else is skipped over in one go.
+SPECIAL = re.compile(r"[\\\"'#()\[\]{}]")
+IN_STRING = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+
+
+class LineLexer:
+    """Keeps track of quotes, escapes and brackets across lines, so we know whether the input so far
+    is a complete statement. Each line is only looked at once, however many lines there are."""
+
+    def __init__(self):
+        self.brackets: list[str] = []  # The closing brackets we're waiting for, innermost last
+        self.quote: str | None = None  # The quote character, if we're inside a string
+        self.continued = False  # If the last line ended with an escaping backslash
+        self.broken = False  # If there's a stray closing bracket
+
+    @property
+    def complete(self) -> bool:
+        # Don't keep asking for input when there's a syntax error: let the parser complain about it
+        if self.broken:
+            return True
+        return not (self.brackets or self.quote or self.continued)
+
+    def feed(self, line: str) -> bool:
+        """Read one more line (without its newline), and return whether the input is complete."""
+        self.continued = False
+        i, end = 0, len(line)
+        while i < end:
+            if self.quote is not None:
+                # Skip to the end of the string, or the next escape inside it
+                match = IN_STRING[self.quote].search(line, i)
+                if match is None:
+                    break
+                if match[0] == "\\":
+                    if match.end() == end:
+                        self.continued = True
+                    i = match.end() + 1
+                else:
+                    self.quote, i = None, match.end()
+                continue
+
+            match = SPECIAL.search(line, i)
+            if match is None:
+                break
+            char, i = match[0], match.end()
+            if char == "\\":
+                if i == end:
+                    self.continued = True
+                i += 1  # Whatever comes next is escaped
+            elif char in "\"'":
+                self.quote = char
+            elif char == "#":
+                break  # The rest of the line is a comment
+            elif char in BRACKETS:
+                self.brackets.append(BRACKETS[char])
+            elif self.brackets and self.brackets[-1] == char:
+                self.brackets.pop()
+            else:
+                self.broken = True
+        return self.complete
 
 
 def is_complete(text: str) -> bool:
     """Returns true if there's a complete statement or not."""
-    # Check if the line ends with a slash
-    if text.strip().endswith(" \\"):
-        return False
+    lexer = LineLexer()
+    for line in text.split("\n"):
+        lexer.feed(line.rstrip())
+    return lexer.complete
 
-    # Count the number of unescaped braces and brackets
-    # We need to ignore anything inside a string, so for this purpose, we can pretend any strings
-    #   don't exist.
-    nostring_text = re.sub(pattern, "", text)
 
-    bracket_styles = ("()", "{}")
-    for bstyle in bracket_styles:
-        lbrace, rbrace = bstyle
-        nl = nostring_text.count(lbrace) - nostring_text.count("\\" + lbrace)
-        nr = nostring_text.count(rbrace) - nostring_text.count("\\" + rbrace)
-        if nl == nr + 1:
-            return False
+def concatenate_incomplete_lines(lines: list[str]) -> str:
+    """Takes a bunch of potentially-incomplete lines, and concatenates them."""
+    lexer = LineLexer()
+    parts: list[str] = []
+    for line in lines:
+        if parts:
+            # A line break in a string becomes a space, otherwise keep it (so comments still end)
+            parts.append(" " if lexer.quote else "\n")
+        line = line.rstrip()
+        if lexer.quote is None:
+            line = line.lstrip()
+        lexer.feed(line)
+        if lexer.continued:
+            line = line[:-1].rstrip()  # Remove trailing '\'
+        parts.append(line)
+    return "".join(parts)
 
-    # Default to True so we don't get stuck perpetually waiting for more input if the uer made a
-    #   syntax error
-    return True
 
+def number_statements(text: str) -> list[tuple[int, str]]:
+    """Splits a script up into its top-level statements, along with the line each one starts on
+    (counting from 1). In a script, a new line starts a new statement, unless the statement so far
+    is incomplete or the line carries it on (like `else`)."""
+    statements: list[tuple[int, list[str]]] = []
+    lexer = LineLexer()
+    for number, line in enumerate(text.splitlines(), start=1):
+        if lexer.complete:
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            continues = statements and (
+                CONTINUATION.match(line)
+                or (DO_WHILE[0].match(statements[-1][1][0]) and DO_WHILE[1].match(line))
+            )
+            if not continues:
+                statements.append((number, []))
+        statements[-1][1].append(line)
+        lexer.feed(line.rstrip())
+    return [(number, concatenate_incomplete_lines(lines)) for number, lines in statements]
 
-def concatenate_incomplete_lines(lines: list[str]):
-    """Takes a bunch of potentially-incomplete lines, and concatenates them."""
-    complete_lines: list[str] = []  # Holder of complete lines
-    line_buffer: str = ""  # Store parts of complete lines until we find the end of them
 
-    for line in lines:
-        if is_complete(line_buffer + line):
-            complete_lines.append(line_buffer + line)
-            line_buffer = ""
-        else:
-            if line.strip().endswith(" \\"):
-                # Remove trailing '\'
-                line = line.strip()[:-2]
-            line_buffer += line.strip() + " "
-
-    return " ".join(complete_lines)
+def join_statements(statements: list[tuple[int, str]]) -> str:
+    """Joins numbered statements back into something the parser accepts, keeping each one on the
+    line it started on (so line numbers in the parse tree match the script)."""
+    parts: list[str] = []
+    line = 1
+    for number, statement in statements:
+        if parts:
+            # Separate statements with a line break as well, in case one ends with a comment
+            parts.append("\n;")
+            line += 1
+        parts.append("\n" * (number - line) + statement)
+        line = number + statement.count("\n")
+    return "".join(parts)
@@ -1,74 +1,179 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
+import hashlib
+import io
+import os
 import pathlib
-from typing import Any, Callable
-import subprocess
+import threading
+from operator import add, eq, ge, gt, iadd, imul, le, lt, mul, ne, sub, truediv
+from typing import Any, Callable, Iterable, Iterator
 
+import lark
 from lark import Lark, Transformer, v_args
 from lark.lexer import Token as LexerToken
 
-from turtleshell.datatypes import CommandResult, Path
-from turtleshell.errors import CommandNotFound
-from turtleshell.variables import EnvironmentVarHolder
-import turtleshell.util
+from turtleshell import profiling, providers, streams
+from turtleshell.builtins import get_builtin
+from turtleshell.datatypes import CommandResult, List, PathList, share
+from turtleshell.errors import (
+    ArgumentError,
+    BreakLoop,
+    CommandNotFound,
+    ContinueLoop,
+    LoopControl,
+    NotParallelSafe,
+    ShellError,
+)
+from turtleshell.filters import get_filter
+from turtleshell.jobs import scheduler
+from turtleshell.pipeline import (
+    BuiltinStage,
+    ExternalStage,
+    SUBSTITUTION_LIMIT,
+    LimitedBuffer,
+    PipelineRun,
+    Stage,
+    OutputLines,
+    Redirect,
+    read_output,
+    run_external,
+)
+from turtleshell.variables import EnvironmentVarHolder, getter, setter, slot
+
+
+# `+=` and `*=` change lists in place (see `List`); for anything else they're the same as `+` and `*`
+ASSIGNMENT_OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "=": lambda _, y: y,
+    "+=": iadd,
+    "-=": sub,
+    "*=": imul,
+    "/=": truediv,
+}
+IN_PLACE = (iadd, imul)
+
+BINARY_OPERATORS: dict[str, Callable[[Any, Any], Any]] = {
+    "+": add,
+    "*": mul,
+    "-": sub,
+    "/": truediv,
+    ">": gt,
+    "<": lt,
+    "==": eq,
+    "!=": ne,
+    "<=": le,
+    ">=": ge,
+}
 
 
 @v_args(inline=True)
 class MyTransformer(Transformer):
     def assignment(self, varname: str, operator: str, value: LexerToken):
-        # ruff: noqa: E731
-        #   Prevent linter from complaining about assignment of lambda to variable
-        f: Callable[[Any, Any], Any] = None
-        match operator:
-            case "=":
-                f = lambda _, y: y
-            case "+=":
-                f = lambda x, y: x + y
-            case "-=":
-                f = lambda x, y: x - y
-            case "*=":
-                f = lambda x, y: x * y
-            case "/=":
-                f = lambda x, y: x / y
-            case "_":
-                raise ValueError(f"Invalid assignment operator: {operator}")
-
-        return Assignment(varname, value, f)
-
-    def command(self, command_name: LexerToken, *options):
-        return Command(command_name.value, *options)
+        if operator not in ASSIGNMENT_OPERATORS:
+            raise ValueError(f"Invalid assignment operator: {operator}")
+        return Assignment(varname, value, ASSIGNMENT_OPERATORS[operator])
+
+    def background(self, statement: Command | Pipeline):
+        return Background(statement)
+
+    def command(self, command_name: LexerToken, *args):
+        options = [arg for arg in args if not isinstance(arg, Redirect)]
+        redirects = [arg for arg in args if isinstance(arg, Redirect)]
+        return Command(command_name.value, *options, redirects=redirects)
+
+    def break_(self):
+        return Break()
+
+    def composite_conditional(self, left: Any, operator: LexerToken, right: Any):
+        return (And if operator == "and" else Or)(left, right)
 
     def cond_eq(self, left: Any, right: Any):
         return IsEqualTo(left, right)
 
-    def conditional(self, conditional):
+    def conditional(self, conditional, *operations):
+        # Operators are applied left to right, e.g. `1 + 2 < 4` means `(1 + 2) < 4`
+        for operator, value in zip(operations[::2], operations[1::2]):
+            conditional = BinaryOperation(conditional, str(operator), value)
         return conditional
 
+    def continue_(self):
+        return Continue()
+
+    def do(self, statement_block: StatementBlock):
+        return statement_block
+
+    def dowhile(self, do: StatementBlock, while_: Conditional):
+        return While(while_, do, check_first=False)
+
     def env_var(self, varname: str):
         return EnvVar(varname[1:])
 
-    def false(self, _):
+    def false(self):
         return False
 
     def float(self, n):
         return float(n)
 
-    def if_(self, cond: Conditional, statement: Statement, else_: Statement):
+    def here_string(self, operator: LexerToken, value: Any):
+        return Redirect(str(operator), value)
+
+    def fail_fast(self):
+        return ("fail_fast", True)
+
+    def foreach(self, *args: Any):
+        *options, name, source, body = args
+        options = dict(options)
+        foreach = Foreach(name, source, body, fail_fast=options.get("fail_fast", False))
+        # Only `-j` makes it parallel: `--fail-fast` on its own stops a normal loop
+        if "max_jobs" in options:
+            return ParallelForeach(foreach, options["max_jobs"])
+        return foreach
+
+    def for_(self, init: Statement, cond: Conditional, step: Statement, body: StatementBlock):
+        return For(init, cond, step, body)
+
+    def if_(self, cond: Conditional, statement: Statement, *elifs_and_else: Any):
+        # Work backwards, so each `elif` becomes the `else` of the branch before it
+        else_ = elifs_and_else[-1] if len(elifs_and_else) % 2 else None
+        elifs = elifs_and_else[: len(elifs_and_else) - len(elifs_and_else) % 2]
+        for elif_cond, elif_statement in reversed(list(zip(elifs[::2], elifs[1::2]))):
+            else_ = If(elif_cond, elif_statement, else_)
         return If(cond, statement, else_)
 
+    def inline_statement(self, statement: Statement):
+        return Substitution(statement)
+
     def int(self, n):
         return int(n)
 
+    def list_(self, *items: Any):
+        return ListLiteral(*items)
+
+    def max_jobs(self, n: LexerToken):
+        return ("max_jobs", int(n))
+
+    def merge_stderr(self, operator: LexerToken):
+        return Redirect(str(operator))
+
     def nested_conditional(self, cond: Conditional):
         return NestedConditional(cond)
 
-    def null(self, _):
+    def null(self):
         return None
 
     def option(self, option):
         """Return the option value, instead of a lexer token"""
         return option
 
+    def pipeline(self, *commands: Command):
+        return Pipeline(*commands)
+
+    def redirect(self, operator: LexerToken, target: Any):
+        return Redirect(str(operator), target)
+
     def statement(self, statement):
         """Return the statement value, instead of a lexer token"""
         return statement
@@ -82,14 +187,55 @@ class MyTransformer(Transformer):
     def true(self):
         return True
 
+    def value(self, value: Any):
+        """Return the value itself (e.g. a substitution), instead of a tree"""
+        return value
+
+    def while_(self, cond: Conditional):
+        return cond
+
+    def whiledo(self, while_: Conditional, do: StatementBlock):
+        return While(while_, do)
+
+
+# 'for' and 'while' are Python keywords, so the methods can't be named after their rules
+setattr(MyTransformer, "for", MyTransformer.for_)
+setattr(MyTransformer, "while", MyTransformer.while_)
+
 
 class Token:
+    _compiled: Callable[[EnvironmentVarHolder], Any] | None = None
+    line: int | None = None  # Only known when parsed with `parse_with_positions`
+    profiled = False  # Whether the profiler should time this token
+
     @abstractmethod
     def eval(self, env: EnvironmentVarHolder):
         pass
 
+    def compile(self) -> Callable[[EnvironmentVarHolder], Any]:
+        """Returns a function which behaves like `eval`. Subclasses override this to do as much
+        work as possible up-front, so that loop bodies don't repeat it on every iteration."""
+        return self.eval
+
+    def compiled(self) -> Callable[[EnvironmentVarHolder], Any]:
+        """Returns the compiled version of this token, compiling it the first time."""
+        if profiling.profiler is not None:
+            return profiling.profiler.compiled(self)
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled
+
+
+def compile_value(value: Any) -> Callable[[EnvironmentVarHolder], Any]:
+    """Compiles a token, or wraps a constant in a function which returns it."""
+    if isinstance(value, Token):
+        return value.compiled()
+    return lambda _: value
+
 
 class Assignment(Token):
+    profiled = True
+
     def __init__(self, name: str, value: Any, func: Callable[[Any, Any], Any]):
         self.name = name
         self.value = value
@@ -99,11 +245,70 @@ class Assignment(Token):
         value = self.value
         if isinstance(value, Token):
             value = value.eval(env)
-        env[self.name] = self.func(env[self.name], value)
+        if isinstance(self.value, EnvVar):
+            # e.g. `ys = $xs`: both variables hold the same list now
+            share(value)
+        current = env[self.name]
+        if type(current) is List and current.owner is not env.owner and self.func in IN_PLACE:
+            current = current.copy(env.owner)
+        env[self.name] = self.func(current, value)
+
+    def compile(self):
+        func, value = self.func, self.value
+        get, set_ = getter(self.name), setter(self.name)
+        get_value = compile_value(value)
+
+        if func is ASSIGNMENT_OPERATORS["="]:
+            if isinstance(value, EnvVar):
+
+                def assignment(env: EnvironmentVarHolder):
+                    # e.g. `ys = $xs`: both variables hold the same list now
+                    set_(env, share(get_value(env)))
+            elif isinstance(value, Token):
+
+                def assignment(env: EnvironmentVarHolder):
+                    set_(env, get_value(env))
+            else:
+
+                def assignment(env: EnvironmentVarHolder):
+                    set_(env, value)
+        elif func is iadd and isinstance(value, ListLiteral):
+            # e.g. `xs += [$i]`: add the items straight onto the list, rather than making a list of
+            #   them to add
+            get_items = [compile_value(item) for item in value.items]
+
+            def assignment(env: EnvironmentVarHolder):
+                current = get(env)
+                if type(current) is List and current.owner is env.owner:
+                    for get_item in get_items:
+                        current.append(get_item(env))
+                    return
+                if type(current) is List:
+                    current = current.copy(env.owner)
+                set_(env, func(current, get_value(env)))
+        elif func in IN_PLACE:
+            # Lists are changed in place, so they have to be our own first
+            is_constant = not isinstance(value, Token)
+
+            def assignment(env: EnvironmentVarHolder):
+                current = get(env)
+                if type(current) is List and current.owner is not env.owner:
+                    current = current.copy(env.owner)
+                set_(env, func(current, value if is_constant else get_value(env)))
+        elif isinstance(value, Token):
+
+            def assignment(env: EnvironmentVarHolder):
+                set_(env, func(get(env), get_value(env)))
+        else:
+
+            def assignment(env: EnvironmentVarHolder):
+                set_(env, func(get(env), value))
+
+        return assignment
 
 
 class Statement(Token):
-    pass
+    profiled = True
 
 
 class Conditional(Token, ABC):
@@ -112,25 +317,123 @@ class Conditional(Token, ABC):
         pass
 
 
+# The constants a condition can be, e.g. `if (true)`
+LITERALS = (bool, int, float, str, type(None))
+
+
 class NestedConditional(Conditional):
     def __init__(self, conditional: Conditional):
+        if not isinstance(conditional, (Token, *LITERALS)):
+            raise TypeError(f"Can't use {conditional!r} as a condition")
         self.conditional = conditional
 
     def eval(self, env: EnvironmentVarHolder) -> bool:
-        return self.conditional.eval(env)
+        if isinstance(self.conditional, Token):
+            return self.conditional.eval(env)
+        return self.conditional
+
+    def compile(self):
+        return compile_value(self.conditional)
 
 
 class If(Token):
+    profiled = True
+
     def __init__(self, conditional: Conditional, statement: Statement, else_: Token = None):
         self.conditional = conditional
         self.statement = statement
         self.else_ = else_
 
     def eval(self, env: EnvironmentVarHolder):
-        if self.conditional.eval(env):
-            self.statement.eval(env)
+        conditional = self.conditional
+        if isinstance(conditional, Token):
+            conditional = conditional.eval(env)
+        if conditional:
+            return self.statement.eval(env)
         elif self.else_:
-            self.else_.eval(env)
+            return self.else_.eval(env)
+
+    def compile(self):
+        statement = self.statement.compiled()
+        else_ = self.else_.compiled() if self.else_ else None
+
+        # If the condition is a constant, we already know which branch to take
+        if not isinstance(self.conditional, Token):
+            if self.conditional:
+                return statement
+            return else_ if else_ else lambda _: None
+
+        conditional = self.conditional.compiled()
+        if else_ is None:
+
+            def if_(env: EnvironmentVarHolder):
+                if conditional(env):
+                    return statement(env)
+        else:
+
+            def if_(env: EnvironmentVarHolder):
+                if conditional(env):
+                    return statement(env)
+                return else_(env)
+
+        return if_
+
+
+class And(Conditional):
+    """`x and y`: y is only evaluated if x is true."""
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def eval(self, env):
+        x = self.x.eval(env) if isinstance(self.x, Token) else self.x
+        if not x:
+            return x
+        return self.y.eval(env) if isinstance(self.y, Token) else self.y
+
+    def compile(self):
+        get_x, get_y = compile_value(self.x), compile_value(self.y)
+        return lambda env: get_x(env) and get_y(env)
+
+
+class Or(Conditional):
+    """`x or y`: y is only evaluated if x is false."""
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def eval(self, env):
+        x = self.x.eval(env) if isinstance(self.x, Token) else self.x
+        if x:
+            return x
+        return self.y.eval(env) if isinstance(self.y, Token) else self.y
+
+    def compile(self):
+        get_x, get_y = compile_value(self.x), compile_value(self.y)
+        return lambda env: get_x(env) or get_y(env)
+
+
+class BinaryOperation(Conditional):
+    """Compares (or does arithmetic on) two values, e.g. `$x < 10`."""
+
+    def __init__(self, x, operator: str, y):
+        self.x = x
+        self.operator = operator
+        self.y = y
+        self.func = BINARY_OPERATORS[operator]
+
+    def eval(self, env):
+        x, y = self.x, self.y
+        if isinstance(x, Token):
+            x = x.eval(env)
+        if isinstance(y, Token):
+            y = y.eval(env)
+        return self.func(x, y)
+
+    def compile(self):
+        return compile_binary_operation(self.x, self.func, self.y)
 
 
 class IsEqualTo(Conditional):
@@ -146,6 +449,26 @@ class IsEqualTo(Conditional):
             y = y.eval(env)
         return x == y
 
+    def compile(self):
+        return compile_binary_operation(self.x, eq, self.y)
+
+
+def compile_binary_operation(x: Any, func: Callable[[Any, Any], Any], y: Any):
+    """Compiles `func(x, y)`, where either of x and y may be tokens that need evaluating."""
+    x_is_token, y_is_token = isinstance(x, Token), isinstance(y, Token)
+    if x_is_token and y_is_token:
+        get_x, get_y = x.compiled(), y.compiled()
+        return lambda env: func(get_x(env), get_y(env))
+    if x_is_token:
+        get_x = x.compiled()
+        return lambda env: func(get_x(env), y)
+    if y_is_token:
+        get_y = y.compiled()
+        return lambda env: func(x, get_y(env))
+    # Both sides are constant, so we can work out the answer now
+    result = func(x, y)
+    return lambda _: result
+
 
 class EnvVar(Token):
     def __init__(self, name):
@@ -154,47 +477,664 @@ class EnvVar(Token):
     def eval(self, env: EnvironmentVarHolder) -> str:
         return env.get(self.name)
 
+    def __str__(self) -> str:
+        return f"${self.name}"
+
+    def compile(self):
+        return getter(self.name)
+
+
+class ListLiteral(Token):
+    """A list, e.g. `[1, 2, $x]`. It makes a new List every time, since Lists can be changed."""
+
+    def __init__(self, *items: Any):
+        self.items = items
+
+    def eval(self, env: EnvironmentVarHolder) -> List:
+        return List(item.eval(env) if isinstance(item, Token) else item for item in self.items)
+
+    def compile(self):
+        if not any(isinstance(item, Token) for item in self.items):
+            constant = List(self.items)
+            return lambda _: constant.copy()
+        getters = [compile_value(item) for item in self.items]
+        return lambda env: List([get(env) for get in getters])
+
+    def __str__(self) -> str:
+        return f"[{', '.join(str(item) for item in self.items)}]"
+
 
 class Command(Statement):
-    def __init__(self, name: str, *options: str):
+    def __init__(self, name: str, *options: str, redirects: Iterable[Redirect] = ()):
         self.name = name
         self.options = options
+        self.redirects = tuple(redirects)
+
+    def eval_options(self, env: EnvironmentVarHolder) -> list[Any]:
+        options = []
+        for option in self.options:
+            if isinstance(option, Token):
+                option = option.eval(env)
+            options.append(option)
+        return options
+
+    def get_argv(self, env: EnvironmentVarHolder, options: list[Any] | None = None) -> list[str]:
+        """Returns the arguments to run this as an external command. `options` can be given if
+        they've already been evaluated."""
+        if options is None:
+            options = self.eval_options(env)
+        executable = env.get_executable(self.name)
+        return [str(executable)] + [str(option) for option in options]
+
+    def get_redirects(self, env: EnvironmentVarHolder) -> list[Redirect]:
+        """Returns the redirections, with any variables in their targets filled in."""
+        return [
+            Redirect(redirect.operator, redirect.target.eval(env))
+            if isinstance(redirect.target, Token)
+            else redirect
+            for redirect in self.redirects
+        ]
+
+    def get_stage(self, env: EnvironmentVarHolder, piped: bool = False) -> Stage:
+        """Returns a stage to run this command in a pipeline. `piped` is whether it reads from the
+        previous stage, in which case a filter (like `grep`) may be run in-process instead."""
+        if cmd := get_builtin(self.name):
+            return BuiltinStage(cmd, self.eval_options(env), env, self.get_redirects(env))
+        options = self.eval_options(env)
+        redirects = self.get_redirects(env)
+        if env["BUILTINFILTERS"]:
+            piped = piped or any(redirect.fd == 0 for redirect in redirects)
+            if cmd := get_filter(self.name, options, piped):
+                return BuiltinStage(cmd, options, env, redirects)
+        return ExternalStage(self.get_argv(env, options), redirects=redirects)
+
+    def get_stages(self, env: EnvironmentVarHolder) -> list[Stage]:
+        return [self.get_stage(env)]
 
     def eval(self, env: EnvironmentVarHolder):
-        if cmd := turtleshell.util.get_builtin(self.name):
-            options = []
-            for option in self.options:
-                if isinstance(option, Token):
-                    option = option.eval(env)
-                options.append(option)
-            return cmd().run(*options)
-
-        return CommandResult.from_process(
-            subprocess.run([env.get_executable(self.name)] + list(self.options))
+        if self.redirects:
+            return PipelineRun(self.get_stages(env)).start().wait()
+
+        if cmd := get_builtin(self.name):
+            return cmd.run(*self.eval_options(env), env=env)
+
+        return run_external(self.get_argv(env))
+
+    def compile(self):
+        if self.redirects:
+            # Redirected commands (even builtins) have to run as a stage, so they get real files
+            return lambda env: PipelineRun(self.get_stages(env)).start().wait()
+
+        name = self.name
+        is_constant = not any(isinstance(option, Token) for option in self.options)
+        if is_constant:
+            options = list(self.options)
+        else:
+            getters = [compile_value(option) for option in self.options]
+
+        if cmd := get_builtin(name):
+            if is_constant:
+                return lambda env: cmd.run(*options, env=env)
+            return lambda env: cmd.run(*[get(env) for get in getters], env=env)
+
+        if is_constant:
+            args = [str(option) for option in options]
+
+            def command(env: EnvironmentVarHolder):
+                return run_external([str(env.get_executable(name)), *args])
+        else:
+
+            def command(env: EnvironmentVarHolder):
+                argv = [str(env.get_executable(name))] + [str(get(env)) for get in getters]
+                return run_external(argv)
+
+        return command
+
+    def __str__(self) -> str:
+        return " ".join(
+            [self.name]
+            + [str(option) for option in self.options]
+            + [str(redirect) for redirect in self.redirects]
         )
 
-    def get_executable(self, name: str, env: EnvironmentVarHolder) -> pathlib.Path | None:
-        for path in env["PATH"]:
-            path = Path(path)
-            if not path.value.exists():
-                continue
-            for item in path.value.iterdir():
-                if item.stem == name and turtleshell.util.is_executable(item):
-                    return item
-        # Else, raise an error because we didn't find an executable with that name
-        raise CommandNotFound(name)
+
+class Pipeline(Statement):
+    def __init__(self, *commands: Command):
+        self.commands = commands
+
+    def get_stages(self, env: EnvironmentVarHolder) -> list[Stage]:
+        # Resolve every command first, so we don't start anything if one of them doesn't exist
+        return [command.get_stage(env, piped=i > 0) for i, command in enumerate(self.commands)]
+
+    def eval(self, env: EnvironmentVarHolder) -> CommandResult:
+        return PipelineRun(self.get_stages(env)).start().wait()
+
+    def __str__(self) -> str:
+        return " | ".join(str(command) for command in self.commands)
+
+
+@contextmanager
+def keeping_cwd():
+    """Puts the working directory back when the context exits, in case something inside changed
+    it."""
+    cwd = os.getcwd()
+    try:
+        yield
+    finally:
+        if os.getcwd() != cwd:
+            os.chdir(cwd)
+            providers.invalidate("chdir")
+
+
+class Substitution(Token):
+    """A command substitution, e.g. `$(cwd)`: the text a statement writes out, without any trailing
+    line breaks.
+
+    Builtins (and anything else that doesn't run a program, like an `if` or a loop of builtins) run
+    right here, writing into a buffer in memory; only external commands and pipelines need a pipe.
+    Either way, if there's more than `limit` bytes of output, OutputTooLarge is raised.
+
+    As in a subshell, nothing done inside lasts beyond it: the statement gets a fork of the
+    environment, and the working directory is put back afterwards."""
+
+    def __init__(self, statement: Statement, limit: int = SUBSTITUTION_LIMIT):
+        self.statement = statement
+        self.limit = limit
+
+    def runs_in_process(self) -> bool:
+        statement = self.statement
+        if isinstance(statement, Command):
+            return not statement.redirects and get_builtin(statement.name) is not None
+        return not isinstance(statement, (Pipeline, Background))
+
+    def is_self_contained(self) -> bool:
+        """Whether the statement can't change anything outside the substitution, so it can run in
+        the caller's environment as it is. That's the case for most builtins, like `cwd`."""
+        statement = self.statement
+        if not isinstance(statement, Command) or statement.redirects:
+            return False
+        cmd = get_builtin(statement.name)
+        return cmd is not None and not cmd.changes_cwd
+
+    def eval(self, env: EnvironmentVarHolder) -> str:
+        return self.compiled()(env)
+
+    def compile(self):
+        statement, limit = self.statement, self.limit
+
+        if not self.runs_in_process():
+
+            def substitution(env: EnvironmentVarHolder) -> str:
+                # Builtin stages run on threads in this process, so a `cd` in one still counts
+                with keeping_cwd():
+                    return read_output(statement.get_stages(env), limit).text.rstrip("\n")
+
+            return substitution
+
+        run = statement.compiled()
+        self_contained = self.is_self_contained()
+
+        def substitution(env: EnvironmentVarHolder) -> str:
+            buffer = LimitedBuffer(limit)
+            if self_contained:
+                with streams.redirect_stdout(buffer):
+                    result = run(env)
+            else:
+                with keeping_cwd(), streams.redirect_stdout(buffer):
+                    result = run(env.fork())
+            if buffer.overflowed:
+                # Something inside ran an external command, which wrote too much and was cut off
+                raise buffer.error()
+            if isinstance(result, CommandResult):
+                if not buffer.data and isinstance(result.stdout, str):
+                    # The usual case for a builtin, like `cwd`: its result is the whole output
+                    if len(result.stdout) > limit:
+                        raise buffer.error()
+                    return result.stdout.rstrip("\n")
+                for chunk in result.chunks():
+                    buffer.write(chunk)
+            return buffer.data.decode("utf-8", errors="replace").rstrip("\n")
+
+        return substitution
+
+    def __str__(self) -> str:
+        return f"$({self.statement})"
+
+
+class Background(Statement):
+    """Runs a command or pipeline as a background job."""
+
+    def __init__(self, statement: Command | Pipeline):
+        self.statement = statement
+
+    def eval(self, env: EnvironmentVarHolder) -> CommandResult:
+        stages = self.statement.get_stages(env)
+        for stage in stages:
+            if isinstance(stage, ExternalStage):
+                stage.new_session = True
+        # Background jobs mustn't compete with the prompt for the terminal's input
+        run = PipelineRun(stages, stdin=os.open(os.devnull, os.O_RDONLY)).start()
+        job = scheduler.submit(run, str(self.statement))
+        return CommandResult(0, f"[{job.id}] {' '.join(str(pid) for pid in job.pids)}", "")
+
+
+def written(result: Any) -> Any:
+    """Writes out a statement's result (like `evaluate` does at the top level), and returns just
+    its exit code, so that it isn't written out again by whatever the statement is inside."""
+    if not isinstance(result, CommandResult) or (result.stdout is None and not result.stderr):
+        return result
+    streams.write_result(result)
+    return CommandResult(result.code, None, None)
 
 
 class StatementBlock(Token):
+    """Some statements in braces, e.g. the body of an `if` or a loop. Each statement's result is
+    written out as it finishes (so `if (true) { cwd }` prints the directory), and the block's
+    result is the last one's exit code."""
+
     def __init__(self, *statements: Statement):
         self.statements = statements
 
     def eval(self, env: EnvironmentVarHolder):
+        result = None
         for statement in self.statements:
-            statement.eval(env)
+            result = written(statement.eval(env))
+        return result
+
+    def compile(self):
+        statements = tuple(statement.compiled() for statement in self.statements)
+        if len(statements) == 1:
+            (statement,) = statements
+            if not isinstance(self.statements[0], (Command, Pipeline, Background)):
+                # Nothing else has any output to write, e.g. `{ total *= $i }`
+                return statement
+            return lambda env: written(statement(env))
+
+        def block(env: EnvironmentVarHolder):
+            result = None
+            for statement in statements:
+                result = written(statement(env))
+            return result
+
+        return block
+
+
+class For(Statement):
+    def __init__(
+        self, init: Statement, conditional: Conditional, step: Statement, body: StatementBlock
+    ):
+        self.init = init
+        self.conditional = conditional
+        self.step = step
+        self.body = body
+
+    def get_slots(self) -> list[int]:
+        """The loop variable (set by the init statement, like `i = 0`) only exists inside the loop."""
+        return [slot(self.init.name)] if isinstance(self.init, Assignment) else []
+
+    def eval(self, env: EnvironmentVarHolder):
+        frame = env.push_frame(self.get_slots())
+        try:
+            self.init.eval(env)
+            conditional = self.conditional
+            while conditional.eval(env) if isinstance(conditional, Token) else conditional:
+                try:
+                    self.body.eval(env)
+                except BreakLoop:
+                    break
+                except ContinueLoop:
+                    pass
+                self.step.eval(env)
+        finally:
+            env.pop_frame(frame)
+
+    def compile(self):
+        init, step, body = self.init.compiled(), self.step.compiled(), self.body.compiled()
+        conditional = compile_value(self.conditional)
+        slots = self.get_slots()
+
+        def for_(env: EnvironmentVarHolder):
+            frame = env.push_frame(slots)
+            try:
+                init(env)
+                while conditional(env):
+                    try:
+                        body(env)
+                    except BreakLoop:
+                        break
+                    except ContinueLoop:
+                        pass
+                    step(env)
+            finally:
+                env.pop_frame(frame)
+
+        return for_
+
+
+class While(Statement):
+    def __init__(self, conditional: Conditional, body: StatementBlock, check_first: bool = True):
+        self.conditional = conditional
+        self.body = body
+        self.check_first = check_first  # False for `do {} while ()` loops
+
+    def eval(self, env: EnvironmentVarHolder):
+        self.compile()(env)
+
+    def compile(self):
+        body, check_first = self.body.compiled(), self.check_first
+        conditional = compile_value(self.conditional)
+
+        def while_(env: EnvironmentVarHolder):
+            if not check_first:
+                try:
+                    body(env)
+                except BreakLoop:
+                    return
+                except ContinueLoop:
+                    pass
+            while conditional(env):
+                try:
+                    body(env)
+                except BreakLoop:
+                    break
+                except ContinueLoop:
+                    pass
+
+        return while_
+
+
+class Break(Statement):
+    def eval(self, env: EnvironmentVarHolder):
+        raise BreakLoop()
+
+
+class Continue(Statement):
+    def eval(self, env: EnvironmentVarHolder):
+        raise ContinueLoop()
+
+
+def iter_tokens(value: Any) -> Iterator[Token]:
+    """Yields a token and every token inside it, e.g. each statement in a block (and each token
+    in those)."""
+    if isinstance(value, Token):
+        yield value
+        value = list(vars(value).values())
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_tokens(item)
+
+
+def changes_cwd(token: Token) -> bool:
+    """Whether running a token could change the working directory, i.e. it has a `cd` in it."""
+    return any(
+        isinstance(t, Command) and (cmd := get_builtin(t.name)) is not None and cmd.changes_cwd
+        for t in iter_tokens(token)
+    )
+
+
+class Foreach(Statement):
+    def __init__(
+        self,
+        name: str,
+        source: LexerToken | Statement,
+        body: StatementBlock,
+        fail_fast: bool = False,
+    ):
+        self.name = name
+        # Either the name of a variable, or a command whose output we use. A name which isn't a
+        #   variable is run as a command.
+        self.source = source
+        self.body = body
+        self.fail_fast = fail_fast  # Whether to stop at the first iteration which fails
+
+    @contextmanager
+    def get_items(self, env: EnvironmentVarHolder) -> Iterator[Iterable[Any]]:
+        """Yields the values to loop over. Output from a command is read one line at a time, as
+        the command produces it."""
+        source = self.source
+        if isinstance(source, LexerToken) and source not in env:
+            # It isn't a variable, so it's a command without any arguments, like `foreach f in ls`
+            source = Command(str(source))
+        if isinstance(source, LexerToken):
+            value = env[source]
+            if isinstance(value, (list, tuple, List, PathList)):
+                # Changes made to the list inside the loop mustn't change what we're looping over
+                yield share(value)
+            else:
+                yield str(value).splitlines()
+        elif isinstance(source, (Command, Pipeline)):
+            with OutputLines(source.get_stages(env)) as lines:
+                yield lines
+        else:
+            # Anything else doesn't produce output, so there's nothing to loop over
+            source.eval(env)
+            yield ()
+
+    def eval(self, env: EnvironmentVarHolder):
+        self.compile()(env)
+
+    def compile(self):
+        get_items, body, fail_fast = self.get_items, self.body.compiled(), self.fail_fast
+        # The loop variable only exists inside the loop
+        slots, set_ = [slot(self.name)], setter(self.name)
+
+        def foreach(env: EnvironmentVarHolder):
+            frame = env.push_frame(slots)
+            try:
+                with get_items(env) as items:
+                    for item in items:
+                        set_(env, item)
+                        try:
+                            result = body(env)
+                        except BreakLoop:
+                            break
+                        except ContinueLoop:
+                            continue
+                        if fail_fast and isinstance(result, CommandResult) and result.code:
+                            return CommandResult(result.code, None, None)
+            finally:
+                env.pop_frame(frame)
+
+        return foreach
+
+
+class ParallelForeach(Statement):
+    """Runs the iterations of a foreach loop on a pool of threads, e.g. `foreach -j 4 ...`.
+
+    Each iteration gets its own copy of the environment, so assignments inside the loop (including
+    the loop variable) aren't visible outside of it. Output is buffered per iteration, and written
+    out in the order the iterations started (once each has finished), so output from different
+    iterations is never interleaved, and always comes out in the same order.
+
+    The working directory is shared by every thread, so a loop with a `cd` in it can't run in
+    parallel."""
+
+    def __init__(self, foreach: Foreach, max_jobs: int):
+        self.foreach = foreach
+        self.max_jobs = max_jobs
+
+    def run_iteration(
+        self, env: EnvironmentVarHolder, body: Callable, item: Any
+    ) -> tuple[bytes, Any, BaseException | None]:
+        env = env.fork()
+        env[self.foreach.name] = item
+        with streams.redirect_stdout(io.BytesIO()) as output:
+            try:
+                result = body(env)
+            except LoopControl:
+                # `break` and `continue` only end this iteration
+                result = None
+            except (Exception, ShellError) as e:
+                return output.getvalue(), None, e
+        return output.getvalue(), result, None
+
+    def report(self, future: Future) -> int:
+        """Write out the output of a finished iteration, and return its exit code."""
+        if future.cancelled():
+            return 0
+        output, result, error = future.result()
+        streams.write(output)
+        if isinstance(error, CommandNotFound):
+            streams.write_error(f"{error}: command not found\n")
+            return 1
+        elif error is not None:
+            streams.write_error(f"{error}\n")
+            return 1
+        elif isinstance(result, CommandResult):
+            return result.code
+        return 0
+
+    def eval(self, env: EnvironmentVarHolder) -> CommandResult:
+        if self.max_jobs < 1:
+            raise ArgumentError(f"foreach -j: expected at least 1 job, got {self.max_jobs}")
+        if changes_cwd(self.foreach.body):
+            raise NotParallelSafe(
+                "foreach -j: can't use cd in a parallel loop, since it would change the directory"
+                " for every iteration"
+            )
+        body = self.foreach.body.compiled()
+        max_jobs, fail_fast = self.max_jobs, self.foreach.fail_fast
+        code = 0
+        with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+            # Iterations are reported in the order they were started, whichever finishes first
+            pending: deque[Future] = deque()
+            with self.foreach.get_items(env) as items:
+                for item in items:
+                    # Don't read ahead of the workers by much, so memory use stays constant
+                    if len(pending) >= 2 * max_jobs:
+                        code = code or self.report(pending.popleft())
+                    if code and fail_fast:
+                        break
+                    pending.append(pool.submit(self.run_iteration, env, body, item))
+
+            if code and fail_fast:
+                for future in pending:
+                    future.cancel()
+            for future in pending:
+                code = code or self.report(future)
+        return CommandResult(code, None, None)
+
+
+GRAMMAR_FILE = pathlib.Path(__file__).parent / "spec.lark"
+
+
+def get_cache_file(name: str = "parser") -> str | bool:
+    """Returns where the compiled parser tables should be cached. The file name includes a hash of
+    the grammar and the Lark version, so changes to either will cause the tables to be rebuilt.
+    Falls back to letting Lark choose a location in the temp directory."""
+    cache_dir = pathlib.Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser()
+    cache_dir = cache_dir / "turtleshell"
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return True
+    digest = hashlib.sha256(GRAMMAR_FILE.read_bytes() + lark.__version__.encode()).hexdigest()
+    return str(cache_dir / f"{name}-{digest[:16]}.lark")
+
+
+def build_parser(cache_name: str = "parser", **options) -> Lark:
+    return Lark.open(GRAMMAR_FILE, parser="lalr", cache=get_cache_file(cache_name), **options)
+
+
+parser = build_parser(transformer=MyTransformer())
+
+
+@functools.cache
+def get_parser_without_transformer() -> Lark:
+    """The untransformed parser is only needed for testing/debugging, so only build it on
+    demand."""
+    return build_parser()
+
+
+class PositionTransformer(MyTransformer):
+    """Like MyTransformer, but also records which line each token starts on."""
+
+
+def _recording_line(callback: Callable) -> Callable:
+    @v_args(meta=True)
+    def with_line(self, meta, children):
+        result = callback(self, *children)
+        # Statements like `statement` just pass on their child, which already has its line
+        if isinstance(result, Token) and result.line is None and not meta.empty:
+            result.line = meta.line
+        return result
+
+    return with_line
+
+
+for _name, _callback in vars(MyTransformer).items():
+    if not _name.startswith("_"):
+        setattr(PositionTransformer, _name, _recording_line(_callback))
+
+
+@functools.cache
+def get_parser_with_positions() -> Lark:
+    return build_parser("parser-positions", propagate_positions=True)
+
+
+def parse_with_positions(text: str) -> tuple[Token, ...]:
+    """Parses some statements, keeping their line numbers (e.g. for profiling). It's slower than
+    `parser.parse`, so it's only used when they're needed."""
+    tree = get_parser_with_positions().parse(text)
+    return tuple(PositionTransformer().transform(tree).children)
+
+
+class ParseCache:
+    """An LRU cache of parsed statements, keyed by their source text.
+
+    The same tokens are returned every time a command is repeated, so tokens must never store
+    anything about a particular run of the command."""
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.entries: OrderedDict[str, tuple[Token, ...]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # The prompt's substitutions are parsed on other threads
+        self.lock = threading.Lock()
+
+    def parse(self, text: str) -> tuple[Token, ...]:
+        key = text.strip()
+        with self.lock:
+            if (statements := self.entries.get(key)) is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return statements
+            self.misses += 1
+
+        statements = tuple(parser.parse(key).children)
+        if self.size > 0:
+            with self.lock:
+                self.entries[key] = statements
+                self._evict()
+        return statements
+
+    def resize(self, size: int):
+        with self.lock:
+            self.size = size
+            self._evict()
+
+    def _evict(self):
+        while len(self.entries) > max(self.size, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "size": self.size,
+        }
+
+
+parse_cache = ParseCache()
 
 
-parser_options = {"parser": "lalr", "transformer": MyTransformer()}
-parser = Lark.open("spec.lark", rel_to=__file__, **parser_options)
-del parser_options["transformer"]
-parser_without_transformer = Lark.open("spec.lark", rel_to=__file__, **parser_options)
+def __getattr__(name: str):
+    if name == "parser_without_transformer":
+        return get_parser_without_transformer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
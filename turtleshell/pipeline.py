@@ -0,0 +1,423 @@
+"""Runs several commands at once, with the output of each one connected to the input of the next.
+
+Each pair of neighbouring stages is connected with an OS pipe, and every stage is started before we
+wait on any of them. External commands read and write the pipes directly, so data never passes
+through Python. Builtins run on their own thread, writing to the pipe through `streams`.
+
+Redirections (like `> out.txt` or `2>&1`) are applied to each stage's file descriptors just before
+it starts, so a redirected command writes straight to the file too.
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from contextlib import ExitStack
+import io
+import os
+import select
+import threading
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Sequence
+
+from turtleshell import streams
+from turtleshell.datatypes import CommandResult
+from turtleshell.errors import OutputTooLarge, RedirectError, ShellError
+from turtleshell.launcher import Process, launcher
+
+if TYPE_CHECKING:
+    from turtleshell.builtins import Command as BuiltinCommand
+    from turtleshell.variables import EnvironmentVarHolder
+
+CHUNK_SIZE = 64 * 1024
+
+# The most output a command substitution (`$(...)`) can produce. It all has to be kept in memory
+#   (and decoded, to be used as text).
+SUBSTITUTION_LIMIT = 16 * 1024 * 1024
+
+# How to open the file named by each kind of redirection (`2>` and `2>>` are the same as `>`/`>>`)
+OPEN_FLAGS = {
+    "<": os.O_RDONLY,
+    ">": os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    ">>": os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+
+class Redirect:
+    """One of a command's redirections, e.g. `> out.txt`, `2>> errors.log`, `2>&1` or
+    `<<< "some input"`. The target is a file name, or for a here-string, the input itself."""
+
+    def __init__(self, operator: str, target: Any = None):
+        self.operator = operator
+        self.target = target
+
+    @property
+    def fd(self) -> int:
+        """The stream being redirected: 0 for stdin, 1 for stdout and 2 for stderr."""
+        if self.operator.startswith("2"):
+            return 2
+        return 0 if self.operator.startswith("<") else 1
+
+    def open(self, fds: dict[int, int | None]) -> int:
+        """Returns a new file descriptor for the stream to use. `fds` are the stage's current
+        stdin, stdout and stderr (None meaning the terminal)."""
+        if self.operator == "2>&1":
+            if fds[1] is not None:
+                return os.dup(fds[1])
+            # Anything we've already printed has to go before the command's errors
+            streams.flush()
+            return os.dup(1)
+        if self.operator == "<<<":
+            return feed(f"{self.target}\n".encode("utf-8"))
+        path = os.path.expanduser(str(self.target))
+        try:
+            return os.open(path, OPEN_FLAGS[self.operator.lstrip("2")], 0o666)
+        except OSError as e:
+            raise RedirectError(f"{self.target}: {e.strerror}") from e
+
+    def __str__(self) -> str:
+        if self.target is None:
+            return self.operator
+        return f"{self.operator} {self.target}"
+
+
+def feed(data: bytes) -> int:
+    """Returns a file descriptor which `data` can be read from, e.g. for a here-string."""
+    r, w = os.pipe()
+    if len(data) <= select.PIPE_BUF:
+        # It fits in the pipe, so writing it won't block
+        os.write(w, data)
+        os.close(w)
+        return r
+
+    def write():
+        try:
+            with os.fdopen(w, "wb") as f:
+                f.write(data)
+        except BrokenPipeError:
+            pass  # The command didn't read all of it
+
+    threading.Thread(target=write, daemon=True).start()
+    return r
+
+
+def close_all(fds: Iterable[int | None]):
+    for fd in fds:
+        if fd is not None:
+            os.close(fd)
+
+
+def apply_redirects(
+    redirects: Sequence[Redirect], stdin: int | None, stdout: int | None
+) -> tuple[int | None, int | None, int | None]:
+    """Returns the stdin, stdout and stderr a stage should use, given the ones the pipeline gave it.
+
+    Redirections are applied left to right, as in `sh`: `> out.txt 2>&1` sends both streams to the
+    file, but `2>&1 > out.txt` only sends stdout there. File descriptors which get replaced are
+    closed (and if anything goes wrong, all of them are)."""
+    fds: dict[int, int | None] = {0: stdin, 1: stdout, 2: None}
+    try:
+        for redirect in redirects:
+            fd = redirect.open(fds)
+            if (replaced := fds[redirect.fd]) is not None:
+                os.close(replaced)
+            fds[redirect.fd] = fd
+    except BaseException:
+        close_all(fds.values())
+        raise
+    return fds[0], fds[1], fds[2]
+
+
+class Stage(ABC):
+    redirects: Sequence[Redirect] = ()
+
+    @abstractmethod
+    def start(self, stdin: int | None, stdout: int | None):
+        """Start running this stage. `stdin` and `stdout` are file descriptors (or None to use the
+        terminal), which the stage becomes responsible for closing."""
+
+    @abstractmethod
+    def wait(self) -> int:
+        """Wait for this stage to finish, and return its exit code."""
+
+
+class ExternalStage(Stage):
+    def __init__(
+        self, argv: list[str], new_session: bool = False, redirects: Sequence[Redirect] = ()
+    ):
+        self.argv = argv
+        # Background jobs get their own session, so Ctrl-C in the terminal doesn't reach them
+        self.new_session = new_session
+        self.redirects = redirects
+        self.process: Process | None = None
+
+    def start(self, stdin: int | None, stdout: int | None):
+        # Make sure anything we've printed so far shows up before the command's output
+        streams.flush()
+        fds = apply_redirects(self.redirects, stdin, stdout)
+        try:
+            self.process = launcher.spawn(self.argv, *fds, new_session=self.new_session)
+        finally:
+            # The child has its own copies now
+            close_all(fds)
+
+    def wait(self) -> int:
+        return self.process.wait()
+
+
+class BuiltinStage(Stage):
+    def __init__(
+        self,
+        command: BuiltinCommand,
+        args: list[Any],
+        env: EnvironmentVarHolder,
+        redirects: Sequence[Redirect] = (),
+    ):
+        self.command = command
+        self.args = args
+        self.env = env
+        self.redirects = redirects
+        self.code = 0
+        self.error: BaseException | None = None
+        self.thread: threading.Thread | None = None
+
+    def start(self, stdin: int | None, stdout: int | None):
+        # Redirections are opened here, rather than on the thread, so errors are raised straight away
+        fds = apply_redirects(self.redirects, stdin, stdout)
+        self.thread = threading.Thread(target=self.run, args=fds, daemon=True)
+        self.thread.start()
+
+    def run(self, stdin: int | None, stdout: int | None, stderr: int | None = None):
+        # Builtins which don't read their input still hold on to it until they're done, so the
+        #   previous stage isn't cut off early
+        infile = os.fdopen(stdin, "rb") if stdin is not None else None
+        outfile = os.fdopen(stdout, "wb") if stdout is not None else None
+        errfile = os.fdopen(stderr, "wb") if stderr is not None else None
+        try:
+            with ExitStack() as stack:
+                if infile is not None:
+                    stack.enter_context(streams.redirect_stdin(infile))
+                if outfile is not None:
+                    stack.enter_context(streams.redirect_stdout(outfile))
+                if errfile is not None:
+                    stack.enter_context(streams.redirect_stderr(errfile))
+                self.code = self.execute()
+        except BrokenPipeError:
+            # The next stage stopped reading; that's fine, as in `sh`
+            pass
+        except (Exception, ShellError) as e:
+            self.error = e
+            self.code = 1
+        finally:
+            for f in (infile, outfile, errfile):
+                if f is not None:
+                    try:
+                        f.close()
+                    except BrokenPipeError:
+                        pass
+
+    def execute(self) -> int:
+        result = self.command.run(*self.args, env=self.env)
+        if not isinstance(result, CommandResult):
+            return 0
+        streams.write_result(result)
+        return result.code
+
+    def wait(self) -> int:
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.code
+
+
+class PipelineRun:
+    """A single execution of a list of stages."""
+
+    def __init__(self, stages: list[Stage], stdin: int | None = None, stdout: int | None = None):
+        self.stages = stages
+        # File descriptors for the first stage to read from and the last stage to write to. If
+        #   they aren't given, the terminal (or wherever `streams` is redirected to) is used.
+        self.stdin = stdin
+        self.stdout = stdout
+        self._forwarder: threading.Thread | None = None
+
+    def get_stdin(self) -> int | None:
+        """Returns the file descriptor the first stage should read from."""
+        if self.stdin is not None or (stream := streams.get_stdin()) is None:
+            return self.stdin
+
+        # Input has been redirected (e.g. to /dev/null, for the prompt), so read from there instead
+        #   of the terminal
+        try:
+            return os.dup(stream.fileno())
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
+    def get_stdout(self) -> int | None:
+        """Returns the file descriptor the last stage should write to."""
+        if self.stdout is not None or (stream := streams.get_stdout()) is None:
+            return self.stdout
+
+        # Output has been redirected, so the last stage has to write there instead of the terminal
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        else:
+            stream.flush()
+            return os.dup(fd)
+
+        # The stream isn't backed by a file (e.g. it's in memory), so copy the output across
+        r, w = os.pipe()
+
+        def forward():
+            with os.fdopen(r, "rb") as f:
+                try:
+                    while chunk := f.read1(CHUNK_SIZE):
+                        stream.write(chunk)
+                except OutputTooLarge:
+                    # Closing the pipe stops the writer; whoever owns the stream reports the error
+                    pass
+
+        self._forwarder = threading.Thread(target=forward, daemon=True)
+        self._forwarder.start()
+        return w
+
+    def start(self) -> PipelineRun:
+        # Create all the pipes up-front, so that if we run out of file descriptors we haven't
+        #   started any processes yet
+        pipes: list[tuple[int, int]] = []
+        try:
+            for _ in range(len(self.stages) - 1):
+                pipes.append(os.pipe())
+        except OSError:
+            for r, w in pipes:
+                os.close(r)
+                os.close(w)
+            raise
+
+        stdins = [self.get_stdin()] + [r for r, _ in pipes]
+        stdouts = [w for _, w in pipes] + [self.get_stdout()]
+        for i, (stage, stdin, stdout) in enumerate(zip(self.stages, stdins, stdouts)):
+            try:
+                stage.start(stdin, stdout)
+            except BaseException:
+                # Close the pipes belonging to the stages which will never run
+                close_all(stdins[i + 1 :] + stdouts[i + 1 :])
+                raise
+        return self
+
+    def wait(self) -> CommandResult:
+        """Wait for every stage to finish. The exit code is that of the last stage."""
+        codes = []
+        error = None
+        for stage in self.stages:
+            try:
+                codes.append(stage.wait())
+            except (Exception, ShellError) as e:
+                codes.append(1)
+                error = error or e
+        if self._forwarder is not None:
+            self._forwarder.join()
+        if error is not None:
+            raise error
+        return CommandResult(codes[-1], None, None)
+
+
+def run_external(argv: list[str]) -> CommandResult:
+    return PipelineRun([ExternalStage(argv)]).start().wait()
+
+
+class LimitedBuffer:
+    """A stream which keeps what's written to it in memory, but won't hold more than `limit` bytes.
+    Writing past the limit raises OutputTooLarge (and keeps raising it, so `overflowed` can be
+    checked afterwards).
+
+    It's a lot cheaper to create than a BytesIO, which matters when there's one for every `$(...)`.
+    """
+
+    __slots__ = ("data", "limit", "overflowed")
+
+    def __init__(self, limit: int = SUBSTITUTION_LIMIT):
+        self.data = bytearray()
+        self.limit = limit
+        self.overflowed = False
+
+    def write(self, data: bytes | memoryview) -> int:
+        if self.overflowed or len(self.data) + len(data) > self.limit:
+            self.overflowed = True
+            raise self.error()
+        self.data += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def error(self) -> OutputTooLarge:
+        return OutputTooLarge(f"output is bigger than {self.limit:,} bytes")
+
+
+def terminate(stages: Iterable[Stage]):
+    """Stop any external commands which are still running."""
+    for stage in stages:
+        if isinstance(stage, ExternalStage) and stage.process.poll() is None:
+            stage.process.terminate()
+
+
+def read_output(stages: list[Stage], limit: int = SUBSTITUTION_LIMIT) -> CommandResult:
+    """Run a pipeline and return what it writes, for a command substitution.
+
+    The output is read as it's written. If there's more than `limit` bytes of it, the pipeline is
+    cut off and OutputTooLarge is raised, rather than waiting for it to finish."""
+    r, w = os.pipe()
+    try:
+        run = PipelineRun(stages, stdout=w).start()
+    except BaseException:
+        os.close(r)
+        raise
+    buffer = bytearray()
+    with os.fdopen(r, "rb") as f:
+        while chunk := f.read1(CHUNK_SIZE):
+            if len(buffer) + len(chunk) > limit:
+                break
+            buffer += chunk
+        else:
+            return CommandResult(run.wait().code, memoryview(buffer), None)
+    # Anything still writing gets SIGPIPE now the pipe is closed; anything else needs to be told
+    terminate(stages)
+    try:
+        run.wait()
+    except (Exception, ShellError):
+        pass
+    raise OutputTooLarge(f"output is bigger than {limit:,} bytes")
+
+
+class OutputLines:
+    """Iterates over the lines written by a pipeline, as they're written, e.g. for a foreach loop.
+
+    Use it as a context manager. If we stop reading early, the pipeline is cut off (as though its
+    output had been closed) rather than being left to run to completion."""
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self.result: CommandResult | None = None
+        self.exhausted = False
+
+    def __enter__(self) -> OutputLines:
+        r, w = os.pipe()
+        try:
+            self.run = PipelineRun(self.stages, stdout=w).start()
+        except BaseException:
+            os.close(r)
+            raise
+        self.file = os.fdopen(r, "rb")
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.file:
+            yield line.rstrip(b"\n").decode("utf-8", errors="replace")
+        self.exhausted = True
+
+    def __exit__(self, *_):
+        self.file.close()
+        if not self.exhausted:
+            # Anything still writing will get SIGPIPE; anything else needs to be told to stop
+            terminate(self.stages)
+        self.result = self.run.wait()
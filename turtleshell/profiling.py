@@ -0,0 +1,189 @@
+"""Find out where the time goes in a turtle script.
+
+While a `Profiler` is running, statements are compiled with a wrapper around them which records how
+long each one takes: wall time, CPU time (of the shell itself) and the CPU time of any programs it
+ran. The results are grouped by statement and by source line, and can be written out as a sorted
+report, or as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev to see a
+flame graph).
+
+Turn it on with `turtle --profile`, or by setting `PROFILE = true`. When no profiler is running,
+statements are compiled as normal, so profiling costs nothing at all.
+
+Time spent by programs started by the fork server isn't counted as child-process time, since they
+aren't our children.
+"""
+
+from __future__ import annotations
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Callable
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The profiler that's currently running, if any
+profiler: Profiler | None = None
+
+# Stop adding to the trace after this many events, so long loops don't use up all the memory (the
+#   totals are still kept up to date)
+MAX_TRACE_EVENTS = 1_000_000
+
+# Statements longer than this are cut short in the report
+MAX_LABEL_LENGTH = 60
+
+
+def describe(token: Any) -> str:
+    """Returns a short description of a statement, for the report."""
+    name = type(token).__name__
+    if type(token).__str__ is object.__str__:
+        return name
+    label = str(token)
+    if len(label) > MAX_LABEL_LENGTH:
+        label = label[: MAX_LABEL_LENGTH - 3] + "..."
+    return f"{name}: {label}"
+
+
+def child_time() -> float:
+    """The CPU time used by our child processes which have finished (and been waited for)."""
+    if resource is None:
+        times = os.times()
+        return times.children_user + times.children_system
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stats:
+    """The totals for a statement, or a source line."""
+
+    __slots__ = ("calls", "wall", "cpu", "children")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.children = 0.0
+
+    def add(self, wall: float, cpu: float, children: float):
+        self.calls += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.children += children
+
+
+class Profiler:
+    def __init__(self):
+        self.statements: dict[tuple[str, int | None], Stats] = {}
+        self.lines: dict[int, Stats] = {}
+        self.events: list[dict[str, Any]] = []
+        self.dropped_events = 0
+        # Tokens compiled while profiling, with the wrapper around them. They're kept separately
+        #   from the tokens' own compiled versions, which know nothing about profiling.
+        self.functions: dict[Any, Callable] = {}
+        self.started = time.perf_counter()
+        # The lines each thread is currently running, so nested statements on the same line
+        #   aren't counted twice
+        self.local = threading.local()
+
+    def compiled(self, token: Any) -> Callable:
+        """Returns the profiled version of a token's compiled function."""
+        if (func := self.functions.get(token)) is None:
+            func = token.compile()
+            if token.profiled:
+                func = self.wrap(token, func)
+            self.functions[token] = func
+        return func
+
+    def wrap(self, token: Any, func: Callable) -> Callable:
+        label, line = describe(token), token.line
+        stats = self.statements.setdefault((label, line), Stats())
+        line_stats = self.lines.setdefault(line, Stats()) if line is not None else None
+        events, pid, started, local = self.events, os.getpid(), self.started, self.local
+
+        def profiled(env):
+            active = local.__dict__.setdefault("lines", set())
+            outermost = line not in active
+            if outermost:
+                active.add(line)
+            wall, cpu, children = time.perf_counter(), time.process_time(), child_time()
+            try:
+                return func(env)
+            finally:
+                elapsed = time.perf_counter() - wall
+                cpu = time.process_time() - cpu
+                children = child_time() - children
+                stats.add(elapsed, cpu, children)
+                if outermost:
+                    active.discard(line)
+                    if line_stats is not None:
+                        line_stats.add(elapsed, cpu, children)
+                if len(events) < MAX_TRACE_EVENTS:
+                    events.append(
+                        {
+                            "name": label,
+                            "ph": "X",
+                            "ts": (wall - started) * 1e6,
+                            "dur": elapsed * 1e6,
+                            "pid": pid,
+                            "tid": threading.get_ident(),
+                            "args": {"line": line},
+                        }
+                    )
+                else:
+                    self.dropped_events += 1
+
+        return profiled
+
+    def report(self, limit: int = 20) -> str:
+        """Returns the slowest statements and lines, as a table. Times include everything run
+        inside each statement."""
+        lines = [
+            f"{'calls':>9} {'wall ms':>10} {'cpu ms':>10} {'child ms':>10} {'line':>5}  statement"
+        ]
+        statements = sorted(self.statements.items(), key=lambda item: -item[1].wall)
+        for (label, line), stats in statements[:limit]:
+            lines.append(self._row(stats, line, label))
+        if self.lines:
+            lines.append("")
+            lines.append(
+                f"{'calls':>9} {'wall ms':>10} {'cpu ms':>10} {'child ms':>10} {'line':>5}"
+            )
+            by_line = sorted(self.lines.items(), key=lambda item: -item[1].wall)
+            for line, stats in by_line[:limit]:
+                lines.append(self._row(stats, line))
+        if self.dropped_events:
+            lines.append(f"({self.dropped_events:,} events were left out of the trace)")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _row(stats: Stats, line: int | None, label: str = "") -> str:
+        return (
+            f"{stats.calls:>9} {stats.wall * 1000:>10.3f} {stats.cpu * 1000:>10.3f}"
+            f" {stats.children * 1000:>10.3f} {line if line is not None else '-':>5}  {label}"
+        ).rstrip()
+
+    def trace(self) -> dict[str, Any]:
+        """Returns the trace, in Chrome's trace event format."""
+        return {"traceEvents": self.events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: pathlib.Path):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+
+
+def start() -> Profiler:
+    """Start profiling every statement that runs, until `stop` is called."""
+    global profiler
+    profiler = Profiler()
+    return profiler
+
+
+def stop() -> Profiler | None:
+    """Stop profiling, and return the profiler that was running."""
+    global profiler
+    stopped, profiler = profiler, None
+    return stopped
@@ -0,0 +1,140 @@
+"""Rendering of prompt strings like PROMPT1.
+
+A prompt is split up ahead of time into segments: literal text, variables like `$CWD`, and command
+substitutions like `$(git branch --show-current)`. Variables are cheap, so they're filled in every
+time the prompt is drawn. Substitutions might be slow, so they run in the background. Until one
+finishes, the prompt shows its value from last time, and `on_update` is called (to redraw the prompt)
+when a new value turns up.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Mapping
+
+from turtleshell import streams
+from turtleshell.errors import ShellError
+
+if TYPE_CHECKING:
+    from turtleshell.variables import EnvironmentVarHolder
+
+VARIABLE_PATTERN = re.compile(r"\$(\w+)")
+
+# How long a substitution has to finish before we stop redrawing the prompt for it. It still runs to
+#   completion, and its value gets used the next time the prompt is drawn.
+SEGMENT_TIMEOUT = 2.0
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prompt")
+    return _executor
+
+
+def capture(source: str, env: EnvironmentVarHolder) -> str:
+    """Run some statements and return what they wrote out, exactly as `$(...)` would. They can't
+    read from the terminal, since the prompt is using it."""
+    from turtleshell import parsing
+
+    statements = parsing.parse_cache.parse(source)
+    statement = statements[0] if len(statements) == 1 else parsing.StatementBlock(*statements)
+    with open(os.devnull, "rb") as devnull, streams.redirect_stdin(devnull):
+        return parsing.Substitution(statement).eval(env)
+
+
+class Text:
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, env: Mapping[str, Any]) -> str:
+        return self.text
+
+
+class Variable:
+    def __init__(self, name: str):
+        self.name = name
+
+    def render(self, env: Mapping[str, Any]) -> str:
+        return str(env.get(self.name, ""))
+
+
+class Substitution:
+    def __init__(self, source: str, timeout: float = SEGMENT_TIMEOUT):
+        self.source = source
+        self.timeout = timeout
+        self.value = ""  # The last value we got, shown until there's a newer one
+        self.future: Future | None = None
+
+    def refresh(self, env: EnvironmentVarHolder, on_update: Callable[[], Any] | None) -> Future:
+        """Start working out a new value, unless we're still working on the last one."""
+        if self.future is None or self.future.done():
+            started = time.monotonic()
+            self.future = get_executor().submit(self._evaluate, env.fork(), on_update, started)
+        return self.future
+
+    def _evaluate(self, env: EnvironmentVarHolder, on_update: Callable | None, started: float):
+        try:
+            value = capture(self.source, env)
+        except (Exception, ShellError):
+            return  # Keep showing the last value
+        changed, self.value = value != self.value, value
+        if changed and on_update is not None and time.monotonic() - started < self.timeout:
+            on_update()
+
+    def render(self, env: Mapping[str, Any]) -> str:
+        return self.value
+
+
+def split_segments(template: str) -> list[Text | Variable | Substitution]:
+    segments, text, i = [], [], 0
+    while i < len(template):
+        if template.startswith("$(", i):
+            # Find the matching bracket, allowing for nested substitutions
+            depth, j = 1, i + 2
+            while j < len(template) and depth:
+                depth += {"(": 1, ")": -1}.get(template[j], 0)
+                j += 1
+            if not depth:
+                segments += [Text("".join(text)), Substitution(template[i + 2 : j - 1])]
+                text, i = [], j
+                continue
+        elif match := VARIABLE_PATTERN.match(template, i):
+            segments += [Text("".join(text)), Variable(match[1])]
+            text, i = [], match.end()
+            continue
+        text.append(template[i])
+        i += 1
+    segments.append(Text("".join(text)))
+    return [s for s in segments if not isinstance(s, Text) or s.text]
+
+
+class PromptTemplate:
+    """A prompt string, split up ahead of time into segments to fill in."""
+
+    def __init__(self, template: str):
+        self.template = template
+        self.segments = split_segments(template)
+        self.substitutions = [s for s in self.segments if isinstance(s, Substitution)]
+
+    def refresh(
+        self, env: EnvironmentVarHolder, on_update: Callable[[], Any] | None = None
+    ) -> list[Future]:
+        """Start updating any substitutions in the background, returning their futures."""
+        return [s.refresh(env, on_update) for s in self.substitutions]
+
+    def render(self, env: Mapping[str, Any]) -> str:
+        return "".join(segment.render(env) for segment in self.segments)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_prompt(template: str) -> PromptTemplate:
+    return PromptTemplate(template)
@@ -0,0 +1,87 @@
+"""Providers for read-only shell variables, each with its own caching policy.
+
+Some shell variables (like CWD and DATE) are worked out when they're read. Rather than doing that
+every time they're used, each one decides how long its value stays valid:
+
+- Constant: never changes
+- Uncached: worked out every time
+- TTL: cached for a number of seconds
+- OnEvent: cached until an event happens, e.g. CWD is cached until the "chdir" event
+- PerPrompt: cached until the next prompt is drawn
+"""
+
+from abc import ABC, abstractmethod
+import time
+from typing import Any, Callable
+
+# How many times each event has happened. Cached values remember the count when they were computed,
+#   so invalidating an event is just an increment.
+_event_counts: dict[str, int] = {}
+
+_NOT_SET = object()
+
+
+def invalidate(event: str):
+    """Signal that an event has happened, invalidating any values which depend on it."""
+    _event_counts[event] = _event_counts.get(event, 0) + 1
+
+
+def new_prompt():
+    invalidate("prompt")
+
+
+class Provider(ABC):
+    @abstractmethod
+    def get(self) -> Any:
+        pass
+
+
+class Constant(Provider):
+    def __init__(self, value: Any):
+        self.value = value
+
+    def get(self) -> Any:
+        return self.value
+
+
+class Uncached(Provider):
+    def __init__(self, func: Callable[[], Any]):
+        self.func = func
+
+    def get(self) -> Any:
+        return self.func()
+
+
+class TTL(Provider):
+    def __init__(self, func: Callable[[], Any], seconds: float):
+        self.func = func
+        self.seconds = seconds
+        self.value = _NOT_SET
+        self.expires = 0.0
+
+    def get(self) -> Any:
+        now = time.monotonic()
+        if self.value is _NOT_SET or now >= self.expires:
+            self.value = self.func()
+            self.expires = now + self.seconds
+        return self.value
+
+
+class OnEvent(Provider):
+    def __init__(self, func: Callable[[], Any], event: str):
+        self.func = func
+        self.event = event
+        self.value = _NOT_SET
+        self.count = -1
+
+    def get(self) -> Any:
+        count = _event_counts.get(self.event, 0)
+        if self.value is _NOT_SET or count != self.count:
+            self.value = self.func()
+            self.count = count
+        return self.value
+
+
+class PerPrompt(OnEvent):
+    def __init__(self, func: Callable[[], Any]):
+        super().__init__(func, "prompt")
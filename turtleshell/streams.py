@@ -0,0 +1,183 @@
+"""Keep track of where the output of the currently-running command should go.
+
+Builtins should write their output with `write` (and errors with `write_error`), rather than calling
+`print` directly. Normally this ends up on the terminal, but when a builtin is part of a pipeline,
+its output gets sent to the next command instead (see `redirect_stdout`). Likewise, builtins which
+read input get it from `get_stdin`.
+
+Output to the terminal is buffered, and written out in large chunks. It's flushed:
+- when the buffer gets bigger than BUFFER_SIZE,
+- at the end of every line, if the output is a TTY (so interactive output shows up straight away),
+- before prompting, and before starting an external command (so output stays in order).
+"""
+
+import atexit
+from collections import deque
+from contextvars import ContextVar
+import sys
+import threading
+from typing import Any, BinaryIO, Callable, TextIO
+
+from turtleshell.datatypes import CommandResult
+
+BUFFER_SIZE = 64 * 1024
+
+_stdin: ContextVar[BinaryIO | None] = ContextVar("stdin", default=None)
+_stdout: ContextVar[BinaryIO | None] = ContextVar("stdout", default=None)
+_stderr: ContextVar[BinaryIO | None] = ContextVar("stderr", default=None)
+
+
+class Sink:
+    """A buffered writer for one of the process's standard streams.
+
+    The stream is looked up whenever it's needed (rather than kept), in case something swaps out
+    `sys.stdout`."""
+
+    def __init__(
+        self,
+        get_stream: Callable[[], TextIO],
+        size: int = BUFFER_SIZE,
+        before_flush: Callable[[], None] | None = None,
+    ):
+        self.get_stream = get_stream
+        self.size = size
+        self.before_flush = before_flush
+        # Writing doesn't take a lock (that would double the cost of a small write): deques can be
+        #   appended to and popped from by different threads safely. The size is only a hint.
+        self.chunks: deque[bytes] = deque()
+        self.pending = 0
+        self.lock = threading.Lock()
+        # Whether to flush at the end of every line. This is checked again whenever we flush, in
+        #   case the stream has changed.
+        self.line_buffered = self.is_tty(self.get_stream())
+
+    @staticmethod
+    def is_tty(stream: TextIO) -> bool:
+        try:
+            return stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def write(self, data: str | bytes | memoryview):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+        self.chunks.append(data)
+        self.pending += len(data)
+        if self.pending >= self.size or (self.line_buffered and b"\n" in data):
+            self.flush()
+
+    def flush(self):
+        if self.before_flush is not None:
+            self.before_flush()
+        with self.lock:
+            stream = self.get_stream()
+            self.line_buffered = self.is_tty(stream)
+            if n := len(self.chunks):
+                data = b"".join([self.chunks.popleft() for _ in range(n)])
+                self.pending = 0
+                # Anything written to the stream by other means (like `print`) has to go first
+                stream.flush()
+                if (binary := getattr(stream, "buffer", None)) is not None:
+                    binary.write(data)
+                else:
+                    stream.write(data.decode("utf-8", errors="replace"))
+            stream.flush()
+
+
+stdout = Sink(lambda: sys.stdout)
+# Errors go after any output written before them
+stderr = Sink(lambda: sys.stderr, before_flush=stdout.flush)
+
+
+def flush():
+    """Write out anything that's been buffered."""
+    stdout.flush()
+    stderr.flush()
+
+
+atexit.register(flush)
+
+
+def get_stdin() -> BinaryIO | None:
+    """Returns the stream a builtin should read its input from (e.g. the previous stage of a
+    pipeline), or None if it's the terminal."""
+    return _stdin.get()
+
+
+def get_stdout() -> BinaryIO | None:
+    """Returns the stream output is currently being sent to, or None if it's the terminal."""
+    return _stdout.get()
+
+
+def get_stderr() -> BinaryIO | None:
+    """Returns the stream errors are currently being sent to, or None if it's the terminal."""
+    return _stderr.get()
+
+
+class _redirect:
+    """Sets a stream for as long as the context lasts. (This is a class, rather than a
+    `contextmanager` function, because it's entered for every command substitution.)"""
+
+    __slots__ = ("var", "stream", "token")
+
+    def __init__(self, var: ContextVar[BinaryIO | None], stream: BinaryIO):
+        self.var = var
+        self.stream = stream
+
+    def __enter__(self) -> BinaryIO:
+        self.token = self.var.set(self.stream)
+        return self.stream
+
+    def __exit__(self, *_):
+        self.var.reset(self.token)
+
+
+def redirect_stdin(stream: BinaryIO):
+    """Have builtins read their input from `stream` until the context exits."""
+    return _redirect(_stdin, stream)
+
+
+def redirect_stdout(stream: BinaryIO):
+    """Send anything written with `write` to `stream` (e.g. a pipe, file or BytesIO) until the
+    context exits."""
+    return _redirect(_stdout, stream)
+
+
+def redirect_stderr(stream: BinaryIO):
+    """Send anything written with `write_error` to `stream` until the context exits."""
+    return _redirect(_stderr, stream)
+
+
+def write(data: str | bytes | memoryview):
+    if (stream := _stdout.get()) is None:
+        stdout.write(data)
+        return
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    stream.write(data)
+
+
+def write_error(data: str | bytes | memoryview):
+    if (stream := _stderr.get()) is None:
+        stderr.write(data)
+        return
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    stream.write(data)
+
+
+def write_result(result: Any):
+    """Write out what a statement returned, e.g. the output of a builtin like `cwd`, followed by a
+    line break. A CommandResult's errors (like `cd`'s "No such file or directory") are written
+    to stderr."""
+    if isinstance(result, CommandResult):
+        # Write output out as it is, rather than decoding it just to encode it again
+        result.write_to(write)
+        if err := result.stderr:
+            write_error(err)
+            if err[-1:] not in ("\n", b"\n"):
+                write_error("\n")
+    elif result is not None and (text := str(result)):
+        write(text + "\n")
@@ -1,34 +1,15 @@
 import os
-import inspect
 from pathlib import Path
-import platform
 
-import turtleshell.builtins
-
-_BUILTINS = {}
+from turtleshell.datatypes import PathList
 
 
 def is_executable(fname: Path):
     return os.access(fname, os.X_OK)
 
 
-def get_os_path():
+def get_os_path() -> PathList:
     """Returns all the directories currently set as the OS path. Note that this function looks as
     the env var as set by the parent process running the shell. It doesn't asjust to changes made to
     turtle's PATH variable."""
-    pathstr = os.environ["PATH"]
-    plat = platform.system()
-    if plat == "Windows":
-        pathlist = pathstr.split(";")
-    elif plat in ("Darwin", "Linux"):
-        pathlist = pathstr.split(":")
-    return pathlist
-
-
-def get_builtin(name: str) -> turtleshell.builtins.Command | None:
-    # Lazily build BUILTINS map
-    if not _BUILTINS:
-        for _, member in inspect.getmembers(turtleshell.builtins):
-            if inspect.isclass(member) and issubclass(member, turtleshell.builtins.Command):
-                _BUILTINS[member.name] = member
-    return _BUILTINS.get(name)  # Return None if no builtin has this name
+    return PathList.of(os.environ.get("PATH", ""))
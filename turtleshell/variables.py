@@ -1,29 +1,37 @@
 """This handles how environment variables are.. well... handled."""
 
+from __future__ import annotations
 from collections.abc import MutableMapping
 from datetime import datetime
 import getpass
 import os
 import pathlib
 import tempfile
-from typing import Any
+import threading
+from typing import Any, Callable, Iterable
 
 from turtleshell.builtins import cwd
-from turtleshell.datatypes import DateTime, Path
+from turtleshell.datatypes import DateTime, List, Path, PathList
 from turtleshell.errors import InvalidAssignment, CommandNotFound
+from turtleshell.executables import ExecutableCache
+from turtleshell.jobs import scheduler
+from turtleshell.providers import TTL, Constant, OnEvent, PerPrompt, Provider, Uncached
 import turtleshell.util
 
 CROSS_PLATFORM_MAPPINGS = {"nt": {"PROMPT": "B_PS1"}, "posix": {"PS1": "B_PS1"}}
 
-# Mapping of read-only shell variables, and how to determine their values
-SHELL_VARS = {
-    "CWD": lambda: Path(cwd()),
-    "DATE": lambda: DateTime(datetime.now()),
-    "HOME": Path(pathlib.Path.home()),
-    "HOST": os.uname().nodename,
-    "OS": os.uname().sysname,
-    "TMP": Path(tempfile.gettempdir()),
-    "USER": getpass.getuser(),
+# Mapping of read-only shell variables, and how to determine (and cache) their values
+SHELL_VARS: dict[str, Provider] = {
+    "CWD": OnEvent(lambda: Path(cwd()), "chdir"),  # Invalidated by `cd`
+    "DATE": TTL(lambda: DateTime(datetime.now()), 1.0),
+    "HOME": Constant(Path(pathlib.Path.home())),
+    "HOST": Constant(os.uname().nodename),
+    "JOBS": Uncached(lambda: scheduler.running()),  # Number of background jobs still running
+    "OS": Constant(os.uname().sysname),
+    # When the prompt was drawn, so every part of the prompt shows the same time
+    "PROMPTDATE": PerPrompt(lambda: DateTime(datetime.now())),
+    "TMP": Constant(Path(tempfile.gettempdir())),
+    "USER": Constant(getpass.getuser()),
 }
 
 # Some vars can be edited, but not deleted. We define the default value of those here.
@@ -34,34 +42,99 @@ DEFAULT_VALUES = {
     "PROMPT2": "> ",  # Prompt for trailing input
     "PROMPT3": "#?",  # Don't remember what this does
     "PROMPT4": "+",  # For debug lines (do we even want this?)
-    "HISTFILE": Path(pathlib.Path("~/.turtle_history")),
+    "HISTFILE": Path(pathlib.Path("~/.turtle_history.sqlite")),
+    "PARSECACHESIZE": 256,  # How many parsed commands to remember
+    "PROFILE": False,  # Whether to time each statement, and report where the time went
+    "PROFILETRACE": "",  # Where to write a Chrome trace of each profiled run, if anywhere
+    "BUILTINFILTERS": True,  # Whether to run grep, sort, etc. in-process when they're piped into
 }
 
 
+# Every variable name gets a slot number the first time it's seen: its index in each environment's
+#   list of values. Compiled code looks up a variable's slot once, when it's compiled (see `getter`
+#   and `setter`), so reading or writing it at runtime is just a list index.
+SLOTS: dict[str, int] = {}
+NAMES: list[str] = []
+_slots_lock = threading.Lock()
+
+# The value of a slot whose variable isn't set (None is a valid value, so it can't be used)
+UNSET = object()
+
+
+def slot(name: str) -> int:
+    """Returns the slot number for a variable name."""
+    if (index := SLOTS.get(name)) is None:
+        with _slots_lock:
+            if (index := SLOTS.get(name)) is None:
+                index = SLOTS[name] = len(NAMES)
+                NAMES.append(name)
+    return index
+
+
 class EnvironmentVarHolder(MutableMapping):
-    def __init__(self):
-        self._data: dict[str, Any] = {}
+    """The shell's variables.
+
+    Values are kept in a list indexed by slot number, with UNSET for variables which aren't set.
+    Lists are only changed in place by the environment which owns them (see `List.owner`), so
+    forking doesn't need to copy them.
+
+    Loop variables are bound in a frame (see `push_frame`): the value from outside the loop is
+    saved, and put back when the loop ends. The current value of every variable is always in the
+    list, so lookups never have to search through the frames."""
+
+    def __init__(self, values: list[Any] | None = None, executables: ExecutableCache | None = None):
+        self.values: list[Any] = values if values is not None else []
+        self.executables = executables if executables is not None else ExecutableCache()
+        # Lists belonging to this environment are marked with this (see `List.owner`)
+        self.owner = object()
+
+    def fork(self) -> EnvironmentVarHolder:
+        """Returns a snapshot of this environment, e.g. for a worker thread. Variables set in the
+        copy don't affect the original (or the other way around)."""
+        # Both environments hold the same lists now. Neither owns them any more, so whichever
+        #   changes one first gets its own copy.
+        self.owner = object()
+        return EnvironmentVarHolder(self.values.copy(), self.executables)
+
+    def load(self, index: int) -> Any:
+        """Returns the value in a slot, or UNSET."""
+        try:
+            return self.values[index]
+        except IndexError:
+            return UNSET
+
+    def store(self, index: int, value: Any):
+        values = self.values
+        if index >= len(values):
+            # Slots are numbered across every environment, so there may be new ones since we last
+            #   grew
+            values.extend([UNSET] * (len(NAMES) - len(values)))
+        values[index] = value
+
+    def push_frame(self, indexes: Iterable[int]) -> list[tuple[int, Any]]:
+        """Start a new scope for some variables (e.g. a loop variable). Returns the frame to pass to
+        `pop_frame` when the scope ends, which puts back the values they had before."""
+        return [(index, self.load(index)) for index in indexes]
+
+    def pop_frame(self, frame: list[tuple[int, Any]]):
+        for index, value in reversed(frame):
+            self.store(index, value)
 
     def get_executable(self, name: str) -> pathlib.Path | None:
-        for path in self["PATH"]:
-            path = Path(path)
-            if not path.value.exists():
-                continue
-            for item in path.value.iterdir():
-                if item.stem == name and turtleshell.util.is_executable(item):
-                    return item
+        if executable := self.executables.lookup(name, self["PATH"]):
+            return executable
         # Else, raise an error because we didn't find an executable with that name
         raise CommandNotFound(name)
 
     def __getitem__(self, key: str):
         # Handle special cases
-        if val := SHELL_VARS.get(key):
-            if callable(val):
-                val = val()
-            return val
+        if provider := SHELL_VARS.get(key):
+            return provider.get()
 
-        # Else, check the internal env var store
-        return self._data.get(key) or DEFAULT_VALUES.get(key, "")
+        # Else, check the internal env var store. Falsy values like 0 are still values.
+        if (index := SLOTS.get(key)) is not None and (value := self.load(index)) is not UNSET:
+            return value
+        return DEFAULT_VALUES.get(key, "")
 
     def __setitem__(self, key: str, value):
         # Make sure this isn't a read-only variable
@@ -70,11 +143,20 @@ class EnvironmentVarHolder(MutableMapping):
                 f"Shell variable '{key}' is read-only and cannot be written to."
             )
 
+        if key == "PATH":
+            value = PathList.of(value)
+        elif type(value) is list:
+            value = List(value)
+
         # Special variables
         if mapped_key := CROSS_PLATFORM_MAPPINGS.get(os.name, {}).get(key):
             self[mapped_key] = value
         else:
-            self._data[key] = value
+            self.store(slot(key), value)
+
+        # Any remembered executable locations may no longer be valid
+        if key == "PATH":
+            self.executables.clear()
 
     def __delitem__(self, key: str):
         # Make sure this isn't a read-only variable
@@ -84,10 +166,52 @@ class EnvironmentVarHolder(MutableMapping):
             )
 
         # Else, just delete it
-        del self._data[key]
+        if (index := SLOTS.get(key)) is None or self.load(index) is UNSET:
+            raise KeyError(key)
+        self.values[index] = UNSET
+
+    def __contains__(self, key: object) -> bool:
+        """Whether there's a variable with this name, including shell variables (like CWD) and ones
+        with a default value (like PATH)."""
+        if key in SHELL_VARS or key in DEFAULT_VALUES:
+            return True
+        return (index := SLOTS.get(key)) is not None and self.load(index) is not UNSET
 
     def __len__(self):
-        return len(self._data)
+        return sum(value is not UNSET for value in self.values)
 
     def __iter__(self):
-        return self._data.__iter__()
+        return iter([NAMES[i] for i, value in enumerate(self.values) if value is not UNSET])
+
+
+def getter(name: str) -> Callable[[EnvironmentVarHolder], Any]:
+    """Returns a function which reads a variable, like `env[name]`, with as much as possible worked
+    out up-front."""
+    if (provider := SHELL_VARS.get(name)) is not None:
+        return lambda _: provider.get()
+    index, default = slot(name), DEFAULT_VALUES.get(name, "")
+
+    def get(env: EnvironmentVarHolder) -> Any:
+        try:
+            value = env.values[index]
+        except IndexError:
+            return default
+        return default if value is UNSET else value
+
+    return get
+
+
+def setter(name: str) -> Callable[[EnvironmentVarHolder, Any], None]:
+    """Returns a function which sets a variable, like `env[name] = value`."""
+    if name in SHELL_VARS or name in CROSS_PLATFORM_MAPPINGS.get(os.name, {}) or name == "PATH":
+        # These need the extra checks in __setitem__
+        return lambda env, value: env.__setitem__(name, value)
+    index = slot(name)
+
+    def set_(env: EnvironmentVarHolder, value: Any):
+        try:
+            env.values[index] = value
+        except IndexError:
+            env.store(index, value)
+
+    return set_